@@ -0,0 +1,101 @@
+"""
+Benchmark of the batch simulator (see ddbatch.py).
+
+A program (by default example.dda) is assembled in memory and run for a number of stimuli (random presses of the \
+buttons and changes of the switches), once lane by lane with ddsim.Simulator and ddsim.Board and once in lockstep \
+with ddbatch.BatchSimulator. Idle loops are executed pass by pass (no fast-forwarding), so both execute the same \
+instructions. The throughput is reported in simulated instructions per second, over all lanes.
+
+USAGE: python benchmarks/bench_batch.py [program.dda] [number_of_lanes] [number_of_cycles] [repetitions]
+"""
+import os
+import sys
+import time
+import random
+
+package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, package_dir)
+
+import ddsim  # noqa: E402
+import ddbatch  # noqa: E402
+
+# Clock frequency of the benchmark (Hz): a low frequency puts several timer ticks in a short run
+clock_frequency = 100000
+
+
+def random_stimuli(number_of_lanes, seconds, seed=0):
+    """
+    :param number_of_lanes: Number of stimuli.
+    :param seconds: The simulated time (s).
+    :param seed: Seed of the random generator.
+    :return: A list of stimuli (see ddbatch.BatchSimulator).
+    """
+    rng = random.Random(seed)
+    stimuli = list()
+    for _ in range(number_of_lanes):
+        buttons = sorted((rng.uniform(0, seconds), rng.randrange(32)) for _ in range(rng.randint(0, 4)))
+        switches = sorted((rng.uniform(0, seconds), rng.randrange(65536)) for _ in range(rng.randint(0, 2)))
+        stimuli.append({'buttons': buttons, 'switches': switches})
+    return stimuli
+
+
+def run_lanes(image, stimuli, number_of_cycles):
+    """
+    :param image: The contents of the program ROM.
+    :param stimuli: The stimuli (see random_stimuli(...) ).
+    :param number_of_cycles: Number of clock cycles to simulate.
+    :return: The number of instructions, with every lane simulated by ddsim.Simulator and ddsim.Board.
+    """
+    instructions = 0
+    for stimulus in stimuli:
+        simulator = ddsim.Simulator(image, fast_forward=False)
+        board = ddsim.Board(simulator, clock_frequency)
+        for at, value in stimulus['buttons']:
+            board.press_buttons(at, value)
+        for at, value in stimulus['switches']:
+            board.flip_switches(at, value)
+        board.run(max_cycles=number_of_cycles)
+        instructions += simulator.instructions
+    return instructions
+
+
+def run_batch(image, stimuli, number_of_cycles):
+    """
+    :param image: The contents of the program ROM.
+    :param stimuli: The stimuli (see random_stimuli(...) ).
+    :param number_of_cycles: Number of clock cycles to simulate.
+    :return: The number of instructions, with the lanes simulated in lockstep by ddbatch.BatchSimulator.
+    """
+    batch = ddbatch.BatchSimulator(image, stimuli, clock_frequency=clock_frequency, fast_forward=False)
+    batch.run(number_of_cycles)
+    return int(batch.instructions.sum())
+
+
+def main(argv):
+    program_file = argv[1] if len(argv) > 1 else os.path.join(package_dir, 'example.dda')
+    number_of_lanes = int(argv[2]) if len(argv) > 2 else 256
+    number_of_cycles = int(argv[3]) if len(argv) > 3 else 100000
+    repetitions = int(argv[4]) if len(argv) > 4 else 3
+
+    if ddbatch.np is None:
+        print('The batch simulator requires NumPy.')
+        return
+    image, _ = ddsim.load_image(program_file, os.path.join(package_dir, 'ROM_template.vhd'))
+    stimuli = random_stimuli(number_of_lanes, number_of_cycles / clock_frequency)
+
+    print('program:      %s' % os.path.basename(program_file))
+    print('lanes:        %d' % number_of_lanes)
+    print('cycles:       %d' % number_of_cycles)
+    for mode, run in (('lane by lane', run_lanes), ('lockstep', run_batch)):
+        best = None
+        instructions = 0
+        for _ in range(repetitions):
+            start = time.perf_counter()
+            instructions = run(image, stimuli, number_of_cycles)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-13s %8.3f s  %10.0f instructions/s' % (mode + ':', best, instructions / best))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
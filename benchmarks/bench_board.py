@@ -0,0 +1,41 @@
+"""
+Benchmark of the simulated lab board (see ddsim.Board).
+
+A program (by default example.dda) is assembled in memory and run with its peripherals for a simulated time, once \
+without and once with the fast-forwarding of idle loops. The throughput is reported in simulated seconds per second.
+
+USAGE: python benchmarks/bench_board.py [program.dda] [simulated_seconds] [repetitions]
+"""
+import os
+import sys
+import time
+
+package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, package_dir)
+
+import ddsim  # noqa: E402
+
+
+def main(argv):
+    program_file = argv[1] if len(argv) > 1 else os.path.join(package_dir, 'example.dda')
+    seconds = float(argv[2]) if len(argv) > 2 else 2.0
+    repetitions = int(argv[3]) if len(argv) > 3 else 3
+
+    image, _ = ddsim.load_image(program_file, os.path.join(package_dir, 'ROM_template.vhd'))
+
+    print('program:      %s' % os.path.basename(program_file))
+    print('simulated:    %.3f s' % seconds)
+    for mode, fast_forward in (('step', False), ('fast-forward', True)):
+        best = None
+        for _ in range(repetitions):
+            simulator = ddsim.Simulator(image, fast_forward=fast_forward)
+            board = ddsim.Board(simulator)
+            start = time.perf_counter()
+            board.run(max_cycles=board.seconds_to_cycles(seconds))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print('%-13s %8.3f s  %10.2f simulated s/s' % (mode + ':', best, seconds / best))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
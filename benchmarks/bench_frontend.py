@@ -0,0 +1,76 @@
+"""
+Benchmark of the DDASM front end (tokenizing and analysing a program).
+
+A large program is generated by repeating a block of typical DDASM lines (labels, #defines, instructions with and \
+without operands, virtual instructions, comments). The throughput is reported in lines per second.
+
+USAGE: python benchmarks/bench_frontend.py [number_of_lines] [repetitions]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import ddasm  # noqa: E402
+
+
+def generate_source(number_of_lines):
+    """
+    Generate a (syntactically valid) DDASM program.
+
+    :param number_of_lines: Approximate number of lines of the program.
+    :return: The program text.
+    """
+    lines = ['; generated program', 'reset:', '\tjump setup', 'isr:', '\treti', 'setup:']
+    block = 0
+    while len(lines) < number_of_lines:
+        lines.extend([
+            '#define SYM_%d\tR%d\t; register alias' % (block, block % 8),
+            'label_%d:\t; a label' % block,
+            '\tmovl SYM_%d, %02X' % (block, block % 256),
+            '\tldr  R0, C1 ; read the interrupt flags',
+            '\tandl R0, 04',
+            '\tjz   label_%d' % block,
+            'inner_%d: inc R3' % block,
+            '\tcmpl R3, 3C\t; compare',
+            '\tmovr R1, R0',
+            '\tstr  F0, R1',
+            '',
+            '\tcall label_%d' % block,
+            '\tretc',
+        ])
+        block += 1
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv):
+    number_of_lines = int(argv[1]) if len(argv) > 1 else 200000
+    repetitions = int(argv[2]) if len(argv) > 2 else 3
+
+    source_text = generate_source(number_of_lines)
+    raw_text = ddasm.text_lines(source_text)
+    assembler = ddasm.Assembler()
+
+    best_tokenize = None
+    best_analyse = None
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        for _ in ddasm.tokenize_program(raw_text):
+            pass
+        elapsed = time.perf_counter() - start
+        best_tokenize = elapsed if best_tokenize is None else min(best_tokenize, elapsed)
+
+        assembler.log_lines = []
+        start = time.perf_counter()
+        assembler.analyse_program(source_text)
+        elapsed = time.perf_counter() - start
+        best_analyse = elapsed if best_analyse is None else min(best_analyse, elapsed)
+
+    print('lines:           %d' % len(raw_text))
+    print('tokenize:        %8.3f s  %10.0f lines/s' % (best_tokenize, len(raw_text) / best_tokenize))
+    print('analyse_program: %8.3f s  %10.0f lines/s' % (best_analyse, len(raw_text) / best_analyse))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,82 @@
+"""
+Memory benchmark of the intermediate representation of an analysed program.
+
+The compact representation (a list of Instruction records, see ddasm.py) is compared with the representation that \
+was used before: a dictionary keyed by source line, holding a dictionary per instruction.
+
+USAGE: python benchmarks/bench_ir_memory.py [number_of_instructions ...]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import ddasm  # noqa: E402
+from bench_frontend import generate_source  # noqa: E402
+
+
+def dictionary_program(raw_text):
+    """
+    Build the program the way it was represented before (one dictionary per instruction, keyed by source line).
+
+    :param raw_text: The lines of the program.
+    :return: The program dictionary.
+    """
+    program = dict()
+    address = 0
+    for token in ddasm.tokenize_program(raw_text):
+        if token[0] == 'instruction':
+            program[token[1]] = {'address': address,
+                                 'instruction': token[2],
+                                 'operand_1': token[3],
+                                 'operand_2': token[4],
+                                 'comment': ' -- ' + token[5] + '\n'}
+            address = address + 2
+    return program
+
+
+def compact_program(raw_text):
+    """
+    Build the compact program representation (as done by Assembler.analyse_program(...) ).
+
+    :param raw_text: The lines of the program.
+    :return: The list of instructions.
+    """
+    assembler = ddasm.Assembler()
+    return assembler.analyse_program(''.join(raw_text))['program']
+
+
+def retained_memory(build, raw_text):
+    """
+    Measure the memory that is held by the result of a build function.
+
+    :param build: Function that builds the program representation.
+    :param raw_text: The lines of the program.
+    :return: A tuple with the number of instructions and the retained memory in bytes.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    program = build(raw_text)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(program), after - before
+
+
+def main(argv):
+    sizes = [int(arg) for arg in argv[1:]] or [1000, 10000, 65536]
+
+    print('%12s  %14s  %14s  %6s' % ('instructions', 'dict (bytes)', 'compact (bytes)', 'ratio'))
+    for size in sizes:
+        # the generated program has about 10 instructions per 13 lines
+        raw_text = ddasm.text_lines(generate_source(size * 13 // 10))
+        count, dictionary_bytes = retained_memory(dictionary_program, raw_text)
+        _, compact_bytes = retained_memory(compact_program, raw_text)
+        print('%12d  %14d  %14d  %5.2fx' % (count, dictionary_bytes, compact_bytes, dictionary_bytes / compact_bytes))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,48 @@
+"""
+Benchmark of the DDASM instruction-set simulator.
+
+A program (by default example.dda) is assembled in memory and run for a number of instructions, once with the \
+interpreter (every instruction through the dispatch table) and once with basic-block translation (without the \
+fast-forwarding of idle loops, see bench_board.py), and both again with profiling (see ddsim.Profile). The throughput \
+is reported in simulated instructions and clock cycles per second.
+
+USAGE: python benchmarks/bench_simulator.py [program.dda] [number_of_instructions] [repetitions]
+"""
+import os
+import sys
+import time
+
+package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, package_dir)
+
+import ddsim  # noqa: E402
+
+
+def main(argv):
+    program_file = argv[1] if len(argv) > 1 else os.path.join(package_dir, 'example.dda')
+    number_of_instructions = int(argv[2]) if len(argv) > 2 else 5000000
+    repetitions = int(argv[3]) if len(argv) > 3 else 3
+
+    image, _ = ddsim.load_image(program_file, os.path.join(package_dir, 'ROM_template.vhd'))
+
+    print('program:      %s' % os.path.basename(program_file))
+    print('instructions: %d' % number_of_instructions)
+    for mode, translate, profile in (('interpret', False, False), ('translate', True, False),
+                                     ('interpret+p', False, True), ('translate+p', True, True)):
+        simulator = ddsim.Simulator(image, translate=translate, fast_forward=False, profile=profile)
+        best = None
+        cycles = 0
+        for _ in range(repetitions):
+            simulator.reset()
+            start = time.perf_counter()
+            simulator.run(number_of_instructions)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+                cycles = simulator.cycles
+        print('%-13s %8.3f s  %10.0f instructions/s  %10.0f cycles/s'
+              % (mode + ':', best, number_of_instructions / best, cycles / best))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,181 @@
+"""
+Benchmark suite of the DDASM assembler.
+
+Synthetic programs (see dda_generator.py) of 100 up to 1M instructions are assembled, with the ROM size raised to fit \
+the program. For every size, the following is measured:
+    - front end: load_program(...) (tokenizing and analysing the program)
+    - encoder:   generate_rom_file(...) (resolving, encoding and writing the VHDL file)
+    - cli:       a complete run of ddasm.py (in a separate process)
+    - memory:    peak memory of load_program(...) + generate_rom_file(...) (tracemalloc, in a separate run)
+
+The results are compared with a stored baseline (benchmarks/baseline.json). Times are compared as throughput, so \
+the ratios are > 1 when the assembler became faster.
+
+USAGE: python benchmarks/bench_suite.py [--sizes N,N,...] [--repetitions N] [--baseline FILE] [--save-baseline]
+"""
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import subprocess
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+package_dir = os.path.join(benchmarks_dir, os.pardir)
+sys.path.insert(0, package_dir)
+
+import ddasm  # noqa: E402
+from dda_generator import generate_program  # noqa: E402
+
+default_sizes = [100, 1000, 10000, 100000, 1000000]
+default_baseline = os.path.join(benchmarks_dir, 'baseline.json')
+
+
+def rom_addr_width(number_of_instructions):
+    """
+    :param number_of_instructions: Number of instructions of the program.
+    :return: The smallest address width (at least 7, as in ROM_template.vhd) of a ROM that fits the program.
+    """
+    return max(7, (2 * number_of_instructions - 1).bit_length())
+
+
+def best_time(function, repetitions):
+    """
+    :param function: The function to time (without arguments).
+    :param repetitions: Number of repetitions.
+    :return: The best wall time (in seconds).
+    """
+    best = None
+    for _ in range(repetitions):
+        gc.collect()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_size(number_of_instructions, repetitions, work_dir):
+    """
+    Benchmark the assembler for one program size.
+
+    :param number_of_instructions: Number of instructions of the synthetic program.
+    :param repetitions: Number of repetitions (the best time is kept).
+    :param work_dir: Directory for the programs and ROM files (contains ROM_template.vhd).
+    :return: A dictionary with the results.
+    """
+    input_file = os.path.join(work_dir, 'synthetic_%d.dda' % number_of_instructions)
+    output_file = os.path.join(work_dir, 'synthetic_%d.vhd' % number_of_instructions)
+    template_file = os.path.join(work_dir, 'ROM_template.vhd')
+    with open(input_file, 'w') as f:
+        f.write(generate_program(number_of_instructions))
+    addr_width = rom_addr_width(number_of_instructions)
+
+    frontend = best_time(lambda: ddasm.load_program(input_file), repetitions)
+
+    pinfo = ddasm.load_program(input_file)
+    rom = ddasm.load_template(template_file, output_file, addr_width)
+    encoder = best_time(lambda: ddasm.generate_rom_file(pinfo, rom, output_file), repetitions)
+    del pinfo, rom
+
+    command = [sys.executable, os.path.join(package_dir, 'ddasm.py'), input_file, output_file,
+               '--addr-width', str(addr_width), '--quiet', '--log-file', 'none', '--no-cache']
+
+    def run_cli():
+        subprocess.run(command, cwd=work_dir, check=True, stdout=subprocess.DEVNULL)
+    cli = best_time(run_cli, repetitions)
+
+    gc.collect()
+    tracemalloc.start()
+    ddasm.generate_rom_file(ddasm.load_program(input_file),
+                            ddasm.load_template(template_file, output_file, addr_width), output_file)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    os.remove(input_file)
+    os.remove(output_file)
+
+    return {'instructions': number_of_instructions, 'addr_width': addr_width, 'frontend': frontend,
+            'encoder': encoder, 'cli': cli, 'peak_memory': peak_memory}
+
+
+def format_results(results, baseline):
+    """
+    :param results: The list of results (see run_size(...) ).
+    :param baseline: The results of the baseline (a dictionary keyed by number of instructions, may be empty).
+    :return: The results as a table.
+    """
+    table = ['%12s | %16s | %16s | %16s | %12s' % ('instructions', 'front end (i/s)', 'encoder (i/s)', 'cli (i/s)',
+                                                   'memory (kB)')]
+    for result in results:
+        count = result['instructions']
+        reference = baseline.get(str(count))
+        columns = ['%12d' % count]
+        for phase in ('frontend', 'encoder', 'cli'):
+            throughput = count / result[phase]
+            if reference is None:
+                columns.append('%16.0f' % throughput)
+            else:
+                columns.append('%9.0f x%5.2f' % (throughput, reference[phase] / result[phase]))
+        memory = result['peak_memory'] // 1024
+        if reference is None:
+            columns.append('%12d' % memory)
+        else:
+            columns.append('%6d x%5.2f' % (memory, result['peak_memory'] / reference['peak_memory']))
+        table.append(' | '.join(columns))
+    return '\n'.join(table)
+
+
+def main(argv):
+    args = argv[1:]
+    sizes = default_sizes
+    repetitions = 3
+    baseline_file = default_baseline
+    save_baseline = False
+    while args:
+        option = args.pop(0)
+        if option == '--sizes':
+            sizes = [int(size) for size in args.pop(0).split(',')]
+        elif option == '--repetitions':
+            repetitions = int(args.pop(0))
+        elif option == '--baseline':
+            baseline_file = args.pop(0)
+        elif option == '--save-baseline':
+            save_baseline = True
+        else:
+            print(__doc__.strip().splitlines()[-1])
+            return -1
+
+    baseline = dict()
+    if not save_baseline and os.path.isfile(baseline_file):
+        with open(baseline_file) as f:
+            baseline = json.load(f)['results']
+
+    work_dir = tempfile.mkdtemp(prefix='ddasm_bench_')
+    try:
+        shutil.copy(os.path.join(package_dir, 'ROM_template.vhd'), work_dir)
+        results = list()
+        for size in sizes:
+            # the largest programs are only assembled once
+            results.append(run_size(size, repetitions if size <= 100000 else 1, work_dir))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if baseline:
+        print('Compared with ' + baseline_file + ' (throughput: x > 1 is faster, memory: x < 1 is smaller)')
+    print(format_results(results, baseline))
+
+    if save_baseline:
+        with open(baseline_file, 'w') as f:
+            json.dump({'python': sys.version.split()[0],
+                       'results': {str(result['instructions']): result for result in results}}, f, indent=2)
+            f.write('\n')
+        print('Baseline saved to ' + baseline_file + '.')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
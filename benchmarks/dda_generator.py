@@ -0,0 +1,134 @@
+"""
+Generator of synthetic (valid) DDASM programs for the benchmarks.
+
+A program is parameterized by its number of instructions, the density of labels, the number of #defines and the mix \
+of instruction types (the types of asminfo.py). Jumps only target labels that can be reached with an 8-bit jump \
+address, so even very large programs assemble (given a ROM that is large enough, see --addr-width of ddasm.py).
+
+USAGE: python benchmarks/dda_generator.py number_of_instructions output.dda [label_density] [defines] [seed]
+"""
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from asminfo import asminfo  # noqa: E402
+
+# Default mix of instruction types (relative weights)
+default_mix = {
+    'x_to_register': 35,
+    'register_to_register': 20,
+    'single_register': 10,
+    'register_to_memory': 8,
+    'indirect_memory': 5,
+    'jump_conditional': 10,
+    'jump': 7,
+    'jump_no_address': 5
+}
+
+# Mnemonics of every instruction type
+mnemonics = dict()
+for mnemonic, instruction in asminfo['instructions'].items():
+    mnemonics.setdefault(instruction['type'], []).append(mnemonic)
+
+
+def generate_program(number_of_instructions, label_density=0.05, defines=16, mix=None, seed=0):
+    """
+    Generate a DDASM program.
+
+    :param number_of_instructions: Number of instructions of the program (at least 3: reset and isr vectors).
+    :param label_density: Probability that an instruction is preceded by a label.
+    :param defines: Number of #define directives (register aliases and constants).
+    :param mix: (optional) Dictionary with the relative weight of every instruction type (see default_mix).
+    :param seed: Seed of the random generator (the same parameters always give the same program).
+    :return: The program text.
+    """
+    rng = random.Random(seed)
+    mix = default_mix if mix is None else mix
+    types = [t for t in mix if mix[t] > 0]
+    weights = [mix[t] for t in types]
+
+    lines = ['; synthetic program: %d instructions, label density %.3f, %d defines, seed %d'
+             % (number_of_instructions, label_density, defines, seed)]
+
+    # register aliases and constants
+    register_symbols = list()
+    constant_symbols = list()
+    for index in range(defines):
+        if index % 2 == 0:
+            name = 'reg_%d' % index
+            lines.append('#define %s r%d' % (name, rng.randrange(8)))
+            register_symbols.append(name)
+        else:
+            name = 'const_%d' % index
+            lines.append('#define %s %02X' % (name, rng.randrange(256)))
+            constant_symbols.append(name)
+
+    def register():
+        if register_symbols and rng.random() < 0.2:
+            return rng.choice(register_symbols)
+        return 'r%d' % rng.randrange(8)
+
+    def literal():
+        if constant_symbols and rng.random() < 0.2:
+            return rng.choice(constant_symbols)
+        return '%02X' % rng.randrange(256)
+
+    def memory_address():
+        return '%02X' % rng.randrange(0x80, 0x100)
+
+    # reset and interrupt vectors
+    lines.extend(['reset:', '\tjmp setup', 'isr:', '\treti', 'setup:'])
+    # labels with an 8-bit address can be used as jump target
+    targets = ['reset', 'isr', 'setup']
+    label_count = 0
+
+    for address in range(4, 2 * number_of_instructions, 2):
+        if rng.random() < label_density:
+            label = 'label_%d' % label_count
+            label_count += 1
+            lines.append(label + ':')
+            if address <= 0xfe:
+                targets.append(label)
+
+        instruction_type = rng.choices(types, weights)[0]
+        mnemonic = rng.choice(mnemonics[instruction_type])
+        if instruction_type in ('jump', 'jump_conditional'):
+            line = '%s %s' % (mnemonic, rng.choice(targets))
+        elif instruction_type == 'jump_no_address':
+            line = mnemonic
+        elif instruction_type == 'single_register':
+            line = '%s %s' % (mnemonic, register())
+        elif instruction_type in ('register_to_register', 'indirect_memory'):
+            line = '%s %s, %s' % (mnemonic, register(), register())
+        elif instruction_type == 'register_to_memory':
+            line = '%s %s, %s' % (mnemonic, memory_address(), register())
+        elif mnemonic == 'ldr':
+            line = '%s %s, %s' % (mnemonic, register(), memory_address())
+        else:
+            line = '%s %s, %s' % (mnemonic, register(), literal())
+
+        if rng.random() < 0.1:
+            line += '\t; comment'
+        lines.append('\t' + line)
+
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv):
+    if len(argv) < 3:
+        print(__doc__.strip().splitlines()[-1])
+        return -1
+    number_of_instructions = int(argv[1])
+    label_density = float(argv[3]) if len(argv) > 3 else 0.05
+    defines = int(argv[4]) if len(argv) > 4 else 16
+    seed = int(argv[5]) if len(argv) > 5 else 0
+
+    with open(argv[2], 'w') as f:
+        f.write(generate_program(number_of_instructions, label_density, defines, seed=seed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
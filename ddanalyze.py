@@ -0,0 +1,598 @@
+"""
+Static analysis of a DDA program for the LDD mark II processor: the worst-case clock cycles of every routine, the \
+worst-case interrupt latency and the maximum depth of the stack, computed on the control-flow graph of the program \
+(without running it). Loops need a bound, given as a comment annotation ("; @bound N"). The results are printed and \
+written to a cycle-annotated listing.
+DDASM = Digital Design Assmebly
+LDD = Lab Digital Design
+Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
+"""
+import os
+import re
+import sys
+import math
+import logging
+from ddasm import Assembler, encoding_tables, pop_option, positive_number, setup_logging, close_logging, logger, \
+    text_lines
+from ddsim import instruction_cycles, default_stack_depth, default_clock_frequency
+
+# Loop bound annotation in a comment: the loop header that follows it (on the same line or the next instruction) is \
+# executed at most N times (decimal) every time the loop is entered
+bound_pattern = re.compile(r';.*@bound\s+(\d+)', re.IGNORECASE)
+
+# Mnemonics of the conditional jumps (jz, jc, je, jg, js)
+conditional_jumps = {mnemonic for mnemonic, (instruction_type, _) in encoding_tables['instructions'].items()
+                     if instruction_type == 'jump_conditional'}
+
+# Instructions that leave a routine
+return_instructions = ('retc', 'reti')
+
+# Clock cycles of a routine (or loop) that has no upper bound
+unbounded = math.inf
+
+
+def main(argv):
+    """
+    Analyse a program.
+
+    :param argv: The list of command line arguments passed to this script.
+    :return: The script returns exit code 0 if the program meets its limits; -1 otherwise.
+    """
+    args = list(argv[1:])
+    try:
+        listing_file = pop_option(args, '--listing', str)
+        deadline = pop_option(args, '--deadline', positive_number)
+        stack_depth = pop_option(args, '--stack-depth', positive_number) or default_stack_depth
+        clock_frequency = pop_option(args, '--clock', positive_number) or default_clock_frequency
+    except ValueError:
+        print('ERROR: "--deadline", "--stack-depth" and "--clock" expect a positive number and "--listing" a file '
+              'name.')
+        print_usage()
+        return -1
+    if len(args) != 1 or not args[0].lower().endswith('.dda'):
+        print('ERROR: Expecting 1 DDA program.')
+        print_usage()
+        return -1
+    if listing_file is None:
+        listing_file = os.path.splitext(args[0])[0] + '.lst'
+
+    handlers = setup_logging({'console_level': logging.WARNING, 'log_level': logging.WARNING, 'log_file': None})
+    try:
+        assembler = Assembler(logger=logger)
+        pinfo = assembler.load_program(args[0])
+        # the jump targets are needed, not the encoding
+        assembler.resolve_program(pinfo)
+        with open(args[0]) as f:
+            source_lines = text_lines(f.read())
+    except (IOError, ValueError) as e:
+        print('ERROR: Failed to load ' + args[0] + (' (' + str(e) + ').' if str(e) else '.'))
+        return -1
+    finally:
+        close_logging(handlers)
+
+    analysis = ProgramAnalysis(pinfo, source_lines)
+    summary = analysis.summary()
+    print(analysis.format_report(clock_frequency, stack_depth))
+    try:
+        with open(listing_file, 'w') as f:
+            f.write(analysis.annotate_source())
+    except IOError:
+        print('ERROR: Failed to write the listing (' + listing_file + ').')
+        return -1
+    print('Cycle-annotated listing written to ' + listing_file + '.')
+
+    success = True
+    if summary['stack'] == unbounded:
+        print('ERROR: The stack may grow without bound (see the problems of the routines).')
+        success = False
+    elif summary['stack'] > stack_depth:
+        print('ERROR: The program may need %d stack entries (the stack holds %d).' % (summary['stack'], stack_depth))
+        success = False
+    if summary['latency'] is not None:
+        if summary['latency'] == unbounded:
+            print('ERROR: The interrupt latency has no bound (see the problems of the routines).')
+            success = False
+        elif deadline is not None and summary['latency'] > deadline:
+            print('ERROR: The worst-case interrupt latency (%d cycles) exceeds the deadline (%d cycles).'
+                  % (summary['latency'], deadline))
+            success = False
+    return 0 if success else -1
+
+
+def print_usage():
+    """
+    Print an informational message on how to use the analyzer.
+
+    :return: Nothing
+    """
+    print('USAGE: python ddanalyze.py program.dda [--listing FILE] [--deadline N] [--stack-depth N] [--clock HZ]')
+    print(' * program.dda      : DDA program to analyse.')
+    print(' * --listing FILE   : (optional) The cycle-annotated listing (default: program.lst).')
+    print(' * --deadline N     : (optional) Fail if the worst-case interrupt latency exceeds N clock cycles.')
+    print(' * --stack-depth N  : (optional) Number of entries of the stack (default: %d).' % default_stack_depth)
+    print(' * --clock HZ       : (optional) Clock frequency of the processor, for the latency in seconds (default: '
+          '100000000).')
+
+
+class ProgramAnalysis:
+    """
+    Control-flow graph of a program, and the worst-case analysis of its routines.
+
+    Every instruction is a node of the graph. A routine starts at reset (00), at isr (02) or at the target of a call, \
+    and ends at retc or reti; a call is a single node that costs the call and the worst case of the routine it \
+    calls. Loops are found as the natural loops of the back edges (a jump to an instruction that dominates it). A \
+    loop is collapsed into its header, innermost loop first: an iteration costs the longest path through the loop \
+    body, and the header is executed at most bound times (see bound_pattern). The worst case of a routine is then \
+    the longest path through the remaining acyclic graph, from the entry to a return.
+    """
+
+    def __init__(self, pinfo, source_lines):
+        """
+        :param pinfo: A dictionary containing the analysed program, with resolved operands (provided by \
+                      ddasm.load_program(...) and ddasm.Assembler.resolve_program(...) ).
+        :param source_lines: The lines of the program.
+        """
+        self.pinfo = pinfo
+        self.source_lines = source_lines
+        self.instructions = {instruction.address: instruction for instruction in pinfo['program']}
+        self.labels = dict()
+        for label, address in pinfo['labels'].items():
+            self.labels.setdefault(int(address, 16), list()).append(label)
+        self.bounds = self.read_bounds()
+
+        # the successors of every instruction within its routine (a call continues after the call)
+        self.successors = dict()
+        self.calls = dict()
+        for instruction in pinfo['program']:
+            address = instruction.address
+            mnemonic = instruction.instruction
+            target = instruction.values[0]
+            if mnemonic == 'jmp':
+                successors = [target]
+            elif mnemonic in conditional_jumps:
+                successors = [target] if target == address + 2 else [target, address + 2]
+            elif mnemonic in return_instructions:
+                successors = []
+            else:
+                if mnemonic == 'call':
+                    self.calls[address] = target
+                successors = [address + 2]
+            self.successors[address] = successors
+
+        self.routines = dict()
+        for entry in [0, 2] + sorted(set(self.calls.values())):
+            if entry in self.instructions and (entry != 2 or 'isr' in self.labels.get(2, ())):
+                self.analyse_routine(entry)
+
+    def read_bounds(self):
+        """
+        :return: A dictionary with the loop bound of every instruction that is annotated (see bound_pattern).
+        """
+        bounds = dict()
+        first_line = 0
+        for instruction in self.pinfo['program']:
+            # an annotation applies to the next instruction
+            for line_index in range(first_line, instruction.line + 1):
+                match = bound_pattern.search(self.source_lines[line_index])
+                if match:
+                    bounds[instruction.address] = int(match.group(1))
+            first_line = instruction.line + 1
+        return bounds
+
+    def routine_name(self, address):
+        """
+        :param address: The address of an instruction.
+        :return: The labels of the instruction, or its address if it has none.
+        """
+        return ', '.join(self.labels.get(address, ['%02X' % address]))
+
+    def line_number(self, address):
+        """
+        :param address: The address of an instruction.
+        :return: Its line number in the program.
+        """
+        return self.instructions[address].line + 1
+
+    def analyse_routine(self, entry):
+        """
+        Compute the worst case of a routine (memoized; the routines that it calls are analysed first).
+
+        :param entry: The address of the first instruction of the routine.
+        :return: A dictionary: 'name', 'entry', 'cycles' (the worst case from the entry up to and including the \
+                 return, unbounded if there is none), 'stack' (the maximum number of entries that it adds to the \
+                 stack, including the routines that it calls), 'loops' (a dictionary with the header -> (bound, \
+                 worst-case cycles of an iteration) of every loop) and 'problems' (a list of descriptions).
+        """
+        routine = self.routines.get(entry)
+        if routine is not None:
+            if routine['cycles'] is None:
+                # the routine is being analysed: it calls itself
+                routine['problems'].append('Recursive call of %s.' % routine['name'])
+                return {'cycles': unbounded, 'stack': unbounded}
+            return routine
+        routine = {'name': self.routine_name(entry), 'entry': entry, 'cycles': None, 'stack': 0, 'loops': dict(),
+                   'problems': list()}
+        self.routines[entry] = routine
+        problems = routine['problems']
+
+        # the instructions of the routine
+        nodes = [entry]
+        reached = {entry}
+        exits = list()
+        for address in nodes:
+            if self.instructions[address].instruction in return_instructions:
+                exits.append(address)
+            for successor in self.successors[address]:
+                if successor not in self.instructions:
+                    problems.append('Line %d continues at %02X, outside the program.'
+                                    % (self.line_number(address), successor))
+                    exits.append(address)
+                elif successor not in reached:
+                    reached.add(successor)
+                    nodes.append(successor)
+        successors = {address: [successor for successor in self.successors[address] if successor in reached]
+                      for address in nodes}
+
+        # the cost of every node
+        cost = dict()
+        callee_stack = dict()
+        for address in nodes:
+            mnemonic = self.instructions[address].instruction
+            cost[address] = instruction_cycles[mnemonic]
+            if mnemonic == 'call':
+                target = self.calls[address]
+                if target not in self.instructions:
+                    problems.append('Line %d calls %02X, outside the program.' % (self.line_number(address), target))
+                    cost[address] = unbounded
+                    callee_stack[address] = 0
+                    continue
+                callee = self.analyse_routine(target)
+                cost[address] += callee['cycles']
+                callee_stack[address] = callee['stack']
+
+        routine['stack'] = self.stack_depth(entry, nodes, successors, callee_stack, problems)
+        routine['cycles'] = self.worst_case(entry, nodes, successors, cost, exits, routine)
+        return routine
+
+    def worst_case(self, entry, nodes, successors, cost, exits, routine):
+        """
+        Compute the worst-case clock cycles of a routine (see analyse_routine(...) ).
+
+        :return: The clock cycles (unbounded if the routine has an unbounded loop or no return).
+        """
+        problems = routine['problems']
+        loops = natural_loops(entry, nodes, successors)
+        back_edges = {(source, header) for header, (sources, _) in loops.items() for source in sources}
+        if topological_order(nodes, {address: [successor for successor in successors[address]
+                                               if (address, successor) not in back_edges]
+                                     for address in nodes}) is None:
+            problems.append('Loop with more than one entry (irreducible) in %s.' % routine['name'])
+            return unbounded
+
+        # representative of every node: the header of the outermost loop that has been collapsed around it
+        representatives = {address: address for address in nodes}
+
+        def find(node):
+            while representatives[node] != node:
+                node = representatives[node]
+            return node
+
+        for header, (_, body) in sorted(loops.items(), key=lambda loop: len(loop[1][1])):
+            iteration = longest_path(header, {find(address) for address in body},
+                                     [(find(address), find(successor)) for address in body
+                                      for successor in successors[address] if successor in body], cost)
+            bound = self.bounds.get(header)
+            if bound is None:
+                if routine['entry'] != 0:
+                    problems.append('Loop at line %d (%s) has no bound (annotate it with "; @bound N").'
+                                    % (self.line_number(header), self.routine_name(header)))
+                total = unbounded
+            else:
+                total = bound * iteration
+            routine['loops'][header] = (bound, iteration)
+            for address in body:
+                representatives[find(address)] = header
+            cost[header] = total
+
+        distances = longest_path(entry, {find(address) for address in nodes},
+                                 [(find(address), find(successor)) for address in nodes
+                                  for successor in successors[address]], cost, all_distances=True)
+        if not exits:
+            return unbounded
+        return max(distances.get(find(address), 0) for address in exits)
+
+    def stack_depth(self, entry, nodes, successors, callee_stack, problems):
+        """
+        Compute the maximum number of stack entries that a routine adds (see analyse_routine(...) ). The depth \
+        before every instruction is propagated along the control-flow graph: push adds an entry, pop removes one and \
+        a call adds the entries of the call and of the routine it calls while it runs.
+
+        :return: The maximum number of entries (unbounded if a loop pushes more than it pops).
+        """
+        depths = {entry: 0}
+        work = [entry]
+        deepest = 0
+        limit = len(nodes) + 1
+        reported = set()
+        while work:
+            address = work.pop()
+            depth = depths[address]
+            mnemonic = self.instructions[address].instruction
+            after = depth
+            if mnemonic == 'push':
+                after = depth + 1
+            elif mnemonic == 'pop':
+                after = depth - 1
+                if after < 0 and address not in reported:
+                    problems.append('Line %d pops more entries than the routine pushed.' % self.line_number(address))
+                    reported.add(address)
+            elif mnemonic == 'call':
+                deepest = max(deepest, depth + 1 + callee_stack[address])
+            elif mnemonic in return_instructions and depth != 0 and address not in reported:
+                problems.append('Line %d returns with entries that the routine pushed on the stack (%d).'
+                                % (self.line_number(address), depth))
+                reported.add(address)
+            deepest = max(deepest, after)
+            if after > limit:
+                problems.append('The stack grows in a loop (line %d).' % self.line_number(address))
+                return unbounded
+            for successor in successors[address]:
+                if successor not in depths or depths[successor] < after:
+                    depths[successor] = after
+                    work.append(successor)
+        return deepest
+
+    def summary(self):
+        """
+        :return: A dictionary: 'isr' (the worst case of the interrupt service routine, from 02 up to and including \
+                 reti; None if the program has no isr), 'wait' (the longest instruction of the main program, that \
+                 an interrupt waits for), 'latency' (the sum of both, None without isr) and 'stack' (the maximum \
+                 number of stack entries: the main program, the return address of an interrupt and the isr).
+        """
+        main_routine = self.routines.get(0)
+        isr = self.routines.get(2)
+        stack = main_routine['stack'] if main_routine else 0
+        wait = max((instruction_cycles[self.instructions[address].instruction]
+                    for address in self.reachable(0)), default=0)
+        if isr is None:
+            return {'isr': None, 'wait': wait, 'latency': None, 'stack': stack}
+        return {'isr': isr['cycles'], 'wait': wait, 'latency': wait + isr['cycles'],
+                'stack': stack + 1 + isr['stack']}
+
+    def reachable(self, entry):
+        """
+        :param entry: The address of an instruction.
+        :return: The addresses of the instructions that can be executed from it (following calls).
+        """
+        if entry not in self.instructions:
+            return set()
+        reached = {entry}
+        work = [entry]
+        while work:
+            address = work.pop()
+            for successor in self.successors[address] + ([self.calls[address]] if address in self.calls else []):
+                if successor in self.instructions and successor not in reached:
+                    reached.add(successor)
+                    work.append(successor)
+        return reached
+
+    def format_report(self, clock_frequency=default_clock_frequency, stack_depth=default_stack_depth):
+        """
+        Format the results: the worst case of every routine, the interrupt latency, the stack depth and the problems.
+
+        :param clock_frequency: The clock frequency of the processor (Hz).
+        :param stack_depth: The number of entries of the stack.
+        :return: The report (string).
+        """
+        lines = ['Routines (worst case):', '%12s %6s  %5s  %s' % ('cycles', 'stack', 'line', 'routine')]
+        for entry in sorted(self.routines):
+            routine = self.routines[entry]
+            lines.append('%12s %6s  %5d  %s' % (format_cycles(routine['cycles']), format_cycles(routine['stack']),
+                                                self.line_number(entry), routine['name']))
+        summary = self.summary()
+        lines.append('')
+        if summary['isr'] is None:
+            lines.append('Interrupt latency: no isr.')
+        else:
+            latency = summary['latency']
+            lines.append('Interrupt latency: %s cycles (isr at 02 up to reti: %s, interrupted instruction: up to %d)'
+                         % (format_cycles(latency), format_cycles(summary['isr']), summary['wait'])
+                         + ('' if latency == unbounded else ', %.2f us at %d Hz' % (1e6 * latency / clock_frequency,
+                                                                                    clock_frequency)))
+        lines.append('Stack depth:       %s of %d entries' % (format_cycles(summary['stack']), stack_depth))
+        problems = [problem for entry in sorted(self.routines) for problem in self.routines[entry]['problems']]
+        if problems:
+            lines.append('')
+            lines.append('Problems:')
+            lines.extend(' * ' + problem for problem in problems)
+        return '\n'.join(lines)
+
+    def annotate_source(self):
+        """
+        Annotate the lines of the program: the address and the clock cycles of every instruction (a call adds the \
+        worst case of the routine it calls). The worst case and the stack depth of every routine and the bound of \
+        every loop are inserted as comment lines (";;").
+
+        :return: The annotated source (string).
+        """
+        loops = dict()
+        for routine in self.routines.values():
+            loops.update(routine['loops'])
+        by_line = {instruction.line: instruction for instruction in self.pinfo['program']}
+        lines = ['%4s %14s | %s' % ('addr', 'cycles', 'source')]
+        for index, source_line in enumerate(self.source_lines):
+            instruction = by_line.get(index)
+            if instruction is None:
+                lines.append('%4s %14s | %s' % ('', '', source_line.rstrip('\n')))
+                continue
+            # the results of a routine or a loop precede its first instruction
+            address = instruction.address
+            routine = self.routines.get(address)
+            if routine is not None:
+                lines.append('%4s %14s | ;; routine %s: %s cycles worst case, stack %s'
+                             % ('', '', routine['name'], format_cycles(routine['cycles']),
+                                format_cycles(routine['stack'])))
+            if address in loops:
+                bound, iteration = loops[address]
+                lines.append('%4s %14s | ;; loop: %s iterations of %s cycles worst case'
+                             % ('', '', 'no bound on the' if bound is None else bound, format_cycles(iteration)))
+            cycles = str(instruction_cycles[instruction.instruction])
+            if address in self.calls:
+                callee = self.routines.get(self.calls[address])
+                cycles += '+' + format_cycles(unbounded if callee is None else callee['cycles'])
+            lines.append('%02X %16s | %s' % (address, cycles, source_line.rstrip('\n')))
+        return '\n'.join(lines) + '\n'
+
+
+def natural_loops(entry, nodes, successors):
+    """
+    Find the natural loops of a control-flow graph.
+
+    :param entry: The entry node.
+    :param nodes: The nodes, reachable from the entry (entry first).
+    :param successors: A dictionary with the list of successors of every node.
+    :return: A dictionary with the loop header -> (the sources of its back edges, the set of nodes of the loop).
+    """
+    dominators = immediate_dominators(entry, nodes, successors)
+    predecessors = {address: list() for address in nodes}
+    for address in nodes:
+        for successor in successors[address]:
+            predecessors[successor].append(address)
+
+    loops = dict()
+    for address in nodes:
+        for successor in successors[address]:
+            # a back edge goes to a node that dominates its source
+            dominator = address
+            while dominator != successor and dominator != entry:
+                dominator = dominators[dominator]
+            if dominator != successor:
+                continue
+            sources, body = loops.setdefault(successor, (list(), {successor}))
+            sources.append(address)
+            work = [address]
+            while work:
+                node = work.pop()
+                if node not in body:
+                    body.add(node)
+                    work.extend(predecessors[node])
+    return loops
+
+
+def immediate_dominators(entry, nodes, successors):
+    """
+    Compute the immediate dominator of every node (the iterative algorithm of Cooper, Harvey and Kennedy).
+
+    :param entry: The entry node (see natural_loops(...) for the parameters).
+    :return: A dictionary with the immediate dominator of every node (the entry dominates itself).
+    """
+    # reverse postorder
+    order = list()
+    visited = {entry}
+    stack = [(entry, iter(successors[entry]))]
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            if child not in visited:
+                visited.add(child)
+                stack.append((child, iter(successors[child])))
+                break
+        else:
+            stack.pop()
+            order.append(node)
+    order.reverse()
+    position = {node: index for index, node in enumerate(order)}
+    predecessors = {node: list() for node in nodes}
+    for node in nodes:
+        for successor in successors[node]:
+            predecessors[successor].append(node)
+
+    dominators = {entry: entry}
+    changed = True
+    while changed:
+        changed = False
+        for node in order[1:]:
+            new_dominator = None
+            for predecessor in predecessors[node]:
+                if predecessor not in dominators:
+                    continue
+                if new_dominator is None:
+                    new_dominator = predecessor
+                    continue
+                # intersect
+                first, second = predecessor, new_dominator
+                while first != second:
+                    while position[first] > position[second]:
+                        first = dominators[first]
+                    while position[second] > position[first]:
+                        second = dominators[second]
+                new_dominator = first
+            if dominators.get(node) != new_dominator:
+                dominators[node] = new_dominator
+                changed = True
+    return dominators
+
+
+def topological_order(nodes, successors):
+    """
+    :param nodes: The nodes of a directed graph.
+    :param successors: A dictionary with the list of successors of every node.
+    :return: The nodes in topological order, or None if the graph has a cycle.
+    """
+    incoming = {node: 0 for node in nodes}
+    for node in nodes:
+        for successor in successors[node]:
+            incoming[successor] += 1
+    ready = [node for node in nodes if not incoming[node]]
+    order = list()
+    while ready:
+        node = ready.pop()
+        order.append(node)
+        for successor in successors[node]:
+            incoming[successor] -= 1
+            if not incoming[successor]:
+                ready.append(successor)
+    return order if len(order) == len(incoming) else None
+
+
+def longest_path(start, nodes, edges, cost, all_distances=False):
+    """
+    Compute the longest path from a node through an acyclic graph (edges back to the start and self-loops, which \
+    are the back edges of the collapsed loops, are left out).
+
+    :param start: The first node.
+    :param nodes: The set of nodes.
+    :param edges: A list of (source, destination) tuples.
+    :param cost: A dictionary with the cost of every node.
+    :param all_distances: Setting all_distances to True returns the distances instead of the longest one.
+    :return: The cost of the longest path (the cost of every node on it), or a dictionary with the cost of the \
+             longest path to every node that can be reached.
+    """
+    successors = {node: set() for node in nodes}
+    for source, destination in edges:
+        if source != destination and destination != start:
+            successors[source].add(destination)
+    order = topological_order(nodes, successors)
+    distances = {start: cost[start]}
+    for node in order:
+        if node not in distances:
+            continue
+        for successor in successors[node]:
+            distance = distances[node] + cost[successor]
+            if distances.get(successor, -1) < distance:
+                distances[successor] = distance
+    if all_distances:
+        return distances
+    return max(distances.values())
+
+
+def format_cycles(value):
+    """
+    :param value: A number of clock cycles or stack entries.
+    :return: The number (string), "unbounded" if it has no bound.
+    """
+    return 'unbounded' if value == unbounded else '%d' % value
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
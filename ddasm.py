@@ -5,12 +5,36 @@ DDASM = Digital Design Assmebly
 LDD = Lab Digital Design
 Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
 """
+import io
+import os
+import re
 import sys
+import glob
+import json
+import stat
+import filecmp
+import hashlib
+import tempfile
+import time
+import cProfile
 import logging
+import tracemalloc
+import contextlib
+import threading
+import multiprocessing
 from asminfo import asminfo
-from datetime import datetime
+from datetime import datetime, timezone
 
-log_file = None
+# Version of the assembler (also part of the key of the build cache)
+version = 'DDASM v0.1'
+
+# Logger of the assembler (the command line tool attaches its handlers to it)
+logger = logging.getLogger('ddasm')
+logger.addHandler(logging.NullHandler())
+
+# Log level of the per-instruction trace (below DEBUG)
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
 
 
 def main(argv):
@@ -20,697 +44,2875 @@ def main(argv):
         2) loading a ROM template file
         3) generating the ROM and writing to a VHDL file
 
-    :param argv: The list of command line arguments passed to this script.
-    :return: The script returns exit code 0 on success; -1 otherwise.
+    :param argv: The list of command line arguments passed to this script.
+    :return: The script returns exit code 0 on success; -1 otherwise.
+    """
+    # Batch mode does not use the shared build log
+    if len(argv) > 1 and argv[1] == '--batch':
+        sys.exit(batch_main(argv))
+
+    argv = list(argv)
+    try:
+        log_options = get_log_options(argv)
+    except ValueError:
+        print('ERROR: "--log-file" expects a file name (or "none").')
+        print_usage()
+        print('FAILURE')
+        sys.exit(-1)
+    try:
+        stats_file = pop_option(argv, '--stats', str)
+        profile_file = pop_option(argv, '--profile', str)
+    except ValueError:
+        print('ERROR: "--stats" and "--profile" expect a file name.')
+        print_usage()
+        print('FAILURE')
+        sys.exit(-1)
+
+    try:
+        handlers = setup_logging(log_options)
+    except IOError as ioe:
+        print('Failed to open log file (' + log_options['log_file'] + '). Is it still open?')
+        print(ioe.args[1])
+        print('FAILURE')
+        sys.exit(-1)
+
+    stats = BuildStats(trace_memory=True) if stats_file is not None else None
+    profiler = cProfile.Profile() if profile_file is not None else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            exit_code = assemble_file(argv, log_options['log_file'], stats)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+        if stats is not None:
+            stats.finish(exit_code == 0)
+            logger.info(stats.table())
+            write_stats_file(stats, stats_file)
+        if profiler is not None:
+            profiler.dump_stats(profile_file)
+            logger.info('Profile written to ' + profile_file + '.')
+    except IOError:
+        logger.error('ERROR: Failed to write statistics or profile.')
+        exit_code = -1
+    finally:
+        close_logging(handlers)
+    sys.exit(exit_code)
+
+
+def assemble_file(argv, log_file_name, stats=None):
+    """
+    Assemble one program (see main(...) ).
+
+    :param argv: The list of command line arguments passed to this script (without the logging options).
+    :param log_file_name: Name of the build log (None if there is no build log).
+    :param stats: (optional) BuildStats that record the time, memory and item counts of every phase.
+    :return: Exit code: 0 on success; -1 otherwise.
+    """
+    if stats is None:
+        stats = BuildStats()
+    logger.info(version)
+
+    # Parse input arguments
+    try:
+        with stats.phase('get_file_names') as counts:
+            file_names = get_file_names(argv)
+            counts['arguments'] = len(argv) - 1
+    except ValueError:
+        return failure(log_file_name)
+    except Exception:
+        logger.exception('Unknown error in "get_file_names()".')
+        return failure(log_file_name)
+
+    # Look up the build in the build cache
+    cache = BuildCache() if file_names['use_cache'] else None
+    cache_key = None
+    cached = None
+    if cache is not None:
+        with stats.phase('cache_lookup') as counts:
+            cache_key = cache_lookup_key(file_names)
+            if cache_key is not None:
+                cached = cache.get(cache_key)
+            counts['hits'] = 0 if cached is None else 1
+    program_capture = None
+    rom_capture = None
+    if cache_key is not None and cached is None:
+        program_capture = CaptureHandler(file_names['input_file'])
+        rom_capture = CaptureHandler()
+
+    # Read and pre-process program
+    if cached is None:
+        try:
+            with stats.phase('load_program') as counts, capture_log(logger, program_capture):
+                analysed_program = load_program(file_names['input_file'])
+                if file_names['optimize']:
+                    counts['rewrites'] = len(optimize_program(analysed_program))
+                counts['lines'] = analysed_program['lines']
+                counts['instructions'] = len(analysed_program['program'])
+                counts['labels'] = len(analysed_program['labels'])
+                counts['symbols'] = len(analysed_program['symbols'])
+        except (IOError, ValueError):
+            return failure(log_file_name)
+        except Exception:
+            logger.exception('Unexpected error in "load_program()".')
+            return failure(log_file_name)
+
+    else:
+        logger.debug('Build cache hit (' + cache_key + ').')
+        replay_log(logger, cached['diagnostics'][0], file_names['input_file'])
+
+    # Read ROM template
+    try:
+        with stats.phase('load_template') as counts:
+            created = build_timestamp(file_names['input_file'] if file_names['reproducible'] else None)
+            rom = load_template(file_names['template_file'], file_names['output_file'], file_names['addr_width'],
+                                created)
+            counts['lines'] = len(rom['first_part']) + len(rom['last_part'])
+            counts['program_space'] = rom['program_space']
+    except (IOError, ValueError):
+        return failure(log_file_name)
+    except Exception:
+        logger.exception('Unexpected error in "load_template()".')
+        return failure(log_file_name)
+
+    # generate VHDL ROM file
+    try:
+        if cached is None:
+            with stats.phase('generate_rom_file') as counts, capture_log(logger, rom_capture):
+                image = encode_program(analysed_program, rom)
+                if rom_capture is None:
+                    listing = None
+                else:
+                    listing = rom_listing(image, analysed_program, rom, file_names['vhdl_style'],
+                                          file_names['vhdl_comments'])
+                counts['instructions'] = len(analysed_program['program'])
+                counts['bytes'] = analysed_program['size']
+        else:
+            replay_log(logger, cached['diagnostics'][1])
+            image = cached['image']
+            listing = cached['listing']
+            analysed_program = None
+        with stats.phase('write') as counts:
+            counts['bytes_written'] = 0
+            for output_format, output_file in output_file_names(file_names['output_file'], file_names['formats']):
+                if output_format == 'vhdl':
+                    counts['bytes_written'] += write_rom_file(image, analysed_program, rom, output_file, listing,
+                                                              file_names['vhdl_style'], file_names['vhdl_comments'])
+                else:
+                    counts['bytes_written'] += write_image_file(image, output_file, output_format)
+    except (IOError, ValueError):
+        return failure(log_file_name)
+    except Exception:
+        logger.exception('Unexpected error in "generate_rom_file()".')
+        return failure(log_file_name)
+
+    # read the output files back and compare them with the machine image
+    if file_names['verify']:
+        try:
+            with stats.phase('verify') as counts:
+                counts['files'] = 0
+                for output_format, output_file in output_file_names(file_names['output_file'],
+                                                                    file_names['formats']):
+                    verify_rom_file(image, analysed_program, rom, output_file)
+                    counts['files'] += 1
+        except ValueError:
+            return failure(log_file_name)
+        except Exception:
+            logger.exception('Unexpected error in "verify_rom_file()".')
+            return failure(log_file_name)
+
+    if rom_capture is not None:
+        cache.put(cache_key, image, listing, analysed_program['size'], [program_capture.records, rom_capture.records])
+
+    logger.info('SUCCESS')
+    return 0
+
+
+def cache_lookup_key(file_names):
+    """
+    Determine the key of a build in the build cache.
+
+    :param file_names: The file names (provided by get_file_names(...) ).
+    :return: The key, or None if the program or the template can not be read (the build then reports the error).
+    """
+    try:
+        with open(file_names['input_file']) as f:
+            source_text = f.read()
+        with open(file_names['template_file']) as f:
+            template_text = f.read()
+    except (IOError, ValueError):
+        return None
+    return BuildCache.key(source_text, template_text, file_names['addr_width'],
+                          vhdl_variant(file_names['vhdl_style'], file_names['vhdl_comments'],
+                                       file_names['optimize']))
+
+
+def failure(log_file_name):
+    """
+    Report that assembling failed.
+
+    :param log_file_name: Name of the build log (None if there is no build log).
+    :return: The exit code (-1).
+    """
+    if log_file_name is None:
+        logger.error('FAILURE')
+    else:
+        logger.error('FAILURE - check ' + log_file_name)
+    return -1
+
+
+def get_log_options(args):
+    """
+    Take the logging options out of the list of arguments:
+        --quiet          only errors and warnings are displayed in the console
+        --verbose        all messages are displayed in the console, the build log includes the per-instruction trace
+        --log-file FILE  write the build log to FILE instead of build.log ("none": no build log)
+
+    :param args: The list of arguments (the options are removed from it).
+    :return: A dictionary with the 'console_level', the 'log_level' and the 'log_file' (None if there is no build log).
+    """
+    quiet = pop_option(args, '--quiet')
+    verbose = pop_option(args, '--verbose')
+    log_file_name = pop_option(args, '--log-file', str)
+
+    options = {'console_level': logging.INFO, 'log_level': logging.DEBUG, 'log_file': 'build.log'}
+    if quiet:
+        options['console_level'] = logging.WARNING
+    if verbose:
+        options['console_level'] = logging.DEBUG
+        options['log_level'] = TRACE
+    if log_file_name is not None:
+        options['log_file'] = None if log_file_name.lower() == 'none' else log_file_name
+    return options
+
+
+def setup_logging(log_options):
+    """
+    Attach the console and build log handlers to the logger of the assembler.
+
+    :param log_options: The logging options (see get_log_options(...) ).
+    :return: The list of handlers (see close_logging(...) ).
+    """
+    handlers = list()
+    formatter = logging.Formatter('%(message)s')
+
+    if log_options['log_file'] is not None:
+        file_handler = logging.FileHandler(log_options['log_file'], 'w')
+        file_handler.setLevel(log_options['log_level'])
+        handlers.append(file_handler)
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(log_options['console_level'])
+    handlers.append(console_handler)
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    # only produce the messages that will end up somewhere
+    logger.setLevel(min(handler.level for handler in handlers))
+
+    return handlers
+
+
+def close_logging(handlers):
+    """
+    Detach (and close) the handlers of the command line tool from the logger of the assembler.
+
+    :param handlers: The list of handlers (provided by setup_logging(...) ).
+    :return: Nothing
+    """
+    for handler in handlers:
+        logger.removeHandler(handler)
+        handler.close()
+    logger.setLevel(logging.NOTSET)
+
+
+def print_usage():
+    """
+    Print an informational message on how to use the DDASM assembler.
+
+    :return: Nothing
+    """
+    print('USAGE: python ddasm.py program_name.dda [vhdl_rom.vhd]')
+    print(' * program_name.dda : File containing the assembly program')
+    print(' * vhdl_rom.vhd     : (optional) File where VHDL description of program ROM is written to.')
+    print('                      If not specified, the file name will be "program_name.vhd".')
+    print('')
+    print('       python ddasm.py --batch (directory | "pattern" | manifest) [--jobs N]')
+    print('                      [--format LIST] [--compact] [--no-comments] [--quiet | --verbose] [--no-cache]')
+    print('                      [--reproducible] [--verify] [--optimize]')
+    print(' * directory        : Assemble all .dda files in this directory')
+    print(' * "pattern"        : Assemble all files that match the (quoted) glob pattern, e.g. "labs/*/*.dda"')
+    print(' * manifest         : Text file listing the programs to assemble (one file name per line)')
+    print(' * --jobs N         : (optional) Number of worker processes (default: number of cores).')
+    print('                      Every program_name.dda results in program_name.vhd and program_name.log.')
+    print('')
+    print('Options:')
+    print(' * --addr-width N   : Address width of the program ROM (the ROM holds 2^N bytes). By default, the value of')
+    print('                      the C_ADDR_WIDTH generic in ROM_template.vhd is used.')
+    print(' * --quiet          : Only display errors and warnings (batch: only the failed programs and the summary).')
+    print(' * --verbose        : Display all messages and add the per-instruction trace to the build log.')
+    print(' * --log-file FILE  : Write the build log to FILE instead of build.log ("none": no build log).')
+    print(' * --stats FILE     : Write the time, peak memory and item counts of every phase to FILE (JSON, "-" for the')
+    print('                      console). The same figures are added to the build log as a table.')
+    print(' * --profile FILE   : Write a cProfile dump of the build to FILE (see the pstats module).')
+    print(' * --format LIST    : Comma separated list of output formats (default: vhdl). Besides the VHDL ROM, the')
+    print('                      machine image can be written as raw binary (bin), Intel HEX (hex), $readmemh file')
+    print('                      (mem), $readmemb file (memb, program_name_bin.mem) and Xilinx .coe file (coe). The')
+    print('                      files get the name of the VHDL file with the extension of the format.')
+    print(' * --compact        : Write the VHDL ROM compactly: hexadecimal literals, and a single "others" choice for')
+    print('                      the unused memory locations (instead of one line per address).')
+    print(' * --no-comments    : Leave the instructions (comments) out of the VHDL ROM.')
+    print(' * --verify         : Read the output files back and compare them with the machine image (reports the')
+    print('                      mismatching addresses with their source lines).')
+    print(' * --optimize       : Optimize the program with peephole rewrites (removes jumps to the next instruction')
+    print('                      and redundant movl and cmpl, threads jumps and turns call + retc into jmp). Every')
+    print('                      rewrite is reported in the build log.')
+    print(' * --reproducible   : Take the creation date in the ROM file from SOURCE_DATE_EPOCH or else from the')
+    print('                      modification time of the program (instead of the current time).')
+    print(' * --no-cache       : Do not use the build cache (DDASM_CACHE_DIR, by default ~/.cache/ddasm).')
+
+
+def batch_main(argv):
+    """
+    Assemble a batch of programs in parallel, using a pool of worker processes. Every worker loads the ROM template \
+    (and the assembler tables) only once. Each program gets its own ROM file and build log.
+
+    :param argv: The list of command line arguments passed to this script (starting with "--batch").
+    :return: Exit code: 0 if all programs were assembled successfully; -1 otherwise.
+    """
+    args = argv[2:]
+    try:
+        jobs = pop_option(args, '--jobs', positive_number)
+    except ValueError:
+        print('ERROR: "--jobs" expects a positive number.')
+        print_usage()
+        return -1
+    try:
+        addr_width = pop_option(args, '--addr-width', positive_number)
+    except ValueError:
+        print('ERROR: "--addr-width" expects a positive number.')
+        print_usage()
+        return -1
+    quiet = pop_option(args, '--quiet')
+    options = {'addr_width': addr_width,
+               'log_level': TRACE if pop_option(args, '--verbose') else logging.DEBUG,
+               'use_cache': not pop_option(args, '--no-cache'),
+               'reproducible': bool(pop_option(args, '--reproducible')),
+               'vhdl_style': 'compact' if pop_option(args, '--compact') else 'verbose',
+               'vhdl_comments': not pop_option(args, '--no-comments'),
+               'verify': bool(pop_option(args, '--verify')),
+               'optimize': bool(pop_option(args, '--optimize'))}
+    try:
+        options['formats'] = pop_option(args, '--format', parse_formats) or ['vhdl']
+    except ValueError:
+        print('ERROR: "--format" expects a list of output formats (vhdl, ' + ', '.join(output_formats) + ').')
+        print_usage()
+        return -1
+    if len(args) != 1:
+        print('ERROR: "--batch" expects exactly one directory, pattern or manifest.')
+        print_usage()
+        return -1
+
+    template_file = 'ROM_template.vhd'
+    try:
+        with open(template_file) as f:
+            template_text = f.read()
+    except IOError:
+        print('ERROR: Failed to load template file (' + template_file + ').')
+        print('FAILURE')
+        return -1
+
+    try:
+        input_files = collect_batch_inputs(args[0])
+    except IOError:
+        print('ERROR: Failed to open manifest (' + args[0] + ').')
+        print('FAILURE')
+        return -1
+    if len(input_files) == 0:
+        print('ERROR: No programs found (' + args[0] + ').')
+        print('FAILURE')
+        return -1
+
+    if not quiet:
+        print(version + ' - batch of ' + str(len(input_files)) + ' programs')
+    chunk_size = max(1, len(input_files) // (4 * (jobs or multiprocessing.cpu_count())))
+    with multiprocessing.Pool(jobs, initializer=batch_init, initargs=(template_text, options)) as pool:
+        results = sorted(pool.imap_unordered(batch_assemble, input_files, chunk_size))
+
+    failures = [r for r in results if not r[1]]
+    for input_file, success, output_file, log_file_name in results:
+        if success:
+            if quiet:
+                continue
+            print(' - OK      ' + input_file + ' -> ' + output_file)
+        else:
+            print(' - FAILED  ' + input_file + ' (check ' + log_file_name + ')')
+    print(str(len(results) - len(failures)) + ' succeeded, ' + str(len(failures)) + ' failed.')
+
+    if failures:
+        print('FAILURE')
+        return -1
+    print('SUCCESS')
+    return 0
+
+
+def collect_batch_inputs(spec):
+    """
+    Determine the programs of a batch.
+
+    :param spec: A directory (all .dda files in it), a glob pattern or a manifest file (one file name per line, \
+                 relative to the manifest; empty lines and lines starting with ';' or '#' are skipped).
+    :return: A sorted list of program file names.
+    """
+    if os.path.isdir(spec):
+        return sorted(glob.glob(os.path.join(spec, '*.dda')))
+    if glob.has_magic(spec):
+        return sorted(glob.glob(spec, recursive=True))
+    if spec.lower().endswith('.dda'):
+        return [spec]
+
+    base_dir = os.path.dirname(spec)
+    input_files = list()
+    with open(spec) as f:
+        for line in f:
+            name = line.strip()
+            if len(name) == 0 or name[0] in ';#':
+                continue
+            input_files.append(os.path.join(base_dir, name))
+    return input_files
+
+
+# Assembler of a batch worker process (see batch_init(...) )
+batch_assembler = None
+# Options of a batch worker process (see batch_init(...) )
+batch_options = {'addr_width': None, 'log_level': logging.DEBUG, 'use_cache': True, 'reproducible': False,
+                 'formats': ['vhdl'], 'vhdl_style': 'verbose', 'vhdl_comments': True, 'verify': False,
+                 'optimize': False}
+
+
+def batch_init(template_text, options=None):
+    """
+    Initialise a batch worker process: the ROM template is parsed once and reused for all programs of the worker.
+
+    :param template_text: The contents of the program ROM template.
+    :param options: (optional) A dictionary with the options of the batch:
+                        'addr_width'    address width of the program ROM (None: C_ADDR_WIDTH of the template)
+                        'log_level'     lowest level of the messages in the build logs of the programs
+                        'use_cache'     share the build cache (see BuildCache)
+                        'reproducible'  take the creation date of the ROM files from the programs (see \
+                                        build_timestamp(...) )
+                        'formats'       the list of output formats (see output_file_names(...) )
+                        'vhdl_style'    style of the VHDL files, 'verbose' or 'compact' (see Assembler)
+                        'vhdl_comments' put the instructions in the VHDL files as comments
+                        'verify'        read the output files back and compare them with the machine image
+                        'optimize'      optimize the programs (see Assembler.optimize_program(...) )
+    :return: Nothing
+    """
+    global batch_assembler
+
+    batch_options.update(options or {})
+    cache = BuildCache() if batch_options['use_cache'] else None
+    batch_assembler = Assembler(template_text, addr_width=batch_options['addr_width'],
+                                log_level=batch_options['log_level'], cache=cache,
+                                vhdl_style=batch_options['vhdl_style'], vhdl_comments=batch_options['vhdl_comments'],
+                                optimize=batch_options['optimize'])
+
+
+def batch_assemble(input_file):
+    """
+    Assemble one program of a batch (runs in a worker process).
+
+    :param input_file: The file containing the program.
+    :return: A tuple (input file, success, output file, log file).
+    """
+    base_name = os.path.splitext(input_file)[0]
+    output_file = base_name + '.vhd'
+    log_file_name = base_name + '.log'
+
+    try:
+        with open(input_file) as f:
+            source_text = f.read()
+    except IOError:
+        result = {'success': False, 'diagnostics': ['ERROR: Failed to open program (' + input_file + ').', 'FAILURE']}
+    else:
+        try:
+            created = build_timestamp(input_file if batch_options['reproducible'] else None)
+        except ValueError:
+            result = {'success': False, 'diagnostics': ['ERROR: SOURCE_DATE_EPOCH should be a number of seconds.',
+                                                        'FAILURE']}
+        else:
+            result = batch_assembler.assemble(source_text, output_file, input_file, created)
+
+    success = result['success']
+    try:
+        if success:
+            for output_format, file_name in output_file_names(output_file, batch_options['formats']):
+                if output_format == 'vhdl':
+                    write_if_changed(file_name, [result['rom']])
+                else:
+                    formatter, binary = output_formats[output_format][1:]
+                    write_if_changed(file_name, formatter(result['image']), binary)
+            if batch_options['verify']:
+                success = batch_verify(result, output_file)
+        write_if_changed(log_file_name, [version + '\n'] + [message + '\n' for message in result['diagnostics']])
+    except IOError:
+        success = False
+
+    return input_file, success, output_file, log_file_name
+
+
+def batch_verify(result, output_file):
+    """
+    Verify the output files of a program of a batch (see verify_image(...) ). Errors are added to the build log.
+
+    :param result: The result of the build (see Assembler.assemble(...) ).
+    :param output_file: The file name of the VHDL file.
+    :return: True if all output files match the machine image.
+    """
+    diagnostics = result['diagnostics']
+    # the outcome of the build is logged after the verification
+    outcome = diagnostics.pop() if diagnostics and diagnostics[-1] == 'SUCCESS' else None
+    success = True
+    for output_format, file_name in output_file_names(output_file, batch_options['formats']):
+        try:
+            errors = verify_image(result['image'], read_image_file(file_name), len(result['image']))
+        except (IOError, ValueError) as e:
+            errors = ['the file can not be read (' + str(e) + ').']
+        if errors:
+            diagnostics.append('ERROR: Verification of ' + file_name + ' failed:')
+            diagnostics.extend('\t' + error for error in errors)
+            success = False
+        else:
+            diagnostics.append('Verified ' + file_name + '.')
+    diagnostics.append(outcome if success and outcome else 'FAILURE')
+    return success
+
+
+def pop_option(args, name, convert=None):
+    """
+    Take a command line option (and its value) out of the list of arguments.
+
+    :param args: The list of arguments (the option is removed from it).
+    :param name: Name of the option, e.g. "--jobs".
+    :param convert: (optional) Function that converts the value of the option. Without it, the option is a flag.
+    :return: None if the option is absent, True for a flag, the (converted) value otherwise. Raises ValueError if \
+             the value is missing or invalid.
+    """
+    if name not in args:
+        return None
+    option_index = args.index(name)
+    if convert is None:
+        del args[option_index]
+        return True
+    if option_index + 1 >= len(args):
+        raise ValueError
+    value = convert(args[option_index + 1])
+    del args[option_index:option_index + 2]
+    return value
+
+
+def positive_number(text):
+    """
+    Convert a command line value to a positive number.
+
+    :param text: The value.
+    :return: The number. Raises ValueError if the value is not a positive number.
+    """
+    number = int(text)
+    if number < 1:
+        raise ValueError
+    return number
+
+
+def get_file_names(argv):
+    """
+    Analyse the list of arguments to determine which files should be loaded.
+
+    :param argv: This is the list of arguments passed with the "main" script. The first item in the list, argv[0], \
+                 the name of the script.
+    :return: a dictionary containing the name of the 'input_file', 'output_file' and the 'template_file' (and the \
+             'addr_width' of the program ROM, if specified, whether to 'use_cache' and to make a 'reproducible' \
+             build, the output 'formats', the style of the VHDL file: 'vhdl_style' and 'vhdl_comments', \
+             whether to 'verify' the output files and to 'optimize' the program)
+    """
+    argv = list(argv)
+    use_cache = not pop_option(argv, '--no-cache')
+    reproducible = bool(pop_option(argv, '--reproducible'))
+    vhdl_style = 'compact' if pop_option(argv, '--compact') else 'verbose'
+    vhdl_comments = not pop_option(argv, '--no-comments')
+    verify = bool(pop_option(argv, '--verify'))
+    optimize = bool(pop_option(argv, '--optimize'))
+    try:
+        formats = pop_option(argv, '--format', parse_formats) or ['vhdl']
+    except ValueError:
+        logger.error('ERROR: "--format" expects a list of output formats (vhdl, ' + ', '.join(output_formats) + ').')
+        print_usage()
+        raise ValueError
+    try:
+        addr_width = pop_option(argv, '--addr-width', positive_number)
+    except ValueError:
+        logger.error('ERROR: "--addr-width" expects a positive number.')
+        print_usage()
+        raise ValueError
+
+    argc = len(argv)
+
+    fns = {'input_file': '', 'output_file': '', 'template_file': 'ROM_template.vhd', 'addr_width': addr_width,
+           'use_cache': use_cache, 'reproducible': reproducible, 'formats': formats, 'vhdl_style': vhdl_style,
+           'vhdl_comments': vhdl_comments, 'verify': verify, 'optimize': optimize}
+    if argc == 1:
+        err = 'ERROR: Not enough input arguments (' + str(argc-1) + '). Expecting at least 1.'
+        logger.error(err)
+        print_usage()
+        raise ValueError
+    elif argc == 2:
+        fns['input_file'] = argv[1]
+    elif argc == 3:
+        fns['input_file'] = argv[1]
+        fns['output_file'] = argv[2]
+    else:
+        err = 'ERROR: Too many input arguments (' + str(argc - 1) + '). Expecting 2 at most.'
+        logger.error(err)
+        print_usage()
+        raise ValueError
+
+    if len(fns['output_file']) == 0:
+        dot_index = fns['input_file'].find('.')
+        if dot_index < 0:
+            logger.warning('WARNING: Input file name is missing an extension!')
+            input_file_name = fns['input_file']
+        else:
+            input_file_name = fns['input_file'][0:dot_index]
+        fns['output_file'] = input_file_name + '.vhd'
+    else:
+        dot_index = fns['output_file'].find('.')
+        if dot_index < 0:
+            logger.warning('WARNING: Output file name is missing an extension!')
+
+    msg = ' - input:    ' + fns['input_file'] + '\n'
+    msg += ' - output:   ' + fns['output_file'] + '\n'
+    msg += ' - template: ' + fns['template_file'] + '\n'
+    logger.debug(msg)
+
+    return fns
+
+
+def load_program(filename):
+    """
+    Load and analyse the DDASM program.
+
+    :param filename: Specifies the name of the file that contains the program.
+    :return: A dictionary containing information of the analysed program.
+    """
+    return cli_assembler().load_program(filename)
+
+
+def optimize_program(pinfo):
+    """
+    Optimize the analysed program (see Assembler.optimize_program(...) ).
+
+    :param pinfo: A dictionary containing the analyzed program (provided by load_program(...) ).
+    :return: The list of rewrites.
+    """
+    return cli_assembler().optimize_program(pinfo)
+
+
+def load_template(filename, romfilename, addr_width=None, created=None):
+    """
+    Load the template of the program ROM.
+
+    :param filename: The program ROM template file name.
+    :param romfilename: The file name of the resulting ROM file
+    :param addr_width: (optional) Address width of the program ROM (overrides C_ADDR_WIDTH of the template).
+    :param created: (optional) The creation date in the header of the ROM file (see build_timestamp(...) ).
+    :return: A dictionary with program ROM structure and memory size
+    """
+    return cli_assembler(addr_width).load_template(filename, romfilename, created)
+
+
+def generate_rom_file(pinfo, rom, filename):
+    """
+    Generate program ROM file in VHDL containing the instructions of the assembled program
+
+    :param pinfo: A dictionary containing the analyzed program (provided by load_program(...) ).
+    :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+    :param filename: The file name of the VHDL file.
+    :return: Nothing
+    """
+    cli_assembler().generate_rom_file(pinfo, rom, filename)
+
+
+def encode_program(pinfo, rom):
+    """
+    Encode the instructions of the assembled program (first half of generate_rom_file(...) ).
+
+    :param pinfo: A dictionary containing the analyzed program (provided by load_program(...) ).
+    :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+    :return: A bytearray with the contents of the complete program ROM.
+    """
+    assembler = cli_assembler()
+    assembler.logger.info('Generating ROM memory file...')
+    return assembler.encode_program(pinfo, rom)
+
+
+def write_rom_file(image, pinfo, rom, filename, listing=None, vhdl_style='verbose', vhdl_comments=True):
+    """
+    Write the program ROM file in VHDL (second half of generate_rom_file(...) ).
+
+    :param image: The contents of the program ROM (provided by encode_program(...) ).
+    :param pinfo: A dictionary containing the analyzed program (provided by load_program(...) ).
+    :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+    :param filename: The file name of the VHDL file.
+    :param listing: (optional) The formatted ROM contents (see Assembler.listing_chunks(...) ).
+    :param vhdl_style: Style of the ROM contents, 'verbose' or 'compact' (see Assembler).
+    :param vhdl_comments: Setting vhdl_comments to False leaves the instructions out of the VHDL file.
+    :return: The number of bytes written.
+    """
+    assembler = cli_assembler(vhdl_style=vhdl_style, vhdl_comments=vhdl_comments)
+    return assembler.write_rom_file(image, pinfo, rom, filename, listing)
+
+
+def write_image_file(image, filename, output_format):
+    """
+    Write the machine image in one of the output formats (see Assembler.write_image_file(...) ).
+
+    :param image: The contents of the program ROM (provided by encode_program(...) ).
+    :param filename: The file name.
+    :param output_format: The name of the output format (see output_formats).
+    :return: The number of bytes written.
+    """
+    return cli_assembler().write_image_file(image, filename, output_format)
+
+
+def verify_rom_file(image, pinfo, rom, filename):
+    """
+    Verify a ROM file that was just written (see Assembler.verify_rom_file(...) ).
+
+    :param image: The contents of the program ROM (provided by encode_program(...) ).
+    :param pinfo: A dictionary containing the analyzed program (None if unavailable).
+    :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+    :param filename: The ROM file.
+    :return: Nothing. Raises ValueError if the file does not match.
+    """
+    cli_assembler().verify_rom_file(image, pinfo, rom, filename)
+
+
+def verify_image(image, written, program_space, pinfo=None, max_mismatches=16):
+    """
+    Compare a machine image that was read back from a ROM file with the image that was written.
+
+    :param image: The contents of the program ROM.
+    :param written: The contents read back from the ROM file.
+    :param program_space: The size of the program ROM (see Assembler.parse_template(...) ).
+    :param pinfo: (optional) A dictionary containing the analyzed program (for the source lines in the report and to \
+                  check the reset and interrupt vectors).
+    :param max_mismatches: Maximum number of mismatching addresses in the report.
+    :return: A list of error messages (empty if the file matches).
+    """
+    errors = list()
+    if len(written) != program_space:
+        errors.append('ROM size is ' + str(len(written)) + ' bytes, expected ' + str(program_space) + ' bytes.')
+
+    if pinfo is not None:
+        for label, address in (('reset', '00'), ('isr', '02')):
+            if label in pinfo['labels'] and pinfo['labels'][label] != address:
+                errors.append('Label "' + label + '" is at address ' + pinfo['labels'][label] + ', expected ' + address
+                              + '.')
+
+    if written == image:
+        return errors
+
+    # the instruction at every address (for the source line)
+    instructions = dict()
+    if pinfo is not None:
+        for instruction_info in pinfo['program']:
+            instructions[instruction_info.address] = instruction_info
+            instructions[instruction_info.address + 1] = instruction_info
+
+    mismatches = [address for address in range(min(len(image), len(written))) if image[address] != written[address]]
+    for address in mismatches[:max_mismatches]:
+        error = 'address %02X: expected %02X, found %02X' % (address, image[address], written[address])
+        instruction_info = instructions.get(address)
+        if instruction_info is not None:
+            error += ' (line ' + str(instruction_info.line + 1) + ': ' + instruction_info.text + ')'
+        errors.append(error)
+    if len(mismatches) > max_mismatches:
+        errors.append('... ' + str(len(mismatches) - max_mismatches) + ' more mismatching addresses.')
+    return errors
+
+
+def output_file_names(output_file, formats):
+    """
+    Determine the file name of every output format: the name of the VHDL file with the extension of the format.
+
+    :param output_file: The file name of the VHDL file.
+    :param formats: The list of output formats ('vhdl' and/or the formats of output_formats).
+    :return: A list of (format, file name) tuples.
+    """
+    base_name = os.path.splitext(output_file)[0]
+    file_names = list()
+    for output_format in formats:
+        if output_format == 'vhdl':
+            file_names.append((output_format, output_file))
+        else:
+            file_names.append((output_format, base_name + output_formats[output_format][0]))
+    return file_names
+
+
+def parse_formats(text):
+    """
+    Convert the value of the --format option to a list of output formats.
+
+    :param text: Comma separated list of output formats, e.g. "vhdl,bin,hex".
+    :return: The list of output formats (without duplicates). Raises ValueError for an unknown format.
+    """
+    formats = list()
+    for output_format in text.lower().split(','):
+        output_format = output_format.strip()
+        if output_format != 'vhdl' and output_format not in output_formats:
+            raise ValueError
+        if output_format not in formats:
+            formats.append(output_format)
+    return formats
+
+
+def rom_listing(image, pinfo, rom, vhdl_style='verbose', vhdl_comments=True):
+    """
+    Format the contents of the program ROM (see Assembler.listing_chunks(...) ).
+
+    :param image: The contents of the program ROM (provided by encode_program(...) ).
+    :param pinfo: A dictionary containing the analyzed program (provided by load_program(...) ).
+    :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+    :param vhdl_style: Style of the ROM contents, 'verbose' or 'compact' (see Assembler).
+    :param vhdl_comments: Setting vhdl_comments to False leaves the instructions out of the VHDL file.
+    :return: The ROM contents (VHDL text).
+    """
+    assembler = cli_assembler(vhdl_style=vhdl_style, vhdl_comments=vhdl_comments)
+    return ''.join(assembler.listing_chunks(image, pinfo, rom))
+
+
+def vhdl_variant(vhdl_style, vhdl_comments, optimize=False):
+    """
+    :param vhdl_style: Style of the ROM contents, 'verbose' or 'compact' (see Assembler).
+    :param vhdl_comments: True if the instructions are put in the VHDL file as comments.
+    :param optimize: True if the program is optimized (see Assembler.optimize_program(...) ).
+    :return: A string that identifies the options that change the ROM contents (for the key of the build cache).
+    """
+    return vhdl_style + (',comments' if vhdl_comments else '') + (',optimize' if optimize else '')
+
+
+def cli_assembler(addr_width=None, vhdl_style='verbose', vhdl_comments=True):
+    """
+    Create an assembler that reports to the logger of the command line tool (see setup_logging(...) ).
+
+    :param addr_width: (optional) Address width of the program ROM (overrides C_ADDR_WIDTH of the template).
+    :param vhdl_style: Style of the ROM contents in the VHDL file, 'verbose' or 'compact' (see Assembler).
+    :param vhdl_comments: Setting vhdl_comments to False leaves the instructions out of the VHDL file.
+    :return: An Assembler instance.
+    """
+    return Assembler(logger=logger, addr_width=addr_width, vhdl_style=vhdl_style, vhdl_comments=vhdl_comments)
+
+
+class BuildCache:
+    """
+    Persistent, content-addressed cache of assembled programs.
+
+    An entry is keyed on a hash of the program, the ROM template, the address width, the assembler tables (asminfo) \
+    and the version of the assembler. It holds the machine image, the ROM contents (VHDL text between the first and \
+    the last part of the template) and the build log of the program, so the header of the ROM file can be filled in \
+    for any file name.
+
+    An entry is a file with a JSON header line (the key, the ROM contents, the size and the build log) followed by \
+    the bytes of the machine image. An entry that cannot be decoded (e.g. a damaged file) is treated as a miss.
+
+    Entries are written to a temporary file first and then renamed, so parallel processes (e.g. the workers of a \
+    batch) can share one cache directory. Entries that are older than max_age are removed, as are the least \
+    recently used entries when the cache grows beyond max_size. The cache directory is scanned for this at the first \
+    store of a BuildCache and then only when the stores since the last scan may have grown the cache beyond max_size.
+    """
+
+    def __init__(self, directory=None, max_size=256 * 1024 * 1024, max_age=30 * 24 * 3600):
+        """
+        :param directory: (optional) The cache directory. By default, DDASM_CACHE_DIR is used or else ddasm in the \
+                          user's cache directory (XDG_CACHE_HOME or ~/.cache).
+        :param max_size: Maximum total size of the cache (in bytes).
+        :param max_age: Maximum age of an unused entry (in seconds).
+        """
+        if directory is None:
+            directory = os.environ.get('DDASM_CACHE_DIR')
+        if directory is None:
+            cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+            directory = os.path.join(cache_home, 'ddasm')
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        # the size of the cache at the last scan (None: not scanned yet) and the bytes stored since (see put(...) )
+        self.scanned_size = None
+        self.stored_size = 0
+
+    @staticmethod
+    def key(source_text, template_text, addr_width=None, variant=''):
+        """
+        :param source_text: The DDASM program.
+        :param template_text: The contents of the program ROM template.
+        :param addr_width: (optional) Address width of the program ROM (overrides C_ADDR_WIDTH of the template).
+        :param variant: (optional) The options that change the ROM contents (see vhdl_variant(...) ).
+        :return: The key of the build (hexadecimal string).
+        """
+        key_hash = hashlib.sha256()
+        for part in (version, asminfo_digest, str(addr_width), variant, template_text, source_text):
+            data = part.encode('utf-8')
+            key_hash.update(b'%d:' % len(data))
+            key_hash.update(data)
+        return key_hash.hexdigest()
+
+    def entry_file(self, key):
+        """
+        :param key: The key of the build.
+        :return: The file name of the cache entry.
+        """
+        return os.path.join(self.directory, key[:2], key + '.entry')
+
+    def get(self, key):
+        """
+        Look up a build in the cache.
+
+        :param key: The key of the build (see key(...) ).
+        :return: The cache entry (a dictionary with the 'image', the 'listing', the 'size' and the 'diagnostics', \
+                 see put(...) ) or None if the build is not in the cache.
+        """
+        filename = self.entry_file(key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+            # mark the entry as recently used
+            os.utime(filename)
+        except OSError:
+            # not in the cache (or evicted by another process in the meantime)
+            return None
+        try:
+            return decode_cache_entry(data, key)
+        except (ValueError, TypeError, KeyError, IndexError):
+            # a damaged entry (or one of another version) is not used; put(...) replaces it
+            return None
+
+    def put(self, key, image, listing, size, diagnostics):
+        """
+        Store a build in the cache (errors are ignored: the cache is only an optimisation).
+
+        :param key: The key of the build (see key(...) ).
+        :param image: The contents of the program ROM.
+        :param listing: The ROM contents (VHDL text).
+        :param size: The program size (in bytes).
+        :param diagnostics: The build log: a list with the captured records (see CaptureHandler) of the analysis \
+                            and of the generation of the ROM.
+        :return: Nothing
+        """
+        try:
+            data = encode_cache_entry(key, image, listing, size, diagnostics)
+        except (ValueError, TypeError):
+            # the build log has arguments that cannot be stored
+            return
+        filename = self.entry_file(key)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            handle, temp_name = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_name, filename)
+            except BaseException:
+                os.remove(temp_name)
+                raise
+            self.stored_size += len(data)
+            if self.scanned_size is None or self.scanned_size + self.stored_size > self.max_size:
+                self.scanned_size = self.evict()
+                self.stored_size = 0
+        except OSError:
+            pass
+
+    def evict(self):
+        """
+        Remove the entries that are too old and, if the cache is too large, the least recently used entries (down to \
+        three quarters of max_size, so the next stores do not have to scan the cache again).
+
+        :return: The total size of the entries that are left (in bytes).
+        """
+        now = time.time()
+        entries = list()
+        for sub_directory in os.scandir(self.directory):
+            if not sub_directory.is_dir():
+                continue
+            for item in os.scandir(sub_directory.path):
+                try:
+                    info = item.stat()
+                except OSError:
+                    continue
+                # leftovers of an interrupted write are removed after a while as well
+                entries.append((info.st_mtime, info.st_size, item.path))
+
+        # the entries that are too old are removed (an entry that cannot be removed still counts)
+        entries = [entry for entry in entries if now - entry[0] <= self.max_age or not remove_file(entry[2])]
+        size_limit = self.max_size
+        if sum(size for _, size, _ in entries) > self.max_size:
+            size_limit = self.max_size * 3 // 4
+        # the most recently used entries are kept, up to the limit
+        total_size = 0
+        full = False
+        for modified, size, path in sorted(entries, reverse=True):
+            full = full or total_size + size > size_limit
+            if not full or not remove_file(path):
+                total_size += size
+        return total_size
+
+
+def remove_file(filename):
+    """
+    :param filename: The file name.
+    :return: True if the file was removed, False if it could not be removed.
+    """
+    try:
+        os.remove(filename)
+    except OSError:
+        return False
+    return True
+
+
+def encode_cache_entry(key, image, listing, size, diagnostics):
+    """
+    Encode an entry of the build cache: a JSON header line followed by the bytes of the machine image.
+
+    :param key: The key of the build (see BuildCache.key(...) ).
+    :param image: The contents of the program ROM.
+    :param listing: The ROM contents (VHDL text).
+    :param size: The program size (in bytes).
+    :param diagnostics: The build log (see BuildCache.put(...) ).
+    :return: The contents of the entry file (bytes). Raises TypeError or ValueError if the build log cannot be \
+             stored as JSON.
+    """
+    image = bytes(image)
+    header = {'key': key, 'listing': listing, 'size': size, 'image_size': len(image), 'diagnostics': diagnostics}
+    return json.dumps(header, allow_nan=False).encode('utf-8') + b'\n' + image
+
+
+def decode_cache_entry(data, key):
+    """
+    Decode an entry of the build cache (see encode_cache_entry(...) ).
+
+    :param data: The contents of the entry file.
+    :param key: The key of the build.
+    :return: A dictionary with the 'image', the 'listing', the 'size' and the 'diagnostics' of the build, or None if \
+             the entry belongs to another build. Raises ValueError (or TypeError, KeyError, IndexError) if the entry \
+             is damaged.
+    """
+    header_end = data.index(b'\n')
+    header = json.loads(data[:header_end].decode('utf-8'))
+    if header['key'] != key:
+        return None
+    image = data[header_end + 1:]
+    if len(image) != header['image_size'] or not isinstance(header['listing'], str) or \
+            not isinstance(header['size'], int):
+        raise ValueError('damaged cache entry')
+    diagnostics = list()
+    for records in header['diagnostics'][:2]:
+        captured = list()
+        for level, message, args in records:
+            if not isinstance(level, int) or not isinstance(message, str) or not isinstance(args, (list, dict)):
+                raise ValueError('damaged cache entry')
+            # JSON has no tuples (see CaptureHandler)
+            captured.append((level, message, tuple(args) if isinstance(args, list) else args))
+        diagnostics.append(captured)
+    if len(diagnostics) != 2:
+        raise ValueError('damaged cache entry')
+    return {'image': image, 'listing': header['listing'], 'size': header['size'], 'diagnostics': diagnostics}
+
+
+class CaptureHandler(logging.Handler):
+    """
+    Logging handler that records the log records of a build (to store the build log in the build cache). The name \
+    of the program is left out of the records, so the build log can be replayed for another program with the same \
+    contents (see replay_log(...) ).
+    """
+
+    def __init__(self, source_name=None):
+        """
+        :param source_name: (optional) Name of the program.
+        """
+        super().__init__(logging.DEBUG)
+        self.source_name = source_name
+        self.records = list()
+
+    def emit(self, record):
+        args = record.args or ()
+        if isinstance(args, tuple):
+            args = tuple(source_name_marker if arg == self.source_name else arg for arg in args)
+        self.records.append((record.levelno, record.msg, args))
+
+
+# Stands for the name of the program in a captured build log (see CaptureHandler)
+source_name_marker = '<source>'
+
+
+@contextlib.contextmanager
+def capture_log(target_logger, capture):
+    """
+    Record the messages of a logger (for the build cache) while the context is active.
+
+    :param target_logger: The logger.
+    :param capture: A CaptureHandler (None: nothing is recorded).
+    :return: A context manager.
+    """
+    if capture is None:
+        yield
+        return
+    level = target_logger.level
+    # the complete build log is stored, also the messages that are not shown in this build
+    if target_logger.getEffectiveLevel() > logging.DEBUG:
+        target_logger.setLevel(logging.DEBUG)
+    target_logger.addHandler(capture)
+    try:
+        yield
+    finally:
+        target_logger.removeHandler(capture)
+        target_logger.setLevel(level)
+
+
+def replay_log(target_logger, records, source_name=None):
+    """
+    Log the records of a captured build log (see CaptureHandler) again.
+
+    :param target_logger: The logger.
+    :param records: The captured records.
+    :param source_name: (optional) Name of the program.
+    :return: Nothing
+    """
+    for level, message, args in records:
+        if isinstance(args, tuple):
+            args = tuple(source_name if arg == source_name_marker else arg for arg in args)
+            target_logger.log(level, message, *args)
+        else:
+            target_logger.log(level, message, args)
+
+
+def write_stats_file(stats, filename):
+    """
+    Write the build statistics as JSON.
+
+    :param stats: The BuildStats of the build.
+    :param filename: Name of the JSON file ("-" to print the statistics in the console).
+    :return: Nothing
+    """
+    text = json.dumps(stats.as_dict(), indent=2) + '\n'
+    if filename == '-':
+        sys.stdout.write(text)
+        return
+    with open(filename, 'w') as f:
+        f.write(text)
+
+
+class BuildStats:
+    """
+    Instrumentation of a build: the wall time, peak memory (optional) and item counts of every phase.
+
+    Usage:
+        stats = BuildStats(trace_memory=True)
+        with stats.phase('load_program') as counts:
+            pinfo = load_program(filename)
+            counts['instructions'] = len(pinfo['program'])
+        stats.finish(True)
+        print(stats.table())
+    """
+
+    def __init__(self, trace_memory=False):
+        """
+        :param trace_memory: Setting trace_memory to True will also record the peak memory of every phase (using \
+                             tracemalloc, which slows down the build).
+        """
+        self.trace_memory = trace_memory
+        self.phases = []
+        self.success = None
+        self.start = time.perf_counter()
+        self.wall_time = None
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Measure a phase of the build. The phase is recorded even if it fails.
+
+        :param name: Name of the phase.
+        :return: A context manager that provides a dictionary for the item counts of the phase.
+        """
+        counts = dict()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield counts
+        finally:
+            record = {'phase': name, 'wall_time': time.perf_counter() - start, 'peak_memory': None,
+                      'counts': counts}
+            if self.trace_memory:
+                record['peak_memory'] = tracemalloc.get_traced_memory()[1] - memory_start
+            self.phases.append(record)
+
+    def finish(self, success):
+        """
+        Mark the end of the build.
+
+        :param success: True if the build succeeded.
+        :return: Nothing
+        """
+        self.success = success
+        self.wall_time = time.perf_counter() - self.start
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    def as_dict(self):
+        """
+        :return: The statistics as a dictionary (suitable for JSON).
+        """
+        return {'version': version, 'success': self.success, 'wall_time': self.wall_time,
+                'phases': self.phases}
+
+    def table(self):
+        """
+        :return: The statistics as a human readable table.
+        """
+        table = ['\n\t+-------------------+------------+--------------+\n',
+                 '\t| phase             | time (ms)  | peak memory  |\n',
+                 '\t+-------------------+------------+--------------+\n']
+        for record in self.phases:
+            memory = '-' if record['peak_memory'] is None else '%d kB' % (record['peak_memory'] // 1024)
+            table.append('\t| %-17s | %10.3f | %12s |' % (record['phase'], record['wall_time'] * 1000, memory))
+            counts = ', '.join('%s: %d' % item for item in record['counts'].items())
+            table.append(' ' + counts + '\n' if counts else '\n')
+        table.append('\t+-------------------+------------+--------------+\n')
+        if self.wall_time is not None:
+            table.append('\t  total: %.3f ms\n' % (self.wall_time * 1000))
+        return ''.join(table)
+
+
+class Assembler:
+    """
+    Reentrant, in-memory DDASM assembler.
+
+    All state of a build (including the build log) is kept in the instance, so no files have to be touched and \
+    different instances can be used from different threads at the same time. Calls to assemble(...) on one and the \
+    same instance are serialised.
+
+    Every instance logs to its own logger (a child of the 'ddasm' logger), which keeps the build log of the last \
+    assemble(...) call in log_lines. Messages meant for the console are logged at level INFO (or WARNING/ERROR), \
+    the rest of the build log at level DEBUG and the per-instruction trace at level TRACE.
+    """
+
+    def __init__(self, template_text=None, echo=False, log_stream=None, addr_width=None, log_level=logging.DEBUG,
+                 logger=None, cache=None, vhdl_style='verbose', vhdl_comments=True, optimize=False):
+        """
+        :param template_text: The contents of the program ROM template (as in ROM_template.vhd). Only required for \
+                              assemble(...).
+        :param echo: Setting echo to True will also display the messages that are meant for the console.
+        :param log_stream: (optional) File-like object to which all log messages are written as well.
+        :param addr_width: (optional) Address width of the program ROM. Overrides the C_ADDR_WIDTH generic of the \
+                           template.
+        :param log_level: Lowest level of the messages in the build log (use TRACE to include the per-instruction \
+                          trace).
+        :param logger: (optional) Use this logger (as is) instead of a logger of the instance. The build log is then \
+                       not kept in log_lines.
+        :param cache: (optional) A BuildCache for assemble(...): unchanged programs are not assembled again.
+        :param vhdl_style: Style of the ROM contents in the VHDL file: 'verbose' (one line per byte, for every \
+                           address) or 'compact' (hexadecimal literals, unused addresses filled with "others").
+        :param vhdl_comments: Setting vhdl_comments to False leaves the instructions out of the VHDL file (as \
+                              comments).
+        :param optimize: Setting optimize to True optimizes the program in assemble(...) (see optimize_program(...) ).
+        """
+        self.template_text = template_text
+        self.addr_width = addr_width
+        self.log_lines = []
+        self.cache = cache
+        self.vhdl_style = vhdl_style
+        self.vhdl_comments = vhdl_comments
+        self.optimize = optimize
+        self._template = None
+        self._lock = threading.Lock()
+
+        if logger is not None:
+            self.logger = logger
+            return
+
+        # a logger of the instance (not registered with the logging module, so it is not kept alive after use)
+        self.logger = logging.Logger('ddasm.assembler', log_level)
+        self.logger.parent = logging.getLogger('ddasm')
+        formatter = logging.Formatter('%(message)s')
+        handlers = [BuildLogHandler(self)]
+        if log_stream is not None:
+            handlers.append(logging.StreamHandler(log_stream))
+        if echo:
+            console_handler = logging.StreamHandler(sys.stdout)
+            console_handler.setLevel(logging.INFO)
+            handlers.append(console_handler)
+        for handler in handlers:
+            handler.setFormatter(formatter)
+            self.logger.addHandler(handler)
+
+    def assemble(self, source_text, rom_name='rom.vhd', source_name='program', created=None):
+        """
+        Assemble a program entirely in memory.
+
+        :param source_text: The DDASM program (contents of a .dda file).
+        :param rom_name: The file name that is put in the header of the generated ROM.
+        :param source_name: Name of the program, used in the build log.
+        :param created: (optional) The creation date that is put in the header of the generated ROM (see \
+                        build_timestamp(...) ).
+        :return: A dictionary with the result of the build: 'success', 'rom' (VHDL text), 'image' (bytes of the \
+                 program ROM), 'size' (program size in bytes) and 'diagnostics' (the build log lines).
+        """
+        with self._lock:
+            self.log_lines = []
+            result = {'success': False, 'rom': None, 'image': None, 'size': 0, 'diagnostics': self.log_lines}
+
+            if self.template_text is None:
+                self.logger.error('ERROR: No ROM template available.')
+                self.logger.debug('FAILURE')
+                return result
+
+            cache_key = None
+            cached = None
+            if self.cache is not None:
+                cache_key = BuildCache.key(source_text, self.template_text, self.addr_width,
+                                           vhdl_variant(self.vhdl_style, self.vhdl_comments, self.optimize))
+                cached = self.cache.get(cache_key)
+
+            try:
+                # the template is only parsed once per assembler
+                if self._template is None:
+                    self._template = self.parse_template(self.template_text)
+                rom = stamp_template(self._template, rom_name, created)
+                if cached is None:
+                    program_capture = None if cache_key is None else CaptureHandler(source_name)
+                    rom_capture = None if cache_key is None else CaptureHandler()
+                    with capture_log(self.logger, program_capture):
+                        pinfo = self.analyse_program(source_text, source_name)
+                        if self.optimize:
+                            self.optimize_program(pinfo)
+                    with capture_log(self.logger, rom_capture):
+                        self.logger.info('Generating ROM memory file...')
+                        image = self.encode_program(pinfo, rom)
+                    listing = ''.join(self.listing_chunks(image, pinfo, rom))
+                    size = pinfo['size']
+                else:
+                    self.logger.debug('Build cache hit (' + cache_key + ').')
+                    replay_log(self.logger, cached['diagnostics'][0], source_name)
+                    replay_log(self.logger, cached['diagnostics'][1])
+                    image = cached['image']
+                    listing = cached['listing']
+                    size = cached['size']
+            except ValueError:
+                self.logger.debug('FAILURE')
+                return result
+
+            if cache_key is not None and cached is None:
+                self.cache.put(cache_key, image, listing, size, [program_capture.records, rom_capture.records])
+
+            self.logger.debug('Program ROM complete.')
+            self.logger.debug('SUCCESS')
+            result['success'] = True
+            result['rom'] = ''.join(rom['first_part']) + listing + ''.join(rom['last_part'])
+            result['image'] = bytes(image)
+            result['size'] = size
+            return result
+
+    def load_program(self, filename):
+        """
+        Load and analyse the DDASM program.
+
+        :param filename: Specifies the name of the file that contains the program.
+        :return: A dictionary containing information of the analysed program.
+        """
+        # load the program
+        try:
+            with open(filename) as f:
+                source_text = f.read()
+        except IOError:
+            err = 'ERROR: Failed to open program (' + filename + ').'
+            self.logger.error(err)
+            raise IOError
+
+        return self.analyse_program(source_text, filename)
+
+    def analyse_program(self, source_text, name='program'):
+        """
+        Analyse the DDASM program.
+
+        :param source_text: The program text.
+        :param name: Name of the program (used in the build log).
+        :return: A dictionary containing information of the analysed program.
+        """
+        raw_text = text_lines(source_text)
+
+        self.logger.info('Analysing program...')
+
+        # analyse text
+        pinfo = {'program': [], 'labels': {}, 'symbols': {}, 'size': 0, 'lines': len(raw_text)}
+        program = pinfo['program']
+        labels = pinfo['labels']
+        symbols = pinfo['symbols']
+        virtual_instructions = asminfo['virtual_instructions']
+        address = 0
+        for token in tokenize_program(raw_text):
+            kind = token[0]
+            if kind == 'instruction':
+                line_index, ins, op_1, op_2, asm = token[1:]
+                # check for virtual instruction and if so do replacement
+                virtual_instruction = virtual_instructions.get(ins)
+                if virtual_instruction is not None:
+                    op_2 = virtual_instruction['operand_2']
+                    ins = virtual_instruction['replace_with']
+                # update program info (and set next instruction address)
+                program.append(Instruction(line_index, address, ins, op_1, op_2, asm))
+                address = address + 2
+            elif kind == 'label':
+                line_index, label = token[1:]
+                # check if the label is already defined
+                if label in labels:
+                    self.line_error('Label "' + label + '" already defined.', line_index, raw_text)
+                # add label to list
+                labels[label] = '%02x' % address
+                # now we do some further checking
+                if label == 'reset' and address != 0:
+                    self.line_error('Label "reset" should have address "00".', line_index, raw_text)
+                if label == 'isr' and address != 2:
+                    self.line_error('Label "isr" should have address "02".', line_index, raw_text)
+            elif kind == 'define':
+                line_index, symbol, value = token[1:]
+                # check if symbol is already defined
+                if symbol in symbols:
+                    self.line_error('Symbol name "' + symbol + '" already defined.', line_index, raw_text)
+                # if not, add it to the list
+                symbols[symbol] = value
+            else:
+                self.line_error(token[2], token[1], raw_text)
+
+        # Log a list of the labels and the symbols that are defined in the program (only formatted when needed)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug('- Labels defined in %s:', name)
+            self.logger.debug(format_symbols_table(pinfo['labels'], 'label', 'address (hex)'))
+            self.logger.debug('- Symbols defined in %s:', name)
+            self.logger.debug(format_symbols_table(pinfo['symbols'], 'symbols', 'value'))
+
+        # Update program size
+        pinfo['size'] = address
+        msg = ' - Program size: ' + str(pinfo['size']) + ' bytes.\n\nAnalysis complete.\n\n'
+        self.logger.info(msg)
+
+        return pinfo
+
+    def line_error(self, description, line_index, raw_text):
+        """
+        Log an error in a line of the program and abort the analysis.
+
+        :param description: Description of the error.
+        :param line_index: Index of the line that contains the error.
+        :param raw_text: The lines of the program.
+        :return: Never returns, raises ValueError.
+        """
+        err = 'ERROR: ' + description + '\n'
+        err += '\tline ' + str(line_index + 1) + ' -> ' + raw_text[line_index].strip()
+        self.logger.error(err)
+        raise ValueError
+
+    def optimize_program(self, pinfo):
+        """
+        Optimize the analysed program with peephole rewrites (before it is encoded). The rewrites are repeated until \
+        none of them applies:
+            * a (conditional) jump to the next instruction is removed;
+            * movl (or clr) followed by movl to the same register is removed;
+            * a jump or call to a jmp goes to the target of that jmp instead (jump threading);
+            * call followed by retc becomes jmp, if the routine that is called returns with retc and leaves the \
+              stack as it found it; the retc is removed unless it is a jump target;
+            * cmpl that repeats the previous cmpl (with only conditional jumps in between) is removed.
+        The labels of a removed instruction move to the next instruction. An instruction that is a jump target is \
+        only removed if that does not change what the jump does, and the instructions at the reset and isr vectors \
+        (00 and 02) are never removed. If a jump uses a literal address or a label is used as a value, no \
+        instructions are removed (their addresses would change), the other rewrites are still done.
+
+        :param pinfo: A dictionary containing the analysed program (provided by analyse_program(...) ). The program, \
+                      the labels and the size are updated.
+        :return: A list with a dictionary for every rewrite: 'line' (index of the source line), 'text' (the \
+                 instruction), 'replacement' (the new instruction, None if it is removed) and 'bytes' (bytes saved). \
+                 Raises ValueError if an instruction or an operand is not valid (as encode_program(...) ).
+        """
+        self.logger.info('Optimizing program...')
+        # the rewrites rely on valid mnemonics and operands: the errors are reported as when the program is encoded
+        self.resolve_program(pinfo)
+        program = pinfo['program']
+        labels = pinfo['labels']
+        symbols = pinfo['symbols']
+        instructions = encoding_tables['instructions']
+        jump_types = ('jump', 'jump_conditional')
+
+        def label_of(operand):
+            # the label that an operand refers to (directly or through symbols), None if it is no label
+            seen = set()
+            while operand not in labels and operand in symbols and operand not in seen:
+                seen.add(operand)
+                operand = symbols[operand]
+            return operand if operand in labels else None
+
+        # instructions can only be removed if all addresses are labels (which move with the instructions)
+        removable = True
+        for instruction_info in program:
+            is_jump = instructions.get(instruction_info.instruction, ('', 0))[0] in jump_types
+            for operand in (instruction_info.operand_1, instruction_info.operand_2):
+                if operand is not None and (label_of(operand) is None) == is_jump:
+                    removable = False
+                    self.logger.warning('WARNING: No instructions are removed: line ' + str(instruction_info.line + 1)
+                                        + ' uses "' + operand + '" as ' + ('address.' if is_jump else 'value.'))
+                    break
+            if not removable:
+                break
+
+        rewrites = list()
+        changed = True
+        while changed:
+            index = self.build_symbol_index(pinfo)
+            positions = {instruction_info.address: position for position, instruction_info in enumerate(program)}
+            label_addresses = {int(address, 16) for address in labels.values()}
+
+            def target(instruction_info):
+                # the position of the instruction that a jump goes to (None if it is outside the program)
+                value = lookup_value(instruction_info.operand_1, index)
+                return positions.get(int(value, 16)) if value is not None and is_hex(value) else None
+
+            def can_remove(position, label_allowed=True):
+                address = program[position].address
+                return removable and address > 2 and (label_allowed or address not in label_addresses)
+
+            # position -> replacement (None: removed); every instruction is rewritten at most once per round
+            replaced = dict()
+            for position, instruction_info in enumerate(program):
+                if position in replaced:
+                    continue
+                mnemonic = instruction_info.instruction
+                instruction_type = instructions.get(mnemonic, ('', 0))[0]
+                following = program[position + 1] if position + 1 < len(program) else None
+                if instruction_type in jump_types:
+                    target_position = target(instruction_info)
+                    if target_position == position + 1 and mnemonic != 'call' and can_remove(position):
+                        replaced[position] = None
+                        continue
+                    # follow the chain of jmp instructions (a loop of jumps is left alone)
+                    final = target_position
+                    last_jump = None
+                    seen = {position}
+                    while final is not None and final not in seen and program[final].instruction == 'jmp':
+                        seen.add(final)
+                        last_jump = final
+                        final = target(program[final])
+                    if last_jump is not None and final is not None and final not in seen:
+                        operand = program[last_jump].operand_1
+                        replaced[position] = Instruction(instruction_info.line, instruction_info.address, mnemonic,
+                                                         operand, None, mnemonic + ' ' + operand)
+                        continue
+                    if mnemonic == 'call' and following is not None and following.instruction == 'retc' and \
+                            target_position is not None and self.returns_balanced(program, target_position, target):
+                        replaced[position] = Instruction(instruction_info.line, instruction_info.address, 'jmp',
+                                                         instruction_info.operand_1, None,
+                                                         'jmp ' + instruction_info.operand_1)
+                        if can_remove(position + 1, label_allowed=False):
+                            replaced[position + 1] = None
+                        continue
+                elif mnemonic == 'movl' and following is not None and following.instruction == 'movl' and \
+                        lookup_value(following.operand_1, index) == lookup_value(instruction_info.operand_1, index) \
+                        and can_remove(position):
+                    replaced[position] = None
+                elif mnemonic == 'cmpl':
+                    # conditional jumps change neither the registers nor the flags
+                    later = position + 1
+                    while later < len(program) and instructions[program[later].instruction][0] == 'jump_conditional' \
+                            and program[later].address not in label_addresses and later not in replaced:
+                        later += 1
+                    if later < len(program) and program[later].instruction == 'cmpl' and later not in replaced and \
+                            [lookup_value(operand, index) for operand in (program[later].operand_1,
+                                                                          program[later].operand_2)] == \
+                            [lookup_value(operand, index) for operand in (instruction_info.operand_1,
+                                                                          instruction_info.operand_2)] and \
+                            can_remove(later, label_allowed=False):
+                        replaced[later] = None
+
+            changed = bool(replaced)
+            for position, replacement in sorted(replaced.items()):
+                instruction_info = program[position]
+                rewrites.append({'line': instruction_info.line, 'text': instruction_info.text,
+                                 'replacement': None if replacement is None else replacement.text,
+                                 'bytes': 2 if replacement is None else 0})
+                self.logger.info(' - line ' + str(instruction_info.line + 1) + ': ' + instruction_info.text + ' -> '
+                                 + ('removed (2 bytes saved)' if replacement is None else replacement.text))
+                if replacement is not None:
+                    program[position] = replacement
+            if any(replacement is None for replacement in replaced.values()):
+                self.relocate_program(pinfo, {position for position, replacement in replaced.items()
+                                              if replacement is None})
+
+        saved = sum(rewrite['bytes'] for rewrite in rewrites)
+        self.logger.info(' - ' + str(len(rewrites)) + ' rewrites, ' + str(saved) + ' bytes saved. Program size: '
+                         + str(pinfo['size']) + ' bytes.\n')
+        return rewrites
+
+    @staticmethod
+    def returns_balanced(program, entry, target):
+        """
+        Check that a routine can be entered with jmp instead of call (see optimize_program(...) ): every path from its \
+        first instruction ends in retc, and pops no more than it pushed and returns with nothing pushed (so it does \
+        not touch the return address). The routines that it calls are assumed to do the same.
+
+        :param program: The instructions of the program.
+        :param entry: The position of the first instruction of the routine.
+        :param target: Function that returns the position of the instruction that a jump goes to (None if it is \
+                       outside the program).
+        :return: True if the routine returns with retc and leaves the stack as it found it; False otherwise.
+        """
+        instructions = encoding_tables['instructions']
+        depths = {entry: 0}
+        work = [entry]
+        while work:
+            position = work.pop()
+            instruction_info = program[position]
+            mnemonic = instruction_info.instruction
+            depth = depths[position] + (mnemonic == 'push') - (mnemonic == 'pop')
+            if depth < 0 or mnemonic == 'reti' or mnemonic not in instructions:
+                return False
+            if mnemonic == 'retc':
+                if depth:
+                    return False
+                continue
+            instruction_type = instructions[mnemonic][0]
+            successors = [target(instruction_info)] if mnemonic == 'jmp' else [position + 1]
+            if instruction_type == 'jump_conditional':
+                successors.append(target(instruction_info))
+            for successor in successors:
+                if successor is None or successor >= len(program):
+                    return False
+                known = depths.get(successor)
+                if known is None:
+                    depths[successor] = depth
+                    work.append(successor)
+                elif known != depth:
+                    return False
+        return True
+
+    @staticmethod
+    def relocate_program(pinfo, removed):
+        """
+        Remove instructions from the analysed program, and give the instructions and labels their new addresses \
+        (the labels of a removed instruction move to the next instruction).
+
+        :param pinfo: A dictionary containing the analysed program (updated).
+        :param removed: The positions of the instructions to remove.
+        :return: Nothing
+        """
+        new_addresses = dict()
+        program = list()
+        address = 0
+        for position, instruction_info in enumerate(pinfo['program']):
+            new_addresses[instruction_info.address] = address
+            if position in removed:
+                continue
+            instruction_info.address = address
+            program.append(instruction_info)
+            address += 2
+        new_addresses[pinfo['size']] = address
+        pinfo['program'][:] = program
+        pinfo['labels'].update({label: '%02x' % new_addresses[int(old_address, 16)]
+                                for label, old_address in pinfo['labels'].items()})
+        pinfo['size'] = address
+
+    def load_template(self, filename, romfilename, created=None):
+        """
+        Load the template of the program ROM.
+
+        :param filename: The program ROM template file name.
+        :param romfilename: The file name of the resulting ROM file
+        :param created: (optional) The creation date in the header of the ROM file (see build_timestamp(...) ).
+        :return: A dictionary with program ROM structure and memory size
+        """
+        self.logger.info('Loading ROM template...')
+
+        # load the template
+        try:
+            with open(filename) as f:
+                template_text = f.read()
+        except IOError as ioe:
+            err = 'ERROR: Failed to load template file (' + filename + ').'
+            self.logger.error(err)
+            self.logger.debug(ioe.args[1])
+            raise IOError
+
+        tinfo = self.analyse_template(template_text, romfilename, created)
+
+        self.logger.info('ROM template loaded.\n')
+
+        return tinfo
+
+    def analyse_template(self, template_text, romfilename, created=None):
+        """
+        Analyse the template of the program ROM.
+
+        :param template_text: The contents of the program ROM template.
+        :param romfilename: The file name of the resulting ROM file
+        :param created: (optional) The creation date in the header of the ROM file (see build_timestamp(...) ).
+        :return: A dictionary with program ROM structure and memory size
+        """
+        return stamp_template(self.parse_template(template_text), romfilename, created)
+
+    def parse_template(self, template_text):
+        """
+        Split the template of the program ROM into its parts. The header lines with the file name and the creation \
+        date are left as they are (see stamp_template(...) ).
+
+        The size of the ROM follows from the C_ADDR_WIDTH generic of the template (or from the address width of the \
+        assembler, which then replaces the value of the generic). The lines between "-- program start" and \
+        "-- program end" are only counted for templates without that generic.
+
+        :param template_text: The contents of the program ROM template.
+        :return: A dictionary with program ROM structure and memory size
+        """
+        tinfo = {'first_part': list(), 'last_part': list(), 'program_space': None,
+                 'addr_width': None, 'data_width': None}
+
+        section = ['start', 'program', 'end']
+        si = 0
+        for line in text_lines(template_text):
+            if section[si] == 'start':
+                generic = generic_pattern.search(line)
+                if generic is not None:
+                    if generic.group(1).lower() == 'c_addr_width':
+                        if self.addr_width is not None:
+                            line = line[:generic.start(2)] + str(self.addr_width) + line[generic.end(2):]
+                        tinfo['addr_width'] = int(generic.group(2)) if self.addr_width is None else self.addr_width
+                    else:
+                        tinfo['data_width'] = int(generic.group(2))
+                tinfo['first_part'].append(line)
+                if '-- program start' in line:
+                    si += 1
+                    tinfo['program_space'] = 0
+            elif section[si] == 'program':
+                if '-- program end' in line:
+                    si += 1
+                    tinfo['last_part'].append(line)
+                else:
+                    tinfo['program_space'] += 1
+            elif section[si] == 'end':
+                tinfo['last_part'].append(line)
+            else:
+                self.logger.error('ERROR: Error while reading template file.')
+                raise ValueError
+
+        if section[si] != 'end':
+            self.logger.error('ERROR: ROM template is missing mandatory lines.')
+            raise ValueError
+
+        if tinfo['data_width'] is not None and tinfo['data_width'] != 8:
+            self.logger.error('ERROR: Unsupported data width (C_DATA_WIDTH = ' + str(tinfo['data_width'])
+                              + ', expecting 8).')
+            raise ValueError
+
+        if tinfo['addr_width'] is not None:
+            tinfo['program_space'] = 2 ** tinfo['addr_width']
+        elif self.addr_width is not None:
+            self.logger.error('ERROR: Can not change the address width, the ROM template has no C_ADDR_WIDTH generic.')
+            raise ValueError
+
+        return tinfo
+
+    def generate_rom_file(self, pinfo, rom, filename):
+        """
+        Generate program ROM file in VHDL containing the instructions of the assembled program
+
+        :param pinfo: A dictionary containing the analyzed program (provided by load_program(...) ).
+        :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+        :param filename: The file name of the VHDL file.
+        :return: Nothing
+        """
+        self.logger.info('Generating ROM memory file...')
+        image = self.encode_program(pinfo, rom)
+        self.write_rom_file(image, pinfo, rom, filename)
+
+    def write_rom_file(self, image, pinfo, rom, filename, listing=None):
+        """
+        Write the program ROM file in VHDL.
+
+        :param image: The contents of the program ROM (provided by encode_program(...) ).
+        :param pinfo: A dictionary containing the analyzed program (for the comments).
+        :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+        :param filename: The file name of the VHDL file.
+        :param listing: (optional) The ROM contents, if they are already formatted (see listing_chunks(...) ). The \
+                        program info is not used in that case.
+        :return: The number of bytes written.
+        """
+        if listing is None:
+            chunks = self.vhdl_chunks(image, pinfo, rom)
+        else:
+            chunks = [''.join(rom['first_part']), listing, ''.join(rom['last_part'])]
+        try:
+            changed = write_if_changed(filename, chunks)
+        except IOError:
+            self.logger.error('ERROR: Failed to open target file.')
+            raise IOError
+
+        if not changed:
+            self.logger.debug('ROM file is unchanged (' + filename + ').')
+        self.logger.info('Program ROM complete.')
+        return os.path.getsize(filename)
+
+    def verify_rom_file(self, image, pinfo, rom, filename):
+        """
+        Verify a ROM file that was just written: the file is read back (see read_image_file(...) ) and compared with \
+        the machine image.
+
+        :param image: The contents of the program ROM (provided by encode_program(...) ).
+        :param pinfo: A dictionary containing the analyzed program (for the source lines in the report, None if \
+                      unavailable).
+        :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
+        :param filename: The ROM file.
+        :return: Nothing. Raises ValueError if the file does not match.
+        """
+        try:
+            written = read_image_file(filename)
+        except (IOError, ValueError) as e:
+            self.logger.error('ERROR: Verification of ' + filename + ' failed: the file can not be read (' + str(e)
+                              + ').')
+            raise ValueError
+
+        errors = verify_image(image, written, rom['program_space'], pinfo)
+        if errors:
+            self.logger.error('ERROR: Verification of ' + filename + ' failed:')
+            for error in errors:
+                self.logger.error('\t' + error)
+            raise ValueError
+
+        self.logger.info('Verified ' + filename + '.')
+
+    def write_image_file(self, image, filename, output_format):
+        """
+        Write the machine image in one of the output formats (see output_formats).
+
+        :param image: The contents of the program ROM (provided by encode_program(...) ).
+        :param filename: The file name.
+        :param output_format: The name of the output format ('bin', 'hex', 'mem', 'memb' or 'coe').
+        :return: The number of bytes written.
+        """
+        formatter, binary = output_formats[output_format][1:]
+        try:
+            changed = write_if_changed(filename, formatter(image), binary)
+        except IOError:
+            self.logger.error('ERROR: Failed to open target file (' + filename + ').')
+            raise IOError
+
+        if changed:
+            self.logger.info('Program ROM written to ' + filename + ' (' + output_format + ').')
+        else:
+            self.logger.info('Program ROM written to ' + filename + ' (' + output_format + ', unchanged).')
+        return os.path.getsize(filename)
+
+    def build_rom(self, pinfo, rom):
+        """
+        Generate the VHDL description of the program ROM containing the instructions of the assembled program
+
+        :param pinfo: A dictionary containing the analyzed program (provided by analyse_program(...) ).
+        :param rom: A dictionary containing the prorgam ROM structure (provided by analyse_template(...) )
+        :return: A tuple with the VHDL text of the ROM and a bytearray with the ROM contents.
+        """
+        self.logger.info('Generating ROM memory file...')
+
+        image = self.encode_program(pinfo, rom)
+        rom_text = ''.join(self.vhdl_chunks(image, pinfo, rom))
+
+        return rom_text, image
+
+    def encode_program(self, pinfo, rom):
+        """
+        Encode the instructions of the analysed program into a machine image. The image is the single source of the \
+        ROM contents: all output formats are generated from it.
+
+        :param pinfo: A dictionary containing the analyzed program (provided by analyse_program(...) ).
+        :param rom: A dictionary containing the prorgam ROM structure (provided by analyse_template(...) )
+        :return: A bytearray with the contents of the complete program ROM.
+        """
+        # check if memory space has not been succeeded
+        if pinfo['size'] > rom['program_space']:
+            err = 'ERROR: Program size (' + str(pinfo['size']) + ' bytes) exceeds available memory (' \
+                  + str(rom['program_space']) + ' bytes).'
+            self.logger.error(err)
+            raise ValueError
+
+        # all operands are resolved before encoding
+        self.resolve_program(pinfo)
+
+        image = bytearray(rom['program_space'])
+        instructions = encoding_tables['instructions']
+
+        for instruction_info in pinfo['program']:
+            instruction_type, high_byte = instructions[instruction_info.instruction]
+            value_1, value_2 = instruction_info.values
+            address = instruction_info.address
+            image[address], image[address + 1] = type_encoders[instruction_type](high_byte, value_1, value_2)
+
+        return image
+
+    def vhdl_chunks(self, image, pinfo, rom):
+        """
+        Format a machine image as VHDL program ROM (using the template). The text is generated in chunks, so large \
+        ROMs can be streamed to a file.
+
+        :param image: The contents of the program ROM (provided by encode_program(...) ).
+        :param pinfo: A dictionary containing the analyzed program (for the comments).
+        :param rom: A dictionary containing the prorgam ROM structure (provided by analyse_template(...) )
+        :return: A generator of strings that make up the VHDL text of the program ROM.
+        """
+        # Write first part of ROM file
+        yield ''.join(rom['first_part'])
+
+        # Write program to ROM file
+        yield from self.listing_chunks(image, pinfo, rom)
+
+        # write last part of template to ROM file
+        yield ''.join(rom['last_part'])
+
+    def listing_chunks(self, image, pinfo, rom):
+        """
+        Format a machine image as the contents of the VHDL program ROM (the part between the first and the last part \
+        of the template), in the VHDL style of the assembler (see vhdl_chunks(...) for the parameters).
+
+        :return: A generator of strings that make up the ROM contents.
+        """
+        if self.vhdl_style == 'compact':
+            return self.compact_listing_chunks(image, pinfo, rom)
+        return self.verbose_listing_chunks(image, pinfo, rom)
+
+    def verbose_listing_chunks(self, image, pinfo, rom):
+        """
+        Format the ROM contents one byte per line, including every unused address (see listing_chunks(...) ).
+        """
+        trace = self.logger.isEnabledFor(TRACE)
+        comments = self.vhdl_comments
+        program_space = rom['program_space']
+
+        # the program
+        last_address = 0
+        rom_lines = list()
+        for instruction_info in pinfo['program']:
+            address = instruction_info.address
+            rom_line = vhdl_fixed_start(address) + byte_bits[image[address]] + '",' \
+                + (instruction_info.comment if comments else '\n')
+            if address == (program_space - 2):
+                rom_line += vhdl_fixed_start(address + 1) + byte_bits[image[address + 1]] + '"\n'
+            else:
+                rom_line += vhdl_fixed_start(address + 1) + byte_bits[image[address + 1]] + '",\n'
+            if trace:
+                self.logger.log(TRACE, rom_line)
+            rom_lines.append(rom_line)
+            last_address = address + 2
+            if len(rom_lines) == vhdl_chunk_lines:
+                yield ''.join(rom_lines)
+                rom_lines = list()
+        yield ''.join(rom_lines)
+
+        # fill remaining memory space with zeros (in blocks of lines)
+        for block_start in range(last_address, program_space - 1, vhdl_chunk_lines):
+            block_end = min(block_start + vhdl_chunk_lines, program_space - 1)
+            yield ''.join([vhdl_zero_line % remaining_address for remaining_address in range(block_start, block_end)])
+        if last_address < program_space:
+            yield vhdl_fixed_start(program_space - 1) + '00000000"\n'
+
+    def compact_listing_chunks(self, image, pinfo, rom):
+        """
+        Format the ROM contents as hexadecimal literals: one line per instruction (with comments) or eight bytes per \
+        line (without comments). The unused addresses are filled with a single "others" choice (see \
+        listing_chunks(...) ).
+        """
+        trace = self.logger.isEnabledFor(TRACE)
+        size = 2 * len(pinfo['program'])
+
+        rom_lines = list()
+        if self.vhdl_comments:
+            for instruction_info in pinfo['program']:
+                address = instruction_info.address
+                rom_line = vhdl_hex_pair % (address, image[address], address + 1, image[address + 1]) \
+                    + instruction_info.comment
+                if trace:
+                    self.logger.log(TRACE, rom_line)
+                rom_lines.append(rom_line)
+                if len(rom_lines) == vhdl_chunk_lines:
+                    yield ''.join(rom_lines)
+                    rom_lines = list()
+        else:
+            for line_start in range(0, size, 8):
+                rom_lines.append('\t\t' + ' '.join([vhdl_hex_byte % (address, image[address])
+                                                    for address in range(line_start, min(line_start + 8, size))])
+                                 + '\n')
+                if len(rom_lines) == vhdl_chunk_lines:
+                    yield ''.join(rom_lines)
+                    rom_lines = list()
+        yield ''.join(rom_lines)
+
+        # all remaining memory locations are zero
+        yield "\t\tothers => (others => '0')\n"
+
+    def resolve_program(self, pinfo):
+        """
+        Resolve the operands of all instructions to integer values (register codes, addresses and literals). The \
+        values are stored in the instruction info ('values').
+
+        :param pinfo: A dictionary containing the analyzed program (provided by analyse_program(...) ).
+        :return: Nothing
+        """
+        trace = self.logger.isEnabledFor(TRACE)
+        index = self.build_symbol_index(pinfo)
+        instructions = encoding_tables['instructions']
+
+        for instruction_info in pinfo['program']:
+            line = instruction_info.line
+            if trace:
+                self.logger.log(TRACE, '%r', instruction_info)
+
+            # get instruction type
+            try:
+                instruction_type = instructions[instruction_info.instruction][0]
+            except KeyError:
+                err = 'ERROR: Unknown instruction "' + instruction_info.instruction + '" (line ' + str(line+1) \
+                      + ').'
+                self.logger.error(err)
+                raise ValueError
+            try:
+                resolver = self.type_resolvers[instruction_type]
+            except KeyError:
+                # unsupported instruction type
+                err = 'ERROR: Unknown instruction type (' + instruction_type + ').'
+                self.logger.error(err)
+                raise ValueError
+
+            instruction_info.values = resolver(self, instruction_info, index)
+
+    def build_symbol_index(self, pinfo):
+        """
+        Merge the registers, labels and symbols into one index that maps every name on its final value.
+
+        A name is looked up as a register, a label or a symbol (in that order). The value of a symbol is looked up in \
+        the same way, so chained #defines (symbol -> symbol -> register or address) are followed until a register, \
+        a label address or a literal is found.
+
+        :param pinfo: A dictionary containing the program info.
+        :return: A dictionary with the value (string) of every name.
+        """
+        index = {name: name for name in asminfo['registers']}
+        for label, address in pinfo['labels'].items():
+            index.setdefault(label, address)
+
+        symbols = pinfo['symbols']
+        for symbol in symbols:
+            if symbol in index:
+                continue
+            # follow the chain of symbols
+            chain = [symbol]
+            value = symbols[symbol]
+            while value not in index and value in symbols:
+                if value in chain:
+                    err = 'ERROR: Circular definition of symbol "' + symbol + '" (' + ' -> '.join(chain) + ' -> ' \
+                          + value + ').'
+                    self.logger.error(err)
+                    raise ValueError
+                chain.append(value)
+                value = symbols[value]
+            # a register, a label or a symbol that is already resolved, otherwise the value is a literal
+            value = index.get(value, value)
+            for name in chain:
+                index[name] = value
+
+        return index
+
+    def resolve_jump(self, instruction_info, index):
+        """
+        Resolve the operands of a (conditional) jump instruction: jump address.
+
+        :param instruction_info: The instruction (see Instruction).
+        :param index: The symbol index (see build_symbol_index(...) ).
+        :return: A tuple with the values of both operands.
+        """
+        # get memory address
+        if instruction_info.operand_1 is None:
+            err = 'ERROR: Jump address not defined for instruction "' + instruction_info.instruction \
+                  + '" (line ' + str(instruction_info.line + 1) + ').'
+            self.logger.error(err)
+            raise ValueError
+
+        # lookup address in case label is used
+        address = lookup_value(instruction_info.operand_1, index)
+        if address is None:
+            err = 'ERROR: Name "' + instruction_info.operand_1 + '" is not defined (line ' \
+                  + str(instruction_info.line + 1) + ').'
+            self.logger.error(err)
+            raise ValueError
+
+        memory_address = hex_values.get(address)
+        if memory_address is None:
+            err = 'ERROR: "' + instruction_info.operand_1 + '" is not a valid jump address (line ' \
+                  + str(instruction_info.line + 1) + ').'
+            self.logger.error(err)
+            raise ValueError
+
+        return memory_address, None
+
+    def resolve_no_address(self, instruction_info, index):
+        """
+        Resolve the operands of a jump instruction without address (see resolve_jump(...) for the parameters).
+        """
+        return None, None
+
+    def resolve_single_register(self, instruction_info, index):
+        """
+        Resolve the operands of a single register instruction: Rds (see resolve_jump(...) for the parameters).
+        """
+        rds_code = self.resolve_register(instruction_info, instruction_info.operand_1, 'Source/destination', index)
+        return rds_code, None
+
+    def resolve_two_registers(self, instruction_info, index):
+        """
+        Resolve the operands of a register-to-register or indirect memory instruction: Rd, Rs (see resolve_jump(...) \
+        for the parameters).
+        """
+        rd_code = self.resolve_register(instruction_info, instruction_info.operand_1, 'Destination', index)
+        rs_code = self.resolve_register(instruction_info, instruction_info.operand_2, 'Source', index)
+        return rd_code, rs_code
+
+    def resolve_register_to_memory(self, instruction_info, index):
+        """
+        Resolve the operands of a register-to-memory instruction: address, Rs (see resolve_jump(...) for the \
+        parameters).
+        """
+        memory_address = self.resolve_byte(instruction_info, instruction_info.operand_1, 'Target address',
+                                           'a hexadecimal address', index)
+        rs_code = self.resolve_register(instruction_info, instruction_info.operand_2, 'Source', index)
+        return memory_address, rs_code
+
+    def resolve_x_to_register(self, instruction_info, index):
+        """
+        Resolve the operands of a memory/literal-to-register instruction: Rd, address or literal (see \
+        resolve_jump(...) for the parameters).
+        """
+        rd_code = self.resolve_register(instruction_info, instruction_info.operand_1, 'Destination', index)
+        address_literal = self.resolve_byte(instruction_info, instruction_info.operand_2,
+                                            'Literal or memory location', 'a hexadecimal address or number', index)
+        return rd_code, address_literal
+
+    def resolve_register(self, instruction_info, operand, role, index):
+        """
+        Look up the code of the register used as operand of an instruction.
+
+        :param instruction_info: The instruction (see Instruction).
+        :param operand: The operand (name or None if missing).
+        :param role: Role of the register (for error messages).
+        :param index: The symbol index (see build_symbol_index(...) ).
+        :return: The register code.
+        """
+        if operand is None:
+            err = 'ERROR: ' + role + ' register not defined for instruction "' + instruction_info.instruction \
+                  + '" (line ' + str(instruction_info.line + 1) + ').'
+            self.logger.error(err)
+            raise ValueError
+        # look-up symbol
+        register_code = encoding_tables['registers'].get(index.get(operand))
+        if register_code is None:
+            err = 'ERROR: Wrong register name "' + operand + '" (line ' + str(instruction_info.line + 1) + ').'
+            self.logger.error(err)
+            raise ValueError
+        return register_code
+
+    def resolve_byte(self, instruction_info, operand, role, kind, index):
+        """
+        Look up the value of the memory address or literal used as operand of an instruction.
+
+        :param instruction_info: The instruction (see Instruction).
+        :param operand: The operand (name, literal or None if missing).
+        :param role: Role of the operand (for error messages).
+        :param kind: Expected kind of value (for error messages).
+        :param index: The symbol index (see build_symbol_index(...) ).
+        :return: The value of the address or literal.
+        """
+        if operand is None:
+            err = 'ERROR: ' + role + ' unspecified for instruction "' + instruction_info.instruction \
+                  + '" (line ' + str(instruction_info.line + 1) + ').'
+            self.logger.error(err)
+            raise ValueError
+        # look-up symbol
+        value = lookup_value(operand, index)
+        byte = hex_values.get(value)
+        if byte is not None:
+            return byte
+
+        if value is None:
+            err = 'ERROR: Target address name "' + operand + '" unspecified for instruction "' \
+                  + instruction_info.instruction + '" (line ' + str(instruction_info.line + 1) + ').'
+        elif len(value) > 2:
+            # make sure the value has the correct length
+            err = 'ERROR: ' + role + ' "' + value + '" is too long (line ' + str(instruction_info.line + 1) + ').'
+        else:
+            err = 'ERROR: "' + value + '" is not ' + kind + ' (line ' + str(instruction_info.line + 1) + ').'
+        self.logger.error(err)
+        raise ValueError
+
+    # Operand resolver for every instruction type (see asminfo.py)
+    type_resolvers = {
+        'jump': resolve_jump,
+        'jump_conditional': resolve_jump,
+        'jump_no_address': resolve_no_address,
+        'single_register': resolve_single_register,
+        'register_to_register': resolve_two_registers,
+        'indirect_memory': resolve_two_registers,
+        'register_to_memory': resolve_register_to_memory,
+        'x_to_register': resolve_x_to_register
+    }
+
+
+def encode_address(high_byte, value_1, value_2):
+    """
+    Encode a (conditional) jump instruction: opcode + flag, address.
+
+    :param high_byte: The opcode (and flag) of the instruction, as most significant byte.
+    :param value_1: The value of the first operand.
+    :param value_2: The value of the second operand.
+    :return: A tuple with the two bytes of the instruction.
+    """
+    return high_byte, value_1
+
+
+def encode_no_address(high_byte, value_1, value_2):
+    """
+    Encode a jump instruction without address (see encode_address(...) for the parameters).
+    """
+    return high_byte, 0
+
+
+def encode_single_register(high_byte, value_1, value_2):
+    """
+    Encode a single register instruction: opcode + Rds, Rds (see encode_address(...) for the parameters).
+    """
+    return high_byte | value_1, value_1 << 5
+
+
+def encode_two_registers(high_byte, value_1, value_2):
+    """
+    Encode a register-to-register or indirect memory instruction: opcode + Rd, Rs (see encode_address(...) for the \
+    parameters).
+    """
+    return high_byte | value_1, value_2 << 5
+
+
+def encode_register_to_memory(high_byte, value_1, value_2):
+    """
+    Encode a register-to-memory instruction: opcode + Rs, address (see encode_address(...) for the parameters).
+    """
+    return high_byte | value_2, value_1
+
+
+def encode_x_to_register(high_byte, value_1, value_2):
+    """
+    Encode a memory/literal-to-register instruction: opcode + Rd, address or literal (see encode_address(...) for \
+    the parameters).
     """
-    global log_file
+    return high_byte | value_1, value_2
 
-    try:
-        log_file = open('build.log', 'w')
-        log("DDASM v0.1", True)
-    except IOError as ioe:
-        print('Failed to open log file (build.log). Is it still open?')
-        print(ioe.args[1])
-        print('FAILURE')
-        sys.exit(-1)
 
-    # Parse input arguments
-    try:
-        file_names = get_file_names(argv)
-    except ValueError:
-        print('FAILURE - check build.log')
-        log('FAILURE', False)
-        log_file.close()
-        sys.exit(-1)
-    except Exception as e:
-        log('Unknown error in "get_file_names()".', True)
-        log('FAILURE - check python logs', True)
-        log_file.close()
-        logging.exception(e)
-        sys.exit(-1)
+# Encoder for every instruction type (see asminfo.py)
+type_encoders = {
+    'jump': encode_address,
+    'jump_conditional': encode_address,
+    'jump_no_address': encode_no_address,
+    'single_register': encode_single_register,
+    'register_to_register': encode_two_registers,
+    'indirect_memory': encode_two_registers,
+    'register_to_memory': encode_register_to_memory,
+    'x_to_register': encode_x_to_register
+}
 
-    # Read and pre-process program
-    try:
-        analysed_program = load_program(file_names['input_file'])
-    except IOError:
-        print('FAILURE - check build.log')
-        log('FAILURE', False)
-        log_file.close()
-        sys.exit(-1)
-    except ValueError:
-        print('FAILURE - check build.log')
-        log('FAILURE', False)
-        log_file.close()
-        sys.exit(-1)
-    except Exception as e:
-        log('Unexpected error in "load_program()".', True)
-        log('FAILURE - check python logs', True)
-        log_file.close()
-        logging.exception(e)
-        sys.exit(-1)
 
-    # Read ROM template
-    try:
-        rom = load_template(file_names['template_file'], file_names['output_file'])
-    except ValueError or IOError:
-        print('FAILURE - check build.log')
-        log('FAILURE', False)
-        log_file.close()
-        sys.exit(-1)
-    except Exception as e:
-        log('Unexpected error in "load_template()".', True)
-        log('FAILURE - check python logs', True)
-        log_file.close()
-        logging.exception(e)
-        sys.exit(-1)
+class BuildLogHandler(logging.Handler):
+    """
+    Logging handler that keeps the messages in the build log (log_lines) of an assembler.
+    """
 
-    # generate VHDL ROM file
-    try:
-        generate_rom_file(analysed_program, rom, file_names['output_file'])
-    except ValueError or IOError:
-        print('FAILURE - check build.log')
-        log('FAILURE', False)
-        log_file.close()
-        sys.exit(-1)
-    except Exception as e:
-        log('Unexpected error in "generate_rom_file()".', True)
-        log('FAILURE - check python logs', True)
-        log_file.close()
-        logging.exception(e)
-        sys.exit(-1)
+    def __init__(self, assembler):
+        """
+        :param assembler: The Assembler to which the build log belongs.
+        """
+        super().__init__()
+        self.assembler = assembler
 
-    log("SUCCESS", True)
-    log_file.close()
-    sys.exit(0)
+    def emit(self, record):
+        self.assembler.log_lines.append(self.format(record))
 
 
-def log(message, do_print):
+class Instruction:
+    """
+    An instruction of the analysed program. The instructions are kept in a list (pinfo['program']) in address order.
     """
-    Log a message to the build log and print in the console (optionally).
+    __slots__ = ('line', 'address', 'instruction', 'operand_1', 'operand_2', 'text', 'values')
+
+    def __init__(self, line, address, instruction, operand_1, operand_2, text):
+        """
+        :param line: Index of the source line.
+        :param address: Address of the instruction in the program ROM.
+        :param instruction: The mnemonic (after replacing virtual instructions).
+        :param operand_1: The first operand (or None).
+        :param operand_2: The second operand (or None).
+        :param text: The instruction as written in the program (without label and comment).
+        """
+        self.line = line
+        self.address = address
+        # mnemonics and operands are repeated a lot, so only one copy of each is kept
+        self.instruction = sys.intern(instruction)
+        self.operand_1 = None if operand_1 is None else sys.intern(operand_1)
+        self.operand_2 = None if operand_2 is None else sys.intern(operand_2)
+        self.text = text
+        self.values = None
+
+    @property
+    def comment(self):
+        """
+        The comment that goes with the instruction in the VHDL ROM.
+        """
+        return ' -- ' + self.text + '\n'
+
+    def __repr__(self):
+        return '{line: %d, address: %d, instruction: %s, operand_1: %s, operand_2: %s, text: %r}' \
+               % (self.line, self.address, self.instruction, self.operand_1, self.operand_2, self.text)
+
+
+def compile_asminfo(info):
+    """
+    Compile the assembler tables (see asminfo.py) into integer lookup tables for the encoder.
 
-    :param message: String containing the log message.
-    :param do_print: Setting do_print to True will also display de logged message in the console.
-    :return: Nothing
+    :param info: The assembler tables.
+    :return: A dictionary with the 'instructions' (mnemonic -> (type, opcode and flag as most significant byte)) and \
+             the 'registers' (name -> code).
     """
-    global log_file
+    instructions = dict()
+    for mnemonic, instruction in info['instructions'].items():
+        high_byte = int(instruction['opcode'], 2) << 3
+        if 'flag' in instruction:
+            high_byte |= int(instruction['flag'], 2)
+        instructions[mnemonic] = (instruction['type'], high_byte)
 
-    log_file.write(message)
-    log_file.write('\n')
+    registers = dict()
+    for name, code in info['registers'].items():
+        registers[name] = int(code, 2)
 
-    if do_print:
-        print(message)
+    return {'instructions': instructions, 'registers': registers}
 
 
-def print_usage():
+# Digest of the assembler tables (part of the key of the build cache)
+asminfo_digest = hashlib.sha256(json.dumps(asminfo, sort_keys=True).encode('utf-8')).hexdigest()
+
+# Integer versions of the assembler tables (compiled once)
+encoding_tables = compile_asminfo(asminfo)
+
+# Value of every hexadecimal byte ('0' - 'f' and '00' - 'ff')
+hex_values = {'%02x' % byte_value: byte_value for byte_value in range(256)}
+hex_values.update({'%x' % byte_value: byte_value for byte_value in range(16)})
+
+# Generic of the ROM template that defines the address width or the data width
+generic_pattern = re.compile(r'\b(c_addr_width|c_data_width)\s*:\s*\w+\s*:=\s*(\d+)', re.IGNORECASE)
+
+# Memory location in a VHDL program ROM: address, binary value or hexadecimal value (see read_vhdl_image(...) )
+vhdl_value_pattern = re.compile(r'\b(\d+)\s*=>\s*(?:"([01]{8})"|x"([0-9a-f]{2})")', re.IGNORECASE)
+
+# Byte of the ROM (compact VHDL style)
+vhdl_hex_byte = '%d => x"%02X",'
+
+# Instruction of the ROM (compact VHDL style, followed by the comment)
+vhdl_hex_pair = '\t\t%d => x"%02X", %d => x"%02X",'
+
+# Number of ROM lines per chunk of VHDL text (see Assembler.vhdl_chunks(...) )
+vhdl_chunk_lines = 4096
+
+# ROM line of an unused memory location (but the last one)
+vhdl_zero_line = '\t\t%3d => "00000000",\n'
+
+# Hexadecimal representation of every byte value (one per line)
+byte_hex = ['%02X\n' % byte_value for byte_value in range(256)]
+
+# Binary representation of every byte value
+byte_bits = ['{:08b}'.format(byte_value) for byte_value in range(256)]
+
+
+def format_bin(image):
     """
-    Print an informational message on how to use the DDASM assembler.
+    Format a machine image as raw binary file.
 
-    :return: Nothing
+    :param image: The contents of the program ROM.
+    :return: A list of chunks (bytes) that make up the file.
     """
-    print('USAGE: python ddasm.py program_name.dda [vhdl_rom.vhd]')
-    print(' * program_name.dda : File containing the assembly program')
-    print(' * vhdl_rom.vhd     : (optional) File where VHDL description of program ROM is written to.')
-    print('                      If not specified, the file name will be "program_name.vhd".')
+    return [bytes(image)]
 
 
-def get_file_names(argv):
+def format_intel_hex(image):
     """
-    Analyse the list of arguments to determine which files should be loaded.
+    Format a machine image as Intel HEX file (data records of 16 bytes, extended linear address records for ROMs \
+    larger than 64 kB).
 
-    :param argv: This is the list of arguments passed with the "main" script. The first item in the list, argv[0], \
-                 the name of the script.
-    :return: a dictionary containing the name of the 'input_file', 'output_file' and the 'template_file'
+    :param image: The contents of the program ROM.
+    :return: A generator of chunks (strings) that make up the file.
     """
-    argc = len(argv)
-    do_print = True
+    records = list()
+    for address in range(0, len(image), 16):
+        if address > 0 and address % 0x10000 == 0:
+            records.append(intel_hex_record(0, 4, (address >> 16).to_bytes(2, 'big')))
+        records.append(intel_hex_record(address & 0xffff, 0, image[address:address + 16]))
+        if len(records) >= vhdl_chunk_lines:
+            yield ''.join(records)
+            records = list()
+    records.append(intel_hex_record(0, 1, b''))
+    yield ''.join(records)
+
+
+def intel_hex_record(address, record_type, data):
+    """
+    :param address: The (16-bit) address of the record.
+    :param record_type: The type of the record (0: data, 1: end of file, 4: extended linear address).
+    :param data: The data of the record (bytes).
+    :return: The record (a line of an Intel HEX file).
+    """
+    record = bytes([len(data), address >> 8, address & 0xff, record_type]) + bytes(data)
+    checksum = -sum(record) & 0xff
+    return ':' + record.hex().upper() + '%02X\n' % checksum
 
-    fns = {'input_file': '', 'output_file': '', 'template_file': 'ROM_template.vhd'}
-    if argc == 1:
-        err = 'ERROR: Not enough input arguments (' + str(argc-1) + '). Expecting at least 1.'
-        log(err, do_print)
-        print_usage()
-        raise ValueError
-    elif argc == 2:
-        fns['input_file'] = argv[1]
-    elif argc == 3:
-        fns['input_file'] = argv[1]
-        fns['output_file'] = argv[2]
-    else:
-        err = 'ERROR: Too many input arguments (' + str(argc - 1) + '). Expecting 2 at most.'
-        log(err, False)
-        print_usage()
-        raise ValueError
 
-    if len(fns['output_file']) == 0:
-        dot_index = fns['input_file'].find('.')
-        if dot_index < 0:
-            log('WARNING: Input file name is missing an extension!', True)
-            input_file_name = fns['input_file']
-        else:
-            input_file_name = fns['input_file'][0:dot_index]
-        fns['output_file'] = input_file_name + '.vhd'
-    else:
-        dot_index = fns['output_file'].find('.')
-        if dot_index < 0:
-            log('WARNING: Output file name is missing an extension!', True)
+def format_readmemh(image):
+    """
+    Format a machine image as memory file for $readmemh (one hexadecimal byte per line).
 
-    msg = ' - input:    ' + fns['input_file'] + '\n'
-    msg += ' - output:   ' + fns['output_file'] + '\n'
-    msg += ' - template: ' + fns['template_file'] + '\n'
-    log(msg, False)
+    :param image: The contents of the program ROM.
+    :return: A generator of chunks (strings) that make up the file.
+    """
+    for address in range(0, len(image), vhdl_chunk_lines):
+        yield ''.join([byte_hex[byte] for byte in image[address:address + vhdl_chunk_lines]])
 
-    return fns
 
+def format_readmemb(image):
+    """
+    Format a machine image as memory file for $readmemb (one binary byte per line).
 
-def load_program(filename):
+    :param image: The contents of the program ROM.
+    :return: A generator of chunks (strings) that make up the file.
     """
-    Load and analyse the DDASM program.
+    for address in range(0, len(image), vhdl_chunk_lines):
+        yield ''.join([byte_bits[byte] + '\n' for byte in image[address:address + vhdl_chunk_lines]])
 
-    :param filename: Specifies the name of the file that contains the program.
-    :return: A dictionary containing information of the analysed program.
+
+def format_coe(image):
     """
-    do_print = False
-    # load the program
-    try:
-        with open(filename) as f:
-            raw_text = f.readlines()
-    except IOError:
-        err = 'ERROR: Failed to open program (' + filename + ').'
-        log(err, True)
-        raise IOError
+    Format a machine image as Xilinx coefficient (.coe) file, e.g. for a block memory generator.
 
-    log('Analysing program...', True)
+    :param image: The contents of the program ROM.
+    :return: A generator of chunks (strings) that make up the file.
+    """
+    yield 'memory_initialization_radix=16;\nmemory_initialization_vector=\n'
+    for address in range(0, len(image), vhdl_chunk_lines):
+        text = ''.join([byte_hex[byte][:2] + ',\n' for byte in image[address:address + vhdl_chunk_lines]])
+        if address + vhdl_chunk_lines >= len(image):
+            # the last value ends the vector
+            text = text[:-2] + ';\n'
+        yield text
+
+
+# Output formats of the machine image: format name -> (extension, formatter, binary file)
+output_formats = {
+    'bin': ('.bin', format_bin, True),
+    'hex': ('.hex', format_intel_hex, False),
+    'mem': ('.mem', format_readmemh, False),
+    'memb': ('_bin.mem', format_readmemb, False),
+    'coe': ('.coe', format_coe, False)
+}
+
+
+def read_image_file(filename):
+    """
+    Read a machine image from a ROM file in one of the output formats (the format follows from the extension: .vhd, \
+    .vhdl, .bin, .hex, .mem or .coe).
 
-    # analyse text
-    line_index = 0
-    pinfo = {'program': {}, 'labels': {}, 'symbols': {}, 'size': 0}
-    address = 0
-    for line in raw_text:
-        is_instruction = False
-        # split line into categories
-        sline = line.strip().lower()
-        scindex = sline.find(';')
-        # isolate instruction from comment
-        if scindex >= 0:
-            asm = sline[0:scindex].strip()
-        else:
-            asm = sline
-        # check for #define
-        if asm.lower().find('#define') >= 0:
-            # check formatting of #define-directive
-            ops = split_instruction(asm.lower())
-            if len(ops) < 3:
-                err = 'ERROR: "#define" is missing arguments'
-                log(err, True)
-            if len(ops) > 3:
-                err = 'ERROR: Too much arguments with "#define"'
-                log(err, True)
-            if ops[0] != '#define':
-                err = 'ERROR: Found something before #define. Check your code!'
-                log(err, True)
-            symbol = ops[1]
-            value = ops[2]
-            if symbol[0].isdigit():
-                err = 'ERROR: Symbol name can not start with a number'
-                log(err, True)
-            # check if symbol is already defined
-            defined_symbols = pinfo['symbols'].keys()
-            if symbol in defined_symbols:
-                err = 'ERROR: Symbol name "' + symbol + '" already defined.\n'
-                err += '\tline ' + str(line_index + 1) + ' -> ' + line.strip()
-                log(err, True)
+    :param filename: The file name.
+    :return: A bytearray with the contents of the program ROM. Raises IOError if the file can not be read and \
+             ValueError if the format is unknown or the file is malformed.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    reader = image_readers.get(extension)
+    if reader is None:
+        raise ValueError('Unknown ROM file format (' + extension + ').')
+    if extension == '.bin':
+        with open(filename, 'rb') as f:
+            return reader(f.read())
+    with open(filename) as f:
+        return reader(f.read())
+
+
+def read_vhdl_image(text):
+    """
+    Read a machine image from a VHDL program ROM (verbose or compact style). The size of the ROM follows from the \
+    C_ADDR_WIDTH generic (or else from the highest address); locations that are not listed are zero.
+
+    :param text: The VHDL text.
+    :return: A bytearray with the contents of the program ROM.
+    """
+    values = dict()
+    for address, bits, hex_digits in vhdl_value_pattern.findall(text):
+        values[int(address)] = int(bits, 2) if bits else int(hex_digits, 16)
+    if not values:
+        raise ValueError('No ROM contents found.')
+
+    size = max(values) + 1
+    for name, width in generic_pattern.findall(text):
+        if name.lower() == 'c_addr_width':
+            size = 2 ** int(width)
+    if max(values) >= size:
+        raise ValueError('Address ' + str(max(values)) + ' is outside of the ROM (' + str(size) + ' bytes).')
+
+    image = bytearray(size)
+    for address, value in values.items():
+        image[address] = value
+    return image
+
+
+def read_bin_image(data):
+    """
+    Read a machine image from a raw binary file.
+
+    :param data: The contents of the file (bytes).
+    :return: A bytearray with the contents of the program ROM.
+    """
+    return bytearray(data)
+
+
+def read_intel_hex_image(text):
+    """
+    Read a machine image from an Intel HEX file (data, end of file and extended address records).
+
+    :param text: The contents of the file.
+    :return: A bytearray with the contents of the program ROM (up to the highest address in the file).
+    """
+    image = bytearray()
+    base_address = 0
+    for line_index, line in enumerate(text_lines(text)):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if line[0] != ':':
                 raise ValueError
-            else:
-                # if not, add it to the list
-                pinfo['symbols'][symbol] = value
-            # no need to further analyse this line, go to next
-        else:
-            # check for label
-            scindex = asm.find(':')
-            if scindex == 0:
-                err = 'ERROR: Semicolon (:) at the start of line.\n'
-                err += '\tline ' + str(line_index+1) + ' -> ' + line
-                err += 'Expecting a label.'
-                log(err, True)
+            record = bytes.fromhex(line[1:])
+            if len(record) < 5 or len(record) != record[0] + 5 or sum(record) & 0xff:
                 raise ValueError
-            if scindex > 0:
-                # we have a label, now we do some checks
-                label = asm[0:scindex].strip()
-                # check if first character is a number
-                if label[0].isdigit():
-                    err = 'ERROR: Label can not start with a number.\n'
-                    err += '\tline ' + str(line_index+1) + ' -> ' + line.strip()
-                    log(err, True)
-                    raise ValueError
-                # check if the label contains spaces
-                if (label.find(' ') > 0) or (label.find('\t') > 0):
-                    err = 'ERROR: Label can not contain spaces.\n'
-                    err += '\tline ' + str(line_index+1) + ' -> ' + line.strip()
-                    log(err, True)
-                    raise ValueError
-                # check if the label is already defined
-                defined_labels = pinfo['labels'].keys()
-                if label in defined_labels:
-                    err = 'ERROR: Label "' + label + '" already defined.\n'
-                    err += '\tline ' + str(line_index+1) + ' -> ' + line.strip()
-                    log(err, True)
-                    raise ValueError
-                else:
-                    # add label to list
-                    pinfo['labels'][label] = '%02x' % address
-                    # now we do some further checking
-                    if 'reset' in defined_labels:
-                        if pinfo['labels']['reset'] != '00':
-                            err = 'ERROR: Label "reset" should have address "00".\n'
-                            err += '\tline ' + str(line_index+1) + ' -> ' + line.strip()
-                            log(err, True)
-                            raise ValueError
-                    if 'isr' in defined_labels:
-                        if pinfo['labels']['isr'] != '02':
-                            err = 'ERROR: Label "isr" should have address "02".\n'
-                            err += '\tline ' + str(line_index+1) + ' -> ' + line.strip()
-                            log(err, True)
-                            raise ValueError
-
-                # in case that an instruction follows the label
-                asm = asm[scindex:].replace(':', ' ').strip()
-
-            vhdl_comment = ' -- ' + asm + '\n'
-
-            ins = None
-            op_1 = None
-            op_2 = None
-            # parse instruction
-            ops = split_instruction(asm)
-            if len(ops) > 0:
-                is_instruction = True
-                ins = ops[0]
-                if len(ops) > 1:
-                    op_1 = ops[1]
-                    if len(ops) > 2:
-                        op_2 = ops[2]
-                        if len(ops) > 3:
-                            err = 'ERROR: Wrong instruction format.\n'
-                            err += '\tline ' + str(line_index + 1) + ' -> ' + line.strip()
-                            log(err, True)
-                            raise ValueError
+        except ValueError:
+            raise ValueError('Malformed Intel HEX record (line ' + str(line_index + 1) + ').')
+        record_type = record[3]
+        data = record[4:-1]
+        if record_type == 0:
+            address = base_address + (record[1] << 8 | record[2])
+            if len(image) < address + len(data):
+                image.extend(bytes(address + len(data) - len(image)))
+            image[address:address + len(data)] = data
+        elif record_type == 1:
+            break
+        elif record_type == 2:
+            base_address = int.from_bytes(data, 'big') << 4
+        elif record_type == 4:
+            base_address = int.from_bytes(data, 'big') << 16
+    return image
+
+
+def read_readmem_image(text):
+    """
+    Read a machine image from a memory file for $readmemh or $readmemb (the radix is detected: binary if all values \
+    have 8 binary digits). Comments (//) and address markers (@address) are supported.
+
+    :param text: The contents of the file.
+    :return: A bytearray with the contents of the program ROM.
+    """
+    words = list()
+    for line in text_lines(text):
+        words.extend(line.partition('//')[0].split())
+    radix = 2 if all(len(w) == 8 and not w.strip('01') for w in words if w[0] != '@') else 16
+
+    image = bytearray()
+    address = 0
+    try:
+        for word in words:
+            if word[0] == '@':
+                address = int(word[1:], 16)
+                continue
+            if len(image) <= address:
+                image.extend(bytes(address + 1 - len(image)))
+            image[address] = int(word, radix)
+            address += 1
+    except ValueError:
+        raise ValueError('Malformed memory file value ("' + word + '").')
+    return image
 
-                # check for virtual instruction and if so do replacement
-                if ins in asminfo['virtual_instructions']:
-                    op_2 = asminfo['virtual_instructions'][ins]['operand_2']
-                    ins = asminfo['virtual_instructions'][ins]['replace_with']
-
-            # update program info (and set next instruction address)
-            if is_instruction:
-                pinfo['program'][line_index] = {'address': address,
-                                                'instruction': ins,
-                                                'operand_1': op_1,
-                                                'operand_2': op_2,
-                                                'comment': vhdl_comment}
-                address = address + 2
 
-        # process next line
-        line_index = line_index + 1
+def read_coe_image(text):
+    """
+    Read a machine image from a Xilinx coefficient (.coe) file.
 
-    # Log a list of the labels that are defined in the program
-    log('- Labels defined in ' + filename + ':', do_print)
-    labels_table = format_symbols_table(pinfo['labels'], 'label', 'address (hex)')
-    log(labels_table, do_print)
-    # Log a list of the symbols that are defined in the program
-    log('- Symbols defined in ' + filename + ':', do_print)
-    symbols_table = format_symbols_table(pinfo['symbols'], 'symbols', 'value')
-    log(symbols_table, do_print)
+    :param text: The contents of the file.
+    :return: A bytearray with the contents of the program ROM.
+    """
+    settings = dict()
+    for statement in text.split(';'):
+        statement = ' '.join(line.partition(';')[0] for line in text_lines(statement)).strip()
+        if '=' in statement:
+            name, _, value = statement.partition('=')
+            settings[name.strip().lower()] = value
+    try:
+        radix = int(settings.get('memory_initialization_radix', '16'))
+        vector = settings['memory_initialization_vector'].replace(',', ' ').split()
+        return bytearray(int(value, radix) for value in vector)
+    except (KeyError, ValueError):
+        raise ValueError('Malformed .coe file.')
 
-    # Update program size
-    pinfo['size'] = address
-    msg = ' - Program size: ' + str(pinfo['size']) + ' bytes.\n\nAnalysis complete.\n\n'
-    log(msg, True)
 
-    return pinfo
+# Readers of the output formats: extension -> reader
+image_readers = {
+    '.vhd': read_vhdl_image,
+    '.vhdl': read_vhdl_image,
+    '.bin': read_bin_image,
+    '.hex': read_intel_hex_image,
+    '.mem': read_readmem_image,
+    '.coe': read_coe_image
+}
 
 
-def load_template(filename, romfilename):
+def stamp_template(tinfo, romfilename, created=None):
     """
-    Load the template of the program ROM.
+    Fill in the file name and the creation date in the header of a (parsed) ROM template.
 
-    :param filename: The program ROM template file name.
+    :param tinfo: A dictionary with program ROM structure (provided by Assembler.parse_template(...) ).
     :param romfilename: The file name of the resulting ROM file
-    :return: A dictionary with program ROM structure and memory size
+    :param created: (optional) The creation date (see build_timestamp(...) ).
+    :return: A new dictionary with program ROM structure and memory size
     """
     # To put creation date in ROM file
-    dt = datetime.now()
+    dt = build_timestamp() if created is None else created
     datestr = dt.strftime('--      Created: %H:%M:%S %d-%m-%Y\r\n')
-    
+
     # To put filename in ROM file
     filestr = '--         File: ' + romfilename + '\r\n'
-    
-    # print(datestr)
-    tinfo = {'first_part': list(), 'last_part': list(), 'program_space': None}
-
-    log('Loading ROM template...', True)
 
-    # load the template
-    try:
-        with open(filename) as f:
-            raw_text = f.readlines()
-    except IOError as ioe:
-        err = 'ERROR: Failed to load template file (' + filename + ').'
-        log(err, True)
-        log(ioe.args[1], False)
-        raise IOError
-
-    section = ['start', 'program', 'end']
-    si = 0
-    for line in raw_text:
-        if section[si] == 'start':
-            if '--      Created' in line:
-                tinfo['first_part'].append(datestr)
-            elif '--         File' in line:
-                tinfo['first_part'].append(filestr)
-            else:
-                tinfo['first_part'].append(line)
-                if '-- program start' in line:
-                    si += 1
-                    tinfo['program_space'] = 0
-        elif section[si] == 'program':
-            if '-- program end' in line:
-                si += 1
-                tinfo['last_part'].append(line)
-            else:
-                tinfo['program_space'] += 1
-        elif section[si] == 'end':
-            tinfo['last_part'].append(line)
+    first_part = list()
+    for line in tinfo['first_part']:
+        if '--      Created' in line:
+            first_part.append(datestr)
+        elif '--         File' in line:
+            first_part.append(filestr)
         else:
-            log('ERROR: Error while reading template file.', True)
-            raise ValueError
+            first_part.append(line)
 
-    if section[si] != 'end':
-        log('ERROR: ROM template is missing mandatory lines.', True)
-        raise ValueError
-
-    log('ROM template loaded.\n', True)
+    stamped = dict(tinfo)
+    stamped['first_part'] = first_part
+    return stamped
 
-    return tinfo
 
-
-def generate_rom_file(pinfo, rom, filename):
+def build_timestamp(source_file=None):
     """
-    Generate program ROM file in VHDL containing the instructions of the assembled program
+    Determine the creation date that is put in the header of a ROM file. For reproducible builds, the date is taken \
+    from the SOURCE_DATE_EPOCH environment variable (seconds since 1970-01-01 UTC) or else from the modification \
+    time of the program.
 
-    :param pinfo: A dictionary containing the analyzed program (provided by load_program(...) ).
-    :param rom: A dictionary containing the prorgam ROM structure (provided by load_template(...) )
-    :param filename: The file name of the VHDL file.
-    :return: Nothing
+    :param source_file: (optional) The file containing the program. Without it (and without SOURCE_DATE_EPOCH), \
+                        the current time is used.
+    :return: The creation date (a datetime). Raises ValueError if SOURCE_DATE_EPOCH is not a number.
     """
-    do_print = False
-    log('Generating ROM memory file...', True)
-
-    try:
-        rom_file = open(filename, 'w')
-    except IOError:
-        log('ERROR: Failed to open target file.', True)
-        raise IOError
-
-    # check if memory space has not been succeeded
-    if pinfo['size'] > rom['program_space']:
-        err = 'ERROR: Program size (' + str(pinfo['size']) + ' bytes) exceeds available memory (' \
-              + str(rom['program_space']) + ' bytes).'
-        log(err, True)
-        raise ValueError
-
-    # Write first part of ROM file
-    for line in rom['first_part']:
-        rom_file.write(line)
-
-    # Write program to ROM file
-    last_address = 0
-    for line in sorted(pinfo['program']):
-        instruction_info = pinfo['program'][line]
-        log(str(instruction_info), do_print)
-
-        # get instruction type
-        try:
-            instruction_type = asminfo['instructions'][instruction_info['instruction']]['type']
-        except KeyError:
-            err = 'ERROR: Unknown instruction "' + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-            log(err, True)
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch is not None:
+        if not epoch.strip().isdigit():
+            logger.error('ERROR: SOURCE_DATE_EPOCH should be a number of seconds (' + epoch + ').')
             raise ValueError
+        return datetime.fromtimestamp(int(epoch), timezone.utc)
+    if source_file is not None:
+        return datetime.fromtimestamp(int(os.path.getmtime(source_file)), timezone.utc)
+    return datetime.now()
 
-        # get instruction opcode
-        instruction_opcode = asminfo['instructions'][instruction_info['instruction']]['opcode']
-        # print(instruction_type)
-
-        rom_line = vhdl_fixed_start(instruction_info['address'])
-        if instruction_type == 'jump':
-            # get memory address
-            if instruction_info['operand_1'] is None:
-                err = 'ERROR: Jump address not defined for instruction "' + instruction_info['instruction'] \
-                      + '" (line ' + str(line + 1) + ').'
-                log(err, True)
-                raise ValueError
-
-            # lookup address in case label is used
-            address = lookup_name(instruction_info['operand_1'], pinfo)
-            if address is None:
-                err = 'ERROR: Name "' + instruction_info['operand_1'] + '" is not defined (line ' + str(line + 1) + ').'
-                log(err, True)
-                raise ValueError
 
-            # convert hex address to binary representation
-            memory_address = address_hex_to_binary(address)
+def write_if_changed(filename, chunks, binary=False):
+    """
+    Write a file atomically, and only if its contents change. The chunks are written to a temporary file in the \
+    same directory, which then replaces the file. If the file already has the same contents, it is left untouched \
+    (so its modification time does not change either). A new file gets the usual permissions (the umask of the \
+    process applies), a file that is replaced keeps its permissions.
+
+    :param filename: The file name.
+    :param chunks: An iterable of strings (or bytes, for a binary file) that make up the contents of the file.
+    :param binary: Setting binary to True writes a binary file.
+    :return: True if the file was written, False if it was unchanged.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, temp_name = create_temp_file(directory, '.' + os.path.basename(filename) + '.')
+    try:
+        with os.fdopen(handle, 'wb' if binary else 'w') as f:
+            f.writelines(chunks)
+        if os.path.isfile(filename):
+            if filecmp.cmp(temp_name, filename, shallow=False):
+                os.remove(temp_name)
+                return False
+            os.chmod(temp_name, stat.S_IMODE(os.stat(filename).st_mode))
+        os.replace(temp_name, filename)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    return True
+
+
+def create_temp_file(directory, prefix):
+    """
+    Create a new temporary file. Unlike tempfile.mkstemp(...), which creates a private file, the permissions follow \
+    from the umask of the process (as for open(...) ).
 
-            # assemble jump instruction
-            rom_line += instruction_opcode + '000",' + instruction_info['comment']
-            if instruction_info['address'] == (rom['program_space'] - 2):
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + memory_address + '"\n'
-            else:
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + memory_address + '",\n'
-
-        elif instruction_type == 'jump_conditional':
-            # get memory address
-            if instruction_info['operand_1'] is None:
-                err = 'ERROR: Jump address not defined for instruction "' + instruction_info['instruction']\
-                      + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
+    :param directory: The directory of the file.
+    :param prefix: The start of the file name.
+    :return: A tuple with the handle of the file (opened for writing) and its name.
+    """
+    flags = os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0)
+    while True:
+        temp_name = os.path.join(directory, '%s%d.%s.tmp' % (prefix, os.getpid(), os.urandom(6).hex()))
+        try:
+            return os.open(temp_name, flags, 0o666), temp_name
+        except FileExistsError:
+            continue
 
-            # lookup address in case label is used
-            address = lookup_name(instruction_info['operand_1'], pinfo)
-            if address is None:
-                err = 'ERROR: Name "' + instruction_info['operand_1'] + '" is not defined (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
 
-            # convert hex address to binary representation
-            memory_address = address_hex_to_binary(address)
+def text_lines(text):
+    """
+    Split a text into lines (like readlines() on a file opened in text mode).
 
-            # look up conditional flag
-            conditional_flag = asminfo['instructions'][instruction_info['instruction']]['flag']
+    :param text: The text to split.
+    :return: A list of lines, each ending in '\\n' (except for the last line, possibly).
+    """
+    return io.StringIO(text, newline=None).readlines()
 
-            # assemble jump instruction
-            rom_line += instruction_opcode + conditional_flag + '",' + instruction_info['comment']
-            if instruction_info['address'] == (rom['program_space'] - 2):
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + memory_address + '"\n'
-            else:
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + memory_address + '",\n'
 
-        elif instruction_type == 'jump_no_address':
-            # assemble jump instruction (no address specified)
-            rom_line += instruction_opcode + '000",' + instruction_info['comment']
-            if instruction_info['address'] == (rom['program_space'] - 2):
-                rom_line += vhdl_fixed_start(instruction_info['address']+1) + '00000000"\n'
-            else:
-                rom_line += vhdl_fixed_start(instruction_info['address']+1) + '00000000",\n'
-
-        elif instruction_type == 'single_register':
-            # get destination/source register code
-            if instruction_info['operand_1'] is None:
-                err = 'ERROR: Source/destination register not defined for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # look-up symbol
-            operand_1 = lookup_name(instruction_info['operand_1'], pinfo)
-            try:
-                rds_code = asminfo['registers'][operand_1]
-            except KeyError:
-                err = 'ERROR: Wrong register name "' + instruction_info['operand_1'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # assemble single register instruction
-            rom_line += instruction_opcode + rds_code + '",' + instruction_info['comment']
-            if instruction_info['address'] == (rom['program_space'] - 2):
-                rom_line += vhdl_fixed_start(instruction_info['address']+1) + rds_code + '00000"\n'
-            else:
-                rom_line += vhdl_fixed_start(instruction_info['address']+1) + rds_code + '00000",\n'
-
-        elif instruction_type == 'register_to_register' or instruction_type == 'indirect_memory':
-            # get destination register code
-            if instruction_info['operand_1'] is None:
-                err = 'ERROR: Destination register not defined for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # look-up symbol
-            operand_1 = lookup_name(instruction_info['operand_1'], pinfo)
-            try:
-                rd_code = asminfo['registers'][operand_1]
-            except KeyError:
-                err = 'ERROR: Wrong register name "' + instruction_info['operand_1'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # get source register code
-            if instruction_info['operand_2'] is None:
-                err = 'ERROR: Source register not defined for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # look-up symbol
-            operand_2 = lookup_name(instruction_info['operand_2'], pinfo)
-            try:
-                rs_code = asminfo['registers'][operand_2]
-            except KeyError:
-                err = 'ERROR: Wrong register name "' + instruction_info['operand_2'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # assemble register-to-register instruction
-            rom_line += instruction_opcode + rd_code + '",' + instruction_info['comment']
-            if instruction_info['address'] == (rom['program_space'] - 2):
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + rs_code + '00000"\n'
-            else:
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + rs_code + '00000",\n'
-
-        elif instruction_type == 'register_to_memory':
-            # get memory address
-            # check if 0 < length <= 2
-            if instruction_info['operand_1'] is None:
-                err = 'ERROR: Target address unspecified for instruction "' + instruction_info['instruction']\
-                      + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # look-up symbol
-            operand_1 = lookup_name(instruction_info['operand_1'], pinfo)
-            if operand_1 is None:
-                err = 'ERROR: Target address name "' + instruction_info['operand_1'] + '" unspecified for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            else:
-                instruction_info['operand_1'] = operand_1
-            # make sure the address has the correct length
-            if len(instruction_info['operand_1']) > 2:
-                err = 'ERROR: Target address "' + instruction_info['operand_1'] + '" is too long (line '\
-                      + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # convert to binary representation
-            try:
-                memory_address = address_hex_to_binary(instruction_info['operand_1'])
-            except KeyError:
-                err = 'ERROR: "' + instruction_info['operand_1'] + '" is not a hexadecimal address (line '\
-                      + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
+def tokenize_program(raw_text):
+    """
+    Split the lines of a DDASM program into tokens, classifying every line in a single pass.
 
-            # get source register code
-            if instruction_info['operand_2'] is None:
-                err = 'ERROR: Source register not defined for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # look-up symbol
-            operand_2 = lookup_name(instruction_info['operand_2'], pinfo)
-            try:
-                rs_code = asminfo['registers'][operand_2]
-            except KeyError:
-                err = 'ERROR: Wrong register name "' + instruction_info['operand_2'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # assemble register-to-memory instruction
-            rom_line += instruction_opcode + rs_code + '",' + instruction_info['comment']
-            if instruction_info['address'] == (rom['program_space'] - 2):
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + memory_address + '"\n'
-            else:
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + memory_address + '",\n'
-
-        elif instruction_type == 'x_to_register':
-            # get destination register code
-            if instruction_info['operand_1'] is None:
-                err = 'ERROR: Destination register not defined for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            # look-up symbol
-            operand_1 = lookup_name(instruction_info['operand_1'], pinfo)
-            try:
-                rd_code = asminfo['registers'][operand_1]
-            except KeyError:
-                err = 'ERROR: Wrong register name "' + instruction_info['operand_1'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
+    The tokens are tuples:
+        ('define', line index, symbol, value)
+        ('label', line index, label)
+        ('instruction', line index, mnemonic, operand 1 or None, operand 2 or None, instruction text)
+        ('error', line index, description)
 
-            # get memory address or literal
-            # check if operand_2 is present
-            if instruction_info['operand_2'] is None:
-                err = 'ERROR: Literal or memory location unspecified for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line + 1) + ').'
-                log(err, True)
-                raise ValueError
-            # look-up symbol
-            operand_2 = lookup_name(instruction_info['operand_2'], pinfo)
-            if operand_2 is None:
-                err = 'ERROR: Target address name "' + instruction_info['operand_2'] + '" unspecified for instruction "'\
-                      + instruction_info['instruction'] + '" (line ' + str(line+1) + ').'
-                log(err, True)
-                raise ValueError
-            else:
-                instruction_info['operand_2'] = operand_2
-            # check length
-            if len(instruction_info['operand_2']) > 2:
-                err = 'ERROR: Literal or memory location "' + instruction_info['operand_2'] + '" is too long (line '\
-                      + str(line + 1) + ').'
-                log(err, True)
-                raise ValueError
-            # convert to binary representation
-            try:
-                address_literal = address_hex_to_binary(instruction_info['operand_2'])
-            except KeyError:
-                err = 'ERROR: "' + instruction_info['operand_2'] + '" is not a hexadecimal address or number (line '\
-                      + str(line + 1) + ').'
-                log(err, True)
-                raise ValueError
+    Well-formed lines are handled here with a few string operations per line. Anything unusual (and every line that \
+    contains an error) is handed to scan_line(...).
 
-            # assemble memory/literal-to-register instruction
-            rom_line += instruction_opcode + rd_code + '",' + instruction_info['comment']
-            if instruction_info['address'] == (rom['program_space'] - 2):
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + address_literal + '"\n'
+    :param raw_text: The lines of the program.
+    :return: A generator of tokens.
+    """
+    # the whole program is converted to lower case at once
+    lower_lines = ''.join(raw_text).lower().split('\n')
+    for line_index, line in enumerate(lower_lines):
+        # isolate instruction from comment
+        asm = line.partition(';')[0].strip()
+        if len(asm) == 0:
+            continue
+
+        # check for label
+        if ':' in asm:
+            label, _, asm = asm.partition(':')
+            label = label.rstrip()
+            if len(label) == 0 or label[0].isdigit() or ' ' in label or '\t' in label or ':' in asm \
+                    or '#define' in asm:
+                yield from scan_line(raw_text[line_index], line_index)
+                continue
+            yield 'label', line_index, label
+            # in case that an instruction follows the label
+            asm = asm.strip()
+            if len(asm) == 0:
+                continue
+
+        # split instruction or #define-directive
+        ops = asm.replace(',', ' ').split()
+        number_of_ops = len(ops)
+        if '#define' in asm:
+            if number_of_ops == 3 and ops[0] == '#define' and not ops[1][0].isdigit():
+                yield 'define', line_index, ops[1], ops[2]
             else:
-                rom_line += vhdl_fixed_start(instruction_info['address'] + 1) + address_literal + '",\n'
-
+                yield from scan_line(raw_text[line_index], line_index)
+        elif number_of_ops == 1:
+            yield 'instruction', line_index, ops[0], None, None, asm
+        elif number_of_ops == 2:
+            yield 'instruction', line_index, ops[0], ops[1], None, asm
+        elif number_of_ops == 3:
+            yield 'instruction', line_index, ops[0], ops[1], ops[2], asm
         else:
-            # unsupported instruction type
-            err = 'ERROR: Unknown instruction type (' + instruction_type + ').'
-            log(err, True)
-            raise ValueError
-
-        log(rom_line, do_print)
-        rom_file.write(rom_line)
-        last_address = instruction_info['address'] + 2
+            yield from scan_line(raw_text[line_index], line_index)
 
-    # fill remaining memory space with zeros
-    for remaining_address in range(last_address, rom['program_space']):
-        if remaining_address == (rom['program_space']-1):
-            rom_line = vhdl_fixed_start(remaining_address) + '00000000"\n'
-        else:
-            rom_line = vhdl_fixed_start(remaining_address) + '00000000",\n'
-        rom_file.write(rom_line)
 
-    # write last part of template to ROM file
-    for line in rom['last_part']:
-        rom_file.write(line)
+def scan_line(line, line_index):
+    """
+    Tokenize a line that is not handled by the fast path of tokenize_program(...). This is also where the errors \
+    in the formatting of a line are detected.
 
-    rom_file.close()
-    log('Program ROM complete.', True)
+    :param line: The line of the program.
+    :param line_index: Index of the line.
+    :return: A generator of tokens (see tokenize_program(...) ).
+    """
+    # isolate instruction from comment
+    asm = line.strip().lower().partition(';')[0].strip()
+    # check for #define
+    if '#define' in asm:
+        # check formatting of #define-directive
+        ops = split_instruction(asm)
+        if len(ops) < 3:
+            yield 'error', line_index, '"#define" is missing arguments.'
+        elif len(ops) > 3:
+            yield 'error', line_index, 'Too much arguments with "#define".'
+        elif ops[0] != '#define':
+            yield 'error', line_index, 'Found something before #define. Check your code!'
+        elif ops[1][0].isdigit():
+            yield 'error', line_index, 'Symbol name can not start with a number.'
+        else:
+            yield 'define', line_index, ops[1], ops[2]
+        return
+
+    # check for label
+    scindex = asm.find(':')
+    if scindex == 0:
+        yield 'error', line_index, 'Semicolon (:) at the start of line. Expecting a label.'
+        return
+    if scindex > 0:
+        # we have a label, now we do some checks
+        label = asm[0:scindex].strip()
+        # check if first character is a number
+        if label[0].isdigit():
+            yield 'error', line_index, 'Label can not start with a number.'
+            return
+        # check if the label contains spaces
+        if (label.find(' ') > 0) or (label.find('\t') > 0):
+            yield 'error', line_index, 'Label can not contain spaces.'
+            return
+        yield 'label', line_index, label
+        # in case that an instruction follows the label
+        asm = asm[scindex:].replace(':', ' ').strip()
+
+    # parse instruction
+    ops = split_instruction(asm)
+    if len(ops) > 3:
+        yield 'error', line_index, 'Wrong instruction format.'
+    elif len(ops) > 0:
+        ops.extend([None, None])
+        yield 'instruction', line_index, ops[0], ops[1], ops[2], asm
 
 
 def vhdl_fixed_start(address):
@@ -736,72 +2938,29 @@ def split_instruction(ins):
     return splitins
 
 
-def lookup_name(name, pinfo):
+def lookup_value(name, index):
     """
-    Lookup if a symbol or label name is defined in the program info dictionary.
+    Look up the value of a name (register, label or symbol) or literal.
 
     :param name: Name to look up.
-    :param pinfo: A dictionary containing the program info.
-    :return: None if the name does not exist, otherwise the name itself.
+    :param index: The symbol index (see Assembler.build_symbol_index(...) ).
+    :return: None if the name does not exist, otherwise the value of the name (or the literal itself).
     """
-    if is_defined(name, asminfo['registers']):
+    value = index.get(name)
+    if value is None and (name in hex_values or is_hex(name)):
+        # hexadecimal literals come last to avoid early return on names that can be interpreted as hex (eg: BCD)
         return name
-
-    if is_defined(name, pinfo['labels']):
-        return pinfo['labels'][name]
-
-    if is_defined(name, pinfo['symbols']):
-        return pinfo['symbols'][name]
-
-    if is_hex(name):    # should be last to avoid early return on names that can be interpreted as hex (eg: BCD)
-        return name
-
-    return None
+    return value
 
 
 def address_hex_to_binary(address):
-    if len(address) == 1:
-        address = '0' + address
-        
     """
     Convert a hexadecimal address (string representation) to binary (string representation).
 
     :param address: The address to convert.
     :return: The binary address.
     """
-    binary_lookup = {
-        '0': '0000',
-        '1': '0001',
-        '2': '0010',
-        '3': '0011',
-        '4': '0100',
-        '5': '0101',
-        '6': '0110',
-        '7': '0111',
-        '8': '1000',
-        '9': '1001',
-        'a': '1010',
-        'b': '1011',
-        'c': '1100',
-        'd': '1101',
-        'e': '1110',
-        'f': '1111'
-    }
-
-    if len(address) == 1:
-        binary_address = '0000'
-    else:
-        try:
-            binary_address = binary_lookup[address[0]]
-        except KeyError as ke:
-            raise ke
-
-    try:
-        binary_address += binary_lookup[address[1]]
-    except KeyError as ke:
-        raise ke
-
-    return binary_address
+    return byte_bits[hex_values[address[0:2]]]
 
 
 def is_hex(s):
@@ -818,94 +2977,34 @@ def is_hex(s):
         return False
 
 
-def is_defined(s, table):
-    """
-    Test if a symbol or label is defined.
-
-    :param s: The symbol to look up.
-    :param table: A dictionary containing the labels and symbols.
-    :return: True if defined, False otherwise.
-    """
-    try:
-        table[s]   # Exploiting possible KeyError
-        return True
-    except KeyError:
-        return False
-
-
 def format_symbols_table(symbols_list, symbol_name, value='address'):
     """
-    Print out the table with symbols and labels in a readable format.
+    Format the table with symbols and labels in a readable format.
 
-    :param symbols_list:
-    :param symbol_name:
-    :param value:
-    :return: Nothing
+    :param symbols_list: A dictionary with the symbols (or labels) and their value.
+    :param symbol_name: Header of the first column.
+    :param value: Header of the second column.
+    :return: The table (string).
     """
     if not bool(symbols_list.keys()):
         msg = '\n\tNo symbols of type "' + symbol_name + '" have been defined.\n'
         return msg
 
-    longest_name = 0
-    longest_value = 0
     # determine maximum length of items in each column
-    for symbol in symbols_list.keys():
-        if len(symbol) > longest_name:
-            longest_name = len(symbol)
-        if len(symbols_list[symbol]) > longest_value:
-            longest_value = len(symbols_list[symbol])
-    if longest_name < len(symbol_name):
-        longest_name = len(symbol_name)
-    if longest_value < len(value):
-        longest_value = len(value)
-
-    # top rule
-    table = '\n\t+'
-    for x in range(0, longest_name):
-        table += '-'
-    table += '--+'
-    for x in range(0, longest_value):
-        table += '-'
-    table += '--+\n'
-
-    # table header
-    table += '\t| ' + symbol_name
-    for x in range(len(symbol_name), longest_name):
-        table += ' '
-    table += ' | ' + value
-    for x in range(len(value), longest_value):
-        table += ' '
-    table += ' |\n'
-
-    # middle rule
-    table += '\t+'
-    for x in range(0, longest_name):
-        table += '-'
-    table += '--+'
-    for x in range(0, longest_value):
-        table += '-'
-    table += '--+\n'
+    longest_name = max(len(symbol_name), max(len(symbol) for symbol in symbols_list))
+    longest_value = max(len(value), max(len(symbol_value) for symbol_value in symbols_list.values()))
 
-    # print lines
-    for symbol in symbols_list.keys():
-        table += '\t| ' + symbol
-        for x in range(len(symbol), longest_name):
-            table += ' '
-        table += ' | ' + symbols_list[symbol]
-        for x in range(len(symbols_list[symbol]), longest_value):
-            table += ' '
-        table += ' |\n'
+    rule = '\t+' + '-' * (longest_name + 2) + '+' + '-' * (longest_value + 2) + '+\n'
+    row = '\t| %-' + str(longest_name) + 's | %-' + str(longest_value) + 's |\n'
 
+    # top rule, table header and middle rule
+    table = ['\n', rule, row % (symbol_name, value), rule]
+    # print lines
+    table.extend(row % item for item in symbols_list.items())
     # bottom rule
-    table += '\t+'
-    for x in range(0, longest_name):
-        table += '-'
-    table += '--+'
-    for x in range(0, longest_value):
-        table += '-'
-    table += '--+\n'
-
-    return table
+    table.append(rule)
+
+    return ''.join(table)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,891 @@
+"""
+Batch simulator for the LDD mark II processor. It runs one program against many stimuli (changes of the buttons and \
+switches over time, e.g. the test cases of an assignment) in lockstep: the state of the processors is kept in NumPy \
+arrays with one lane per stimulus, and every instruction is executed for all lanes at once (see ddsim.py for the \
+simulator of a single run).
+DDASM = Digital Design Assmebly
+LDD = Lab Digital Design
+Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
+"""
+import sys
+import time
+import logging
+from ddasm import encoding_tables, pop_option, positive_number, setup_logging, close_logging
+from ddsim import Simulator, Board, load_image, decode_instruction, instruction_cycles, parse_stimulus, \
+    positive_time, default_stack_depth, default_clock_frequency, max_idle_interval, data_memory_size, io_start, \
+    irqe_address, irqf_address, timer_address, switches_addresses, buttons_address, output_names, \
+    buttons_irq_mask, timer_irq_mask, flag_names
+
+# NumPy is only needed for the batch simulator
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Default maximum number of different program counters that are executed in lockstep (see BatchSimulator.run(...) )
+default_max_divergence = 8
+
+# Cycle count of an event that never happens
+never = 1 << 62
+
+# Inputs that can be changed by a stimulus
+stimulus_inputs = ('buttons', 'switches')
+
+
+def main(argv):
+    """
+    Simulate a program for a list of stimuli.
+
+    :param argv: The list of command line arguments passed to this script.
+    :return: The script returns exit code 0 on success; -1 otherwise.
+    """
+    args = list(argv[1:])
+    try:
+        max_cycles = pop_option(args, '--cycles', positive_number)
+        seconds = pop_option(args, '--seconds', positive_time)
+        clock_frequency = pop_option(args, '--clock', positive_number) or default_clock_frequency
+        max_divergence = pop_option(args, '--max-divergence', positive_number) or default_max_divergence
+        addr_width = pop_option(args, '--addr-width', positive_number)
+        template_file = pop_option(args, '--template', str) or 'ROM_template.vhd'
+    except ValueError:
+        print('ERROR: "--cycles", "--clock", "--max-divergence" and "--addr-width" expect a positive number, '
+              '"--seconds" a positive time and "--template" a file name.')
+        print_usage()
+        return -1
+    if len(args) != 2:
+        print('ERROR: Expecting 1 program or ROM file and 1 stimuli file.')
+        print_usage()
+        return -1
+    if np is None:
+        print('ERROR: The batch simulator requires NumPy (pip install numpy).')
+        return -1
+    if seconds is not None:
+        max_cycles = int(round(seconds * clock_frequency))
+    if max_cycles is None:
+        max_cycles = 1000000
+
+    handlers = setup_logging({'console_level': logging.WARNING, 'log_level': logging.WARNING, 'log_file': None})
+    try:
+        image, _ = load_image(args[0], template_file, addr_width)
+        stimuli = read_stimuli(args[1])
+    except (IOError, ValueError) as e:
+        print('ERROR: Failed to load ' + ' or '.join(args) + (' (' + str(e) + ').' if str(e) else '.'))
+        return -1
+    finally:
+        close_logging(handlers)
+    if not stimuli:
+        print('ERROR: No stimuli in ' + args[1] + '.')
+        return -1
+
+    batch = BatchSimulator(image, stimuli, clock_frequency=clock_frequency, max_divergence=max_divergence)
+    start = time.perf_counter()
+    batch.run(max_cycles)
+    elapsed = time.perf_counter() - start
+
+    for lane in range(batch.lanes):
+        print(batch.format_lane(lane))
+    instructions = int(batch.instructions.sum())
+    failures = sum(error is not None for error in batch.errors)
+    print('%d lanes (%d failed, %d run separately): %d instructions in %.3f s (%.2f M instructions/s)'
+          % (batch.lanes, failures, len(batch.lane_boards), instructions, elapsed,
+             instructions / max(elapsed, 1e-9) / 1e6))
+    simulated = float(batch.cycles.sum()) / clock_frequency
+    print('%.3f s simulated at %d Hz (%.1f simulated s per s)'
+          % (simulated, clock_frequency, simulated / max(elapsed, 1e-9)))
+    return -1 if failures else 0
+
+
+def print_usage():
+    """
+    Print an informational message on how to use the batch simulator.
+
+    :return: Nothing
+    """
+    print('USAGE: python ddbatch.py (program.dda | rom_file) stimuli_file [--cycles N] [--seconds S] [--clock HZ]')
+    print('                         [--max-divergence N] [--addr-width N] [--template FILE]')
+    print(' * program.dda        : DDA program (assembled in memory, see ddasm.py)')
+    print(' * rom_file           : Program ROM (.vhd, .bin, .hex, .mem or .coe file)')
+    print(' * stimuli_file       : One lane per line: "buttons=T:HH,... switches=T:HHHH,..." (or "-" for no input)')
+    print(' * --cycles N         : (optional) Number of clock cycles to simulate (default: 1000000).')
+    print(' * --seconds S        : (optional) Simulated time (s); replaces --cycles.')
+    print(' * --clock HZ         : (optional) Clock frequency of the processor (default: 100000000).')
+    print(' * --max-divergence N : (optional) Maximum number of different program counters that are executed in')
+    print('                        lockstep; beyond it, the lanes of the least common ones are simulated')
+    print('                        separately (default: 8).')
+    print(' * --addr-width N     : (optional) Address width of the program ROM (for a DDA program).')
+    print(' * --template FILE    : (optional) The program ROM template (for a DDA program).')
+
+
+def read_stimuli(filename):
+    """
+    Read a stimuli file: one lane per line, with the changes of the inputs as NAME=TIME:VALUE,... fields (see \
+    ddsim.parse_stimulus(...) ). A line "-" is a lane without changes; empty lines and comments (#) are skipped.
+
+    :param filename: The stimuli file.
+    :return: A list with a dictionary for every lane: input name ('buttons' or 'switches') -> list of (time, value) \
+             tuples. Raises IOError or ValueError if the file cannot be read.
+    """
+    stimuli = list()
+    with open(filename) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            stimulus = {name: list() for name in stimulus_inputs}
+            for field in line.split():
+                if field == '-':
+                    continue
+                name, _, changes = field.partition('=')
+                if name not in stimulus:
+                    raise ValueError('unknown input "%s" on line %d' % (name, line_number))
+                try:
+                    stimulus[name].extend(parse_stimulus(changes))
+                except ValueError:
+                    raise ValueError('invalid changes "%s" on line %d' % (changes, line_number))
+            stimuli.append(stimulus)
+    return stimuli
+
+
+class BatchSimulator:
+    """
+    Lockstep simulator of the LDD mark II processor and the peripherals of the lab board (see ddsim.Board), with \
+    one lane for every stimulus.
+
+    The state of the processors is kept in NumPy arrays with a column per lane: registers (8 x lanes), flags (5 x \
+    lanes), memory (256 x lanes), stack (stack depth x lanes, with stack_pointer), and pc, cycles and instructions \
+    (one entry per lane). An instruction is executed for all lanes with the same program counter at once: the \
+    handlers (see compile_batch_handlers(...) ) take the indices of these lanes (masked execution). As long as \
+    every lane runs the same code, a step executes a single instruction; when the lanes diverge (a conditional \
+    jump, an interrupt at another time), a step executes one instruction for every program counter. When there are \
+    more than max_divergence of them, the lanes of the least common ones are simulated separately from then on (by \
+    ddsim.Simulator and ddsim.Board, with fast-forwarding).
+
+    The peripherals follow ddsim.Board: the events of every lane (changes of the inputs and timer ticks) are handled \
+    before the first instruction that starts at or after their cycle. Idle loops are fast-forwarded per lane: when a \
+    lane jumps back to the start of a loop in the same state as at the last check, the remaining passes up to its \
+    next event are only counted. A lane that fails (unknown instruction, stack overflow or underflow, program \
+    counter outside the program ROM) stops, with the error message in errors.
+    """
+
+    def __init__(self, image, stimuli, stack_depth=default_stack_depth, clock_frequency=default_clock_frequency,
+                 max_divergence=default_max_divergence, fast_forward=True, record_outputs=False):
+        """
+        :param image: The contents of the program ROM.
+        :param stimuli: A list with the stimulus of every lane: a dictionary with the changes of the inputs, input \
+                        name ('buttons' or 'switches') -> list of (time in seconds, value) tuples.
+        :param stack_depth: Number of entries of the stack.
+        :param clock_frequency: The clock frequency of the processor (Hz).
+        :param max_divergence: Maximum number of different program counters that are executed in lockstep.
+        :param fast_forward: Setting fast_forward to False executes idle loops pass by pass.
+        :param record_outputs: Setting record_outputs to True keeps a list of the changes of the outputs of every \
+                               lane in output_log: (cycle, address, value) tuples.
+        """
+        if np is None:
+            raise ImportError('The batch simulator requires NumPy.')
+        lanes = len(stimuli)
+        self.image = bytes(image)
+        self.lanes = lanes
+        self.stack_depth = stack_depth
+        self.clock_frequency = clock_frequency
+        self.max_divergence = max_divergence
+        self.fast_forward = fast_forward
+        self.lane_indices = np.arange(lanes)
+        self.registers = np.zeros((8, lanes), np.int32)
+        self.flags = np.zeros((len(flag_names), lanes), bool)
+        self.saved_flags = np.zeros((len(flag_names), lanes), bool)
+        self.memory = np.zeros((data_memory_size, lanes), np.uint8)
+        self.stack = np.zeros((stack_depth, lanes), np.int32)
+        self.stack_pointer = np.zeros(lanes, np.int32)
+        self.pc = np.zeros(lanes, np.int64)
+        self.cycles = np.zeros(lanes, np.int64)
+        self.instructions = np.zeros(lanes, np.int64)
+        self.in_interrupt = np.zeros(lanes, bool)
+        self.interrupt_pending = np.zeros(lanes, bool)
+        self.interrupt_request = np.zeros(lanes, bool)
+        self.halted = np.zeros(lanes, bool)
+        self.errors = [None] * lanes
+        self.separate = np.zeros(lanes, bool)
+        self.output_log = [list() for _ in range(lanes)] if record_outputs else None
+        # lanes that are simulated separately: lane -> ddsim.Board
+        self.lane_boards = dict()
+
+        # the changes of the inputs of every lane, ordered by cycle (padded with events that never happen)
+        events = list()
+        for stimulus in stimuli:
+            lane_events = list()
+            for kind, name in enumerate(stimulus_inputs):
+                lane_events.extend((int(round(at * clock_frequency)), kind, value)
+                                   for at, value in stimulus.get(name, ()))
+            events.append(sorted(lane_events, key=lambda event: event[0]))
+        width = max([len(lane_events) for lane_events in events] + [0]) + 1
+        self.stimulus_cycle = np.full((lanes, width), never, np.int64)
+        self.stimulus_kind = np.zeros((lanes, width), np.int32)
+        self.stimulus_value = np.zeros((lanes, width), np.int32)
+        for lane, lane_events in enumerate(events):
+            for index, (cycle, kind, value) in enumerate(lane_events):
+                self.stimulus_cycle[lane, index] = cycle
+                self.stimulus_kind[lane, index] = kind
+                self.stimulus_value[lane, index] = value
+        self.stimulus_index = np.zeros(lanes, np.int64)
+        self.timer_tick = np.full(lanes, never, np.int64)
+        self.next_event = self.stimulus_cycle[:, 0].copy()
+
+        # state of every lane at the last check of an idle loop (see fast_forward_lanes(...) )
+        self.idle_start = np.full(lanes, -1, np.int64)
+        self.idle_cycles = np.zeros(lanes, np.int64)
+        self.idle_instructions = np.zeros(lanes, np.int64)
+        self.idle_state = [np.zeros_like(array) for array in self.state_arrays()]
+        # loop start -> [passes to skip before the next check, interval between checks]
+        self.idle_checks = dict()
+
+        self.handlers = compile_batch_handlers(self)
+        self.program = self.predecode(self.image)
+
+    def predecode(self, image):
+        """
+        Decode every address of the program ROM (see ddsim.Simulator.predecode(...) ).
+
+        :param image: The contents of the program ROM.
+        :return: A list with the decoded instruction (handler, operand, operand, cycles) at every address.
+        """
+        program = list()
+        padded = image + b'\x00'
+        for address in range(len(image)):
+            decoded = decode_instruction(padded[address], padded[address + 1])
+            if decoded is None:
+                program.append((self.handlers['unknown'], padded[address], padded[address + 1], 0))
+            else:
+                mnemonic, handler_name, operand_1, operand_2 = decoded
+                program.append((self.handlers[handler_name], operand_1, operand_2, instruction_cycles[mnemonic]))
+        return program
+
+    def run(self, max_cycles):
+        """
+        Run every lane for a number of clock cycles (the last instruction is always completed, see \
+        ddsim.Simulator.run(...) ).
+
+        :param max_cycles: Number of clock cycles to execute.
+        :return: Nothing
+        """
+        end = self.cycles + max_cycles
+        for lane, board in self.lane_boards.items():
+            self.run_lane(lane, board, int(end[lane]))
+
+        program = self.program
+        pc = self.pc
+        cycles = self.cycles
+        instructions = self.instructions
+        next_event = self.next_event
+        everyone = slice(None)
+        while True:
+            # as in ddsim.Board, the events that are due are handled before the lanes stop
+            lanes = np.flatnonzero(~self.halted & ~self.separate)
+            due = lanes[next_event[lanes] <= cycles[lanes]]
+            if len(due):
+                self.handle_events(due)
+                continue
+            active = lanes[cycles[lanes] < end[lanes]]
+            if len(active) == 0:
+                break
+
+            pcs = pc[active]
+            first = pcs[0]
+            if (pcs == first).all():
+                groups = [(int(first), everyone if len(active) == self.lanes else active)]
+            else:
+                addresses, counts = np.unique(pcs, return_counts=True)
+                if len(addresses) > self.max_divergence:
+                    # the lanes of the least common program counters continue separately
+                    rare = addresses[np.argsort(-counts, kind='stable')[self.max_divergence:]]
+                    self.run_separately(active[np.isin(pcs, rare)], end)
+                    continue
+                groups = [(int(address), active[pcs == address]) for address in addresses]
+
+            for address, lanes in groups:
+                if address >= len(program):
+                    self.fail(self.indices(lanes), 'Program counter (%02X) outside the program ROM.' % address)
+                    continue
+                handler, operand_1, operand_2, cost = program[address]
+                lanes = handler(lanes, address, operand_1, operand_2)
+                cycles[lanes] += cost
+                instructions[lanes] += 1
+                # a jump back to the start of a loop
+                if self.fast_forward and handler.jumps and operand_1 <= address:
+                    self.check_idle(lanes, operand_1, end)
+
+    def indices(self, lanes):
+        """
+        :param lanes: Lanes: an array of lane indices or a slice of all lanes.
+        :return: The array of lane indices.
+        """
+        return self.lane_indices[lanes]
+
+    def fail(self, lanes, message):
+        """
+        Stop lanes after an error.
+
+        :param lanes: The indices of the lanes.
+        :param message: The error message.
+        :return: Nothing
+        """
+        for lane in lanes:
+            self.errors[lane] = message
+        self.halted[lanes] = True
+
+    def handle_events(self, lanes):
+        """
+        Handle the events that are due in some lanes: requested interrupts, changes of the inputs and timer ticks \
+        (the changes of the inputs before the timer ticks of the same cycle, as in ddsim.Board).
+
+        :param lanes: The indices of the lanes with an event that is due.
+        :return: Nothing
+        """
+        memory = self.memory
+        while len(lanes):
+            requested = lanes[self.interrupt_request[lanes]]
+            if len(requested):
+                self.interrupt_request[requested] = False
+                self.interrupt(requested[(memory[irqe_address, requested] & memory[irqf_address, requested]) != 0])
+
+            cycles = self.cycles[lanes]
+            index = self.stimulus_index[lanes]
+            stimulus_cycle = self.stimulus_cycle[lanes, index]
+            timer_tick = self.timer_tick[lanes]
+            is_stimulus = (stimulus_cycle <= cycles) & (stimulus_cycle <= timer_tick)
+            is_tick = ~is_stimulus & (timer_tick <= cycles)
+
+            changed = lanes[is_stimulus]
+            if len(changed):
+                kinds = self.stimulus_kind[changed, index[is_stimulus]]
+                values = self.stimulus_value[changed, index[is_stimulus]]
+                self.stimulus_index[changed] += 1
+                buttons = changed[kinds == 0]
+                if len(buttons):
+                    values_buttons = values[kinds == 0]
+                    pressed = values_buttons & ~memory[buttons_address, buttons]
+                    memory[buttons_address, buttons] = values_buttons & 0xff
+                    self.raise_flag(buttons[pressed != 0], buttons_irq_mask)
+                switches = changed[kinds == 1]
+                if len(switches):
+                    values_switches = values[kinds == 1]
+                    memory[switches_addresses[0], switches] = values_switches & 0xff
+                    memory[switches_addresses[1], switches] = (values_switches >> 8) & 0xff
+
+            ticked = lanes[is_tick]
+            if len(ticked):
+                self.timer_tick[ticked] += self.clock_frequency
+                self.raise_flag(ticked, timer_irq_mask)
+
+            self.update_next_event(lanes)
+            lanes = lanes[self.next_event[lanes] <= self.cycles[lanes]]
+            lanes = lanes[~self.halted[lanes]]
+
+    def update_next_event(self, lanes):
+        """
+        :param lanes: The indices of the lanes whose events changed.
+        :return: Nothing
+        """
+        next_event = np.minimum(self.timer_tick[lanes], self.stimulus_cycle[lanes, self.stimulus_index[lanes]])
+        requested = self.interrupt_request[lanes]
+        self.next_event[lanes] = np.where(requested, np.minimum(next_event, self.cycles[lanes]), next_event)
+
+    def raise_flag(self, lanes, mask):
+        """
+        Set an interrupt flag, and request an interrupt in the lanes where it is enabled.
+
+        :param lanes: The indices of the lanes.
+        :param mask: The flag (bit mask of IRQF).
+        :return: Nothing
+        """
+        memory = self.memory
+        memory[irqf_address, lanes] |= mask
+        self.interrupt(lanes[(memory[irqe_address, lanes] & mask) != 0])
+
+    def interrupt(self, lanes):
+        """
+        Request an interrupt (see ddsim.Simulator.interrupt() ).
+
+        :param lanes: The indices of the lanes.
+        :return: Nothing
+        """
+        self.interrupt_pending[lanes[self.in_interrupt[lanes]]] = True
+        lanes = lanes[~self.in_interrupt[lanes]]
+        full = self.stack_pointer[lanes] >= self.stack_depth
+        for lane in lanes[full]:
+            self.fail([lane], 'Stack overflow at address %02X (interrupt).' % self.pc[lane])
+        lanes = lanes[~full]
+        self.stack[self.stack_pointer[lanes], lanes] = self.pc[lanes]
+        self.stack_pointer[lanes] += 1
+        self.saved_flags[:, lanes] = self.flags[:, lanes]
+        self.in_interrupt[lanes] = True
+        self.pc[lanes] = 2
+
+    def store(self, address, lanes, values):
+        """
+        Write to the data memory, through the peripherals for an I/O location.
+
+        :param address: The address.
+        :param lanes: The lanes (see indices(...) ).
+        :param values: The values that are written.
+        :return: Nothing
+        """
+        memory = self.memory
+        if address == irqe_address:
+            # enabling a flag that is already set requests an interrupt
+            newly_enabled = values & ~memory[irqe_address, lanes] & memory[irqf_address, lanes]
+            requested = self.indices(lanes)[newly_enabled != 0]
+            self.interrupt_request[requested] = True
+            self.next_event[requested] = self.cycles[requested]
+        elif address == timer_address:
+            enabled = memory[timer_address, lanes] & 1
+            indices = self.indices(lanes)
+            started = indices[(values & 1 != 0) & (enabled == 0)]
+            stopped = indices[(values & 1 == 0) & (enabled != 0)]
+            self.timer_tick[started] = self.cycles[started] + self.clock_frequency
+            self.timer_tick[stopped] = never
+            self.update_next_event(np.concatenate((started, stopped)))
+        elif address in output_names and self.output_log is not None:
+            changed = values != memory[address, lanes]
+            for lane, value in zip(self.indices(lanes)[changed], values[changed]):
+                self.output_log[lane].append((int(self.cycles[lane]), address, int(value)))
+        memory[address, lanes] = values
+
+    def check_idle(self, lanes, start, end):
+        """
+        Check whether lanes that jumped back to the start of a loop are idle, and fast-forward them (see \
+        fast_forward_lanes(...) ). A loop that is not idle is checked less and less often.
+
+        :param lanes: The lanes that executed the jump (see indices(...) ).
+        :param start: The start of the loop (the target of the jump).
+        :param end: The cycle count at which every lane stops.
+        :return: Nothing
+        """
+        check = self.idle_checks.setdefault(start, [0, 0])
+        if check[0]:
+            check[0] -= 1
+            return
+        lanes = self.indices(lanes)
+        lanes = lanes[self.pc[lanes] == start]
+        if self.fast_forward_lanes(lanes, start, end):
+            check[1] = 0
+        else:
+            check[1] = min(2 * check[1] + 1, max_idle_interval)
+        check[0] = check[1]
+
+    def state_arrays(self):
+        """
+        :return: The arrays with the state of the processors (except the program counter and the counters), with a \
+                 lane in every column or entry.
+        """
+        return (self.memory, self.registers, self.flags, self.stack, self.stack_pointer, self.in_interrupt,
+                self.interrupt_pending)
+
+    def fast_forward_lanes(self, lanes, start, end):
+        """
+        Fast-forward the lanes that are at the start of a loop in the same state as at the last check: all whole \
+        periods up to their next event (or the end of the run) are skipped, only counted (see ddsim.Simulator).
+
+        :param lanes: The indices of the lanes at the start of the loop.
+        :param start: The start of the loop.
+        :param end: The cycle count at which every lane stops.
+        :return: True if at least one lane was fast-forwarded; False otherwise.
+        """
+        same = self.idle_start[lanes] == start
+        for array, snapshot in zip(self.state_arrays(), self.idle_state):
+            equal = array[..., lanes] == snapshot[..., lanes]
+            same &= equal if equal.ndim == 1 else equal.all(axis=0)
+        idle = lanes[same]
+        if len(idle):
+            period_cycles = self.cycles[idle] - self.idle_cycles[idle]
+            period_instructions = self.instructions[idle] - self.idle_instructions[idle]
+            limit = np.minimum(self.next_event[idle], end[idle])
+            periods = np.maximum((limit - self.cycles[idle]) // period_cycles, 0)
+            self.cycles[idle] += periods * period_cycles
+            self.instructions[idle] += periods * period_instructions
+
+        self.idle_start[lanes] = start
+        self.idle_cycles[lanes] = self.cycles[lanes]
+        self.idle_instructions[lanes] = self.instructions[lanes]
+        for array, snapshot in zip(self.state_arrays(), self.idle_state):
+            snapshot[..., lanes] = array[..., lanes]
+        return len(idle) > 0
+
+    def run_separately(self, lanes, end):
+        """
+        Simulate lanes separately from now on, each by a ddsim.Simulator and ddsim.Board.
+
+        :param lanes: The indices of the lanes.
+        :param end: The cycle count at which every lane stops.
+        :return: Nothing
+        """
+        for lane in lanes:
+            lane = int(lane)
+            simulator = Simulator(self.image, self.stack_depth, fast_forward=self.fast_forward)
+            board = Board(simulator, self.clock_frequency)
+            simulator.registers[:] = self.registers[:, lane].tolist()
+            simulator.flags[:] = self.flags[:, lane].tolist()
+            simulator.saved_flags[:] = self.saved_flags[:, lane].tolist()
+            simulator.memory[:] = self.memory[:, lane].tobytes()
+            simulator.stack[:] = self.stack[:self.stack_pointer[lane], lane].tolist()
+            simulator.pc = int(self.pc[lane])
+            simulator.cycles = int(self.cycles[lane])
+            simulator.instructions = int(self.instructions[lane])
+            simulator.in_interrupt = bool(self.in_interrupt[lane])
+            simulator.interrupt_pending = bool(self.interrupt_pending[lane])
+
+            # the remaining changes of the inputs, then the timer (so they come first in the same cycle)
+            for index in range(int(self.stimulus_index[lane]), self.stimulus_cycle.shape[1]):
+                cycle = int(self.stimulus_cycle[lane, index])
+                if cycle == never:
+                    break
+                value = int(self.stimulus_value[lane, index])
+                if self.stimulus_kind[lane, index] == 0:
+                    board.schedule(cycle, lambda _, value=value, board=board: board.set_buttons(value))
+                else:
+                    board.schedule(cycle, lambda _, value=value, board=board: board.set_switches(value))
+            if self.timer_tick[lane] != never:
+                board.timer_generation += 1
+                board.schedule_tick(int(self.timer_tick[lane]), board.timer_generation)
+            if self.output_log is not None:
+                board.output_listeners.append(lambda cycle, address, value, log=self.output_log[lane]:
+                                              log.append((cycle, address, value)))
+
+            self.lane_boards[lane] = board
+            self.separate[lane] = True
+            self.run_lane(lane, board, int(end[lane]))
+
+    def run_lane(self, lane, board, end):
+        """
+        Run a lane that is simulated separately, and copy its state back into the arrays.
+
+        :param lane: The index of the lane.
+        :param board: The ddsim.Board of the lane.
+        :param end: The cycle count at which the lane stops.
+        :return: Nothing
+        """
+        simulator = board.simulator
+        if not self.halted[lane] and simulator.cycles < end:
+            try:
+                board.run(max_cycles=end - simulator.cycles)
+            except ValueError as e:
+                self.fail([lane], str(e))
+        self.registers[:, lane] = simulator.registers
+        self.flags[:, lane] = simulator.flags
+        self.saved_flags[:, lane] = simulator.saved_flags
+        self.memory[:, lane] = np.frombuffer(bytes(simulator.memory), np.uint8)
+        self.stack[:len(simulator.stack), lane] = simulator.stack
+        self.stack_pointer[lane] = len(simulator.stack)
+        self.pc[lane] = simulator.pc
+        self.cycles[lane] = simulator.cycles
+        self.instructions[lane] = simulator.instructions
+        self.in_interrupt[lane] = simulator.in_interrupt
+        self.interrupt_pending[lane] = simulator.interrupt_pending
+
+    def format_lane(self, lane):
+        """
+        :param lane: The index of a lane.
+        :return: The state of the lane (program counter, outputs, registers and error) on a line.
+        """
+        memory = self.memory[:, lane]
+        line = ('lane %3d  PC: %02X  LEDS: %02X%02X  BCD3-0: %X %X %X %X  R0-R7: %s'
+                % ((lane, self.pc[lane]) + tuple(memory[address] for address in (0xf1, 0xf0, 0xfb, 0xfa, 0xf9, 0xf8))
+                   + (' '.join('%02X' % value for value in self.registers[:, lane]),)))
+        if self.errors[lane] is not None:
+            line += '  ERROR: ' + self.errors[lane]
+        return line
+
+
+def compile_batch_handlers(batch):
+    """
+    Build the dispatch table of a batch simulator (see ddsim.compile_handlers(...) ). A handler is called with the \
+    lanes that execute the instruction (an array of lane indices, or a slice of all lanes), the address of the \
+    instruction and its two decoded operands; it executes the instruction in these lanes, sets their program \
+    counter and returns the lanes that completed it (lanes that fail are stopped). The handlers of jumps have the \
+    attribute jumps set to True, those of other instructions to False.
+
+    :param batch: The BatchSimulator.
+    :return: A dictionary with the handler of every mnemonic, of the I/O variants of ldr and str ('ldr_io' and \
+             'str_io') and of unknown instructions ('unknown').
+    """
+    r = batch.registers
+    f = batch.flags
+    memory = batch.memory
+    stack = batch.stack
+    stack_pointer = batch.stack_pointer
+    stack_depth = batch.stack_depth
+    pcs = batch.pc
+
+    def push_lanes(lanes, pc, what):
+        lanes = batch.indices(lanes)
+        full = stack_pointer[lanes] >= stack_depth
+        if full.any():
+            batch.fail(lanes[full], 'Stack overflow at address %02X (%s).' % (pc, what))
+            lanes = lanes[~full]
+        return lanes
+
+    def pop_lanes(lanes, pc):
+        lanes = batch.indices(lanes)
+        empty = stack_pointer[lanes] == 0
+        if empty.any():
+            batch.fail(lanes[empty], 'Stack underflow at address %02X.' % pc)
+            lanes = lanes[~empty]
+        stack_pointer[lanes] -= 1
+        return lanes
+
+    def unknown(lanes, pc, high_byte, low_byte):
+        batch.fail(batch.indices(lanes), 'Unknown instruction %02X%02X at address %02X.' % (high_byte, low_byte, pc))
+        return batch.lane_indices[:0]
+
+    # jump instructions
+    def nop(lanes, pc, a, b):
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def reti(lanes, pc, a, b):
+        lanes = pop_lanes(lanes, pc)
+        pcs[lanes] = stack[stack_pointer[lanes], lanes]
+        inside = lanes[batch.in_interrupt[lanes]]
+        f[:, inside] = batch.saved_flags[:, inside]
+        batch.in_interrupt[inside] = False
+        # a pending interrupt is taken at once: the return address is pushed again
+        again = inside[batch.interrupt_pending[inside]]
+        batch.interrupt_pending[again] = False
+        stack_pointer[again] += 1
+        batch.saved_flags[:, again] = f[:, again]
+        batch.in_interrupt[again] = True
+        pcs[again] = 2
+        return lanes
+
+    def retc(lanes, pc, a, b):
+        lanes = pop_lanes(lanes, pc)
+        pcs[lanes] = stack[stack_pointer[lanes], lanes]
+        return lanes
+
+    def call(lanes, pc, address, b):
+        lanes = push_lanes(lanes, pc, 'call')
+        stack[stack_pointer[lanes], lanes] = pc + 2
+        stack_pointer[lanes] += 1
+        pcs[lanes] = address
+        return lanes
+
+    def jmp(lanes, pc, address, b):
+        pcs[lanes] = address
+        return lanes
+
+    def jump_conditional(lanes, pc, address, flag):
+        pcs[lanes] = np.where(f[flag, lanes], address, pc + 2)
+        return lanes
+
+    # register / memory instructions
+    def movl(lanes, pc, rd, literal):
+        r[rd, lanes] = literal
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def movr(lanes, pc, rd, rs):
+        r[rd, lanes] = r[rs, lanes]
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def ldr(lanes, pc, rd, address):
+        r[rd, lanes] = memory[address, lanes]
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def ldr_io(lanes, pc, rd, address):
+        r[rd, lanes] = memory[address, lanes]
+        if address == irqf_address:
+            # reading the flags clears them (and the interrupt requested by them)
+            memory[address, lanes] = 0
+            batch.interrupt_pending[lanes] = False
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def str_(lanes, pc, address, rs):
+        memory[address, lanes] = r[rs, lanes]
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def str_io(lanes, pc, address, rs):
+        batch.store(address, lanes, r[rs, lanes])
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def ldrr(lanes, pc, rd, rs):
+        lanes = batch.indices(lanes)
+        addresses = r[rs, lanes]
+        r[rd, lanes] = memory[addresses, lanes]
+        flags_read = lanes[addresses == irqf_address]
+        memory[irqf_address, flags_read] = 0
+        batch.interrupt_pending[flags_read] = False
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def strr(lanes, pc, rd, rs):
+        lanes = batch.indices(lanes)
+        addresses = r[rd, lanes]
+        values = r[rs, lanes]
+        io = addresses >= io_start
+        if io.any():
+            for address in np.unique(addresses[io]):
+                selected = addresses == address
+                batch.store(int(address), lanes[selected], values[selected])
+        memory[addresses, lanes] = values
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def push(lanes, pc, rs, b):
+        lanes = push_lanes(lanes, pc, 'push')
+        stack[stack_pointer[lanes], lanes] = r[rs, lanes]
+        stack_pointer[lanes] += 1
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def pop(lanes, pc, rd, b):
+        lanes = pop_lanes(lanes, pc)
+        r[rd, lanes] = stack[stack_pointer[lanes], lanes]
+        pcs[lanes] = pc + 2
+        return lanes
+
+    # ALU operations - single operand
+    def not_(lanes, pc, rds, b):
+        value = r[rds, lanes] ^ 0xff
+        r[rds, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def rr(lanes, pc, rds, b):
+        value = r[rds, lanes]
+        f[1, lanes] = value & 1 == 1
+        r[rds, lanes] = (value >> 1) | (value & 1) << 7
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def rl(lanes, pc, rds, b):
+        value = r[rds, lanes] << 1
+        f[1, lanes] = value > 0xff
+        r[rds, lanes] = (value | value >> 8) & 0xff
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def swap(lanes, pc, rds, b):
+        value = r[rds, lanes]
+        r[rds, lanes] = (value << 4 | value >> 4) & 0xff
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    # ALU operations - two operands
+    def andl(lanes, pc, rd, literal):
+        value = r[rd, lanes] & literal
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def andr(lanes, pc, rd, rs):
+        value = r[rd, lanes] & r[rs, lanes]
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def orl(lanes, pc, rd, literal):
+        value = r[rd, lanes] | literal
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def orr(lanes, pc, rd, rs):
+        value = r[rd, lanes] | r[rs, lanes]
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def xorl(lanes, pc, rd, literal):
+        value = r[rd, lanes] ^ literal
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def xorr(lanes, pc, rd, rs):
+        value = r[rd, lanes] ^ r[rs, lanes]
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def addl(lanes, pc, rd, literal):
+        value = r[rd, lanes] + literal
+        f[1, lanes] = value > 0xff
+        value &= 0xff
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def addr(lanes, pc, rd, rs):
+        value = r[rd, lanes] + r[rs, lanes]
+        f[1, lanes] = value > 0xff
+        value &= 0xff
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def subl(lanes, pc, rd, literal):
+        value = r[rd, lanes] - literal
+        f[1, lanes] = value < 0
+        value &= 0xff
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def subr(lanes, pc, rd, rs):
+        value = r[rd, lanes] - r[rs, lanes]
+        f[1, lanes] = value < 0
+        value &= 0xff
+        r[rd, lanes] = value
+        f[0, lanes] = value == 0
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def cmpl(lanes, pc, rd, literal):
+        value = r[rd, lanes]
+        f[2, lanes] = value == literal
+        f[3, lanes] = value > literal
+        f[4, lanes] = value < literal
+        pcs[lanes] = pc + 2
+        return lanes
+
+    def cmpr(lanes, pc, rd, rs):
+        value = r[rd, lanes]
+        other = r[rs, lanes]
+        f[2, lanes] = value == other
+        f[3, lanes] = value > other
+        f[4, lanes] = value < other
+        pcs[lanes] = pc + 2
+        return lanes
+
+    handlers = {'nop': nop, 'reti': reti, 'retc': retc, 'call': call, 'jmp': jmp, 'movl': movl, 'movr': movr,
+                'ldr': ldr, 'ldr_io': ldr_io, 'str': str_, 'str_io': str_io, 'ldrr': ldrr, 'strr': strr,
+                'push': push, 'pop': pop, 'not': not_, 'rr': rr, 'rl': rl, 'swap': swap, 'andl': andl, 'andr': andr,
+                'orl': orl, 'orr': orr, 'xorl': xorl, 'xorr': xorr, 'addl': addl, 'addr': addr, 'subl': subl,
+                'subr': subr, 'cmpl': cmpl, 'cmpr': cmpr, 'unknown': unknown}
+    for mnemonic, (instruction_type, _) in encoding_tables['instructions'].items():
+        if instruction_type == 'jump_conditional':
+            handlers[mnemonic] = jump_conditional
+    for handler in handlers.values():
+        handler.jumps = handler in (jmp, jump_conditional)
+    return handlers
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,292 @@
+"""
+Disassembler for the LDD mark II processor. It reads a program ROM (VHDL, raw binary, Intel HEX, $readmemh/$readmemb \
+or .coe file, see ddasm.py) and converts the machine image back to a DDA program. The targets of jumps and calls get \
+a label (reset and isr for the reset and interrupt vectors).
+DDASM = Digital Design Assmebly
+LDD = Lab Digital Design
+Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
+"""
+import os
+import sys
+import multiprocessing
+from ddasm import encoding_tables, image_readers, read_image_file, pop_option, positive_number
+
+
+def main(argv):
+    """
+    Disassemble one or more program ROMs.
+
+    :param argv: The list of command line arguments passed to this script.
+    :return: The script returns exit code 0 on success; -1 otherwise.
+    """
+    args = list(argv[1:])
+    try:
+        jobs = pop_option(args, '--jobs', positive_number)
+        output_dir = pop_option(args, '--output', str)
+    except ValueError:
+        print('ERROR: "--jobs" expects a positive number and "--output" a directory.')
+        print_usage()
+        return -1
+    with_addresses = not pop_option(args, '--no-addresses')
+    if len(args) == 0:
+        print('ERROR: Not enough input arguments. Expecting at least 1 ROM file or directory.')
+        print_usage()
+        return -1
+
+    rom_files = collect_rom_files(args)
+    if len(rom_files) == 0:
+        print('ERROR: No ROM files found.')
+        return -1
+
+    # a single ROM is printed in the console (unless an output directory is given)
+    if len(rom_files) == 1 and output_dir is None:
+        try:
+            print(disassemble_file(rom_files[0], with_addresses), end='')
+        except (IOError, ValueError) as e:
+            print('ERROR: Failed to disassemble ' + rom_files[0] + ' (' + str(e) + ').')
+            return -1
+        return 0
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    jobs_args = [(rom_file, output_file_name(rom_file, output_dir), with_addresses) for rom_file in rom_files]
+    with multiprocessing.Pool(jobs) as pool:
+        results = pool.map(disassemble_job, jobs_args, max(1, len(jobs_args) // (4 * (jobs or os.cpu_count()))))
+
+    failures = 0
+    for rom_file, output_file, error in results:
+        if error is None:
+            print(' - OK      ' + rom_file + ' -> ' + output_file)
+        else:
+            print(' - FAILED  ' + rom_file + ' (' + error + ')')
+            failures += 1
+    print(str(len(results) - failures) + ' disassembled, ' + str(failures) + ' failed.')
+    return -1 if failures else 0
+
+
+def print_usage():
+    """
+    Print an informational message on how to use the disassembler.
+
+    :return: Nothing
+    """
+    print('USAGE: python ddisasm.py (rom_file | directory) ... [--output DIR] [--jobs N] [--no-addresses]')
+    print(' * rom_file         : Program ROM (.vhd, .bin, .hex, .mem or .coe file)')
+    print(' * directory        : Disassemble all ROM files in this directory')
+    print(' * --output DIR     : (optional) Directory for the DDA programs. By default, a single ROM is printed in')
+    print('                      the console and every other rom_file.ext results in rom_file.ext.dda.')
+    print(' * --jobs N         : (optional) Number of worker processes (default: number of cores).')
+    print(' * --no-addresses   : Leave out the comments with the address and the code of every instruction.')
+
+
+def collect_rom_files(names):
+    """
+    :param names: ROM files and directories.
+    :return: The list of ROM files (for a directory, all files with the extension of a ROM file format).
+    """
+    rom_files = list()
+    for name in names:
+        if os.path.isdir(name):
+            for entry in sorted(os.listdir(name)):
+                path = os.path.join(name, entry)
+                if os.path.splitext(entry)[1].lower() in image_readers and os.path.isfile(path):
+                    rom_files.append(path)
+        else:
+            rom_files.append(name)
+    return rom_files
+
+
+def output_file_name(rom_file, output_dir=None):
+    """
+    :param rom_file: The ROM file.
+    :param output_dir: (optional) Directory for the DDA programs.
+    :return: The file name of the disassembled program.
+    """
+    if output_dir is None:
+        return rom_file + '.dda'
+    return os.path.join(output_dir, os.path.basename(rom_file) + '.dda')
+
+
+def disassemble_job(job):
+    """
+    Disassemble one ROM of a directory (runs in a worker process).
+
+    :param job: A tuple (ROM file, output file, with addresses).
+    :return: A tuple (ROM file, output file, error message or None).
+    """
+    rom_file, output_file, with_addresses = job
+    try:
+        program = disassemble_file(rom_file, with_addresses)
+        with open(output_file, 'w') as f:
+            f.write(program)
+    except (IOError, ValueError) as e:
+        return rom_file, output_file, str(e) or e.__class__.__name__
+    return rom_file, output_file, None
+
+
+def disassemble_file(rom_file, with_addresses=True):
+    """
+    Disassemble a program ROM file.
+
+    :param rom_file: The ROM file (see ddasm.read_image_file(...) ).
+    :param with_addresses: Setting with_addresses to True adds the address and the code of every instruction as \
+                           a comment.
+    :return: The DDA program.
+    """
+    image = read_image_file(rom_file)
+    header = '; disassembled from ' + os.path.basename(rom_file) + ' (' + str(len(image)) + ' bytes)\n'
+    return header + disassemble(image, with_addresses)
+
+
+def disassemble(image, with_addresses=True):
+    """
+    Disassemble a machine image. The zeros at the end of the image (unused memory) are left out.
+
+    :param image: The contents of the program ROM.
+    :param with_addresses: Setting with_addresses to True adds the address and the code of every instruction as \
+                           a comment.
+    :return: The DDA program.
+    """
+    program_end = program_size(image)
+
+    # first pass: decode the instructions and collect the jump targets
+    instructions = list()
+    targets = set()
+    for address in range(0, program_end, 2):
+        high_byte = image[address]
+        low_byte = image[address + 1]
+        decoded = decode_table[high_byte]
+        instructions.append((address, high_byte, low_byte, decoded))
+        if decoded is not None and decoded[1] in ('jump', 'jump_conditional'):
+            targets.add(low_byte)
+
+    labels = {0: 'reset', 2: 'isr'}
+    for target in sorted(targets):
+        if target not in labels and target < program_end and target % 2 == 0:
+            labels[target] = 'label_%02x' % target
+
+    # second pass: format the instructions
+    lines = list()
+    for address, high_byte, low_byte, decoded in instructions:
+        label = labels.get(address)
+        if label is not None:
+            lines.append(label + ':\n')
+        if decoded is None:
+            line = '; unknown instruction'
+        else:
+            mnemonic, instruction_type = decoded
+            operands = operand_formatters[instruction_type](high_byte, low_byte, labels)
+            line = mnemonic + (' ' + operands if operands else '')
+        if with_addresses:
+            line = '%-24s; %02X: %02X%02X' % (line, address, high_byte, low_byte)
+        lines.append('\t' + line + '\n')
+
+    if program_end < len(image):
+        lines.append('; ' + str(len(image) - program_end) + ' bytes of unused memory (zeros)\n')
+    return ''.join(lines)
+
+
+def program_size(image):
+    """
+    :param image: The contents of the program ROM.
+    :return: The size of the program: the image without the zeros at the end, rounded up to whole instructions.
+    """
+    program_end = len(image.rstrip(b'\x00'))
+    return min(program_end + program_end % 2, len(image) - len(image) % 2)
+
+
+def format_address(high_byte, low_byte, labels):
+    """
+    Format the operands of a (conditional) jump instruction: the label (or hexadecimal address) of the target.
+
+    :param high_byte: The most significant byte of the instruction (opcode and flag, Rd or Rs).
+    :param low_byte: The least significant byte of the instruction (address, literal or Rs).
+    :param labels: The labels of the program (address -> label).
+    :return: The operands (text).
+    """
+    return labels.get(low_byte, '%02X' % low_byte)
+
+
+def format_no_address(high_byte, low_byte, labels):
+    """
+    Format the operands of a jump instruction without address (see format_address(...) for the parameters).
+    """
+    return ''
+
+
+def format_single_register(high_byte, low_byte, labels):
+    """
+    Format the operands of a single register instruction: Rds (see format_address(...) for the parameters).
+    """
+    return register_names[high_byte & 7]
+
+
+def format_two_registers(high_byte, low_byte, labels):
+    """
+    Format the operands of a register-to-register or indirect memory instruction: Rd, Rs (see format_address(...) \
+    for the parameters).
+    """
+    return register_names[high_byte & 7] + ', ' + register_names[low_byte >> 5]
+
+
+def format_register_to_memory(high_byte, low_byte, labels):
+    """
+    Format the operands of a register-to-memory instruction: address, Rs (see format_address(...) for the \
+    parameters).
+    """
+    return '%02X, ' % low_byte + register_names[high_byte & 7]
+
+
+def format_x_to_register(high_byte, low_byte, labels):
+    """
+    Format the operands of a memory/literal-to-register instruction: Rd, address or literal (see \
+    format_address(...) for the parameters).
+    """
+    return register_names[high_byte & 7] + ', %02X' % low_byte
+
+
+# Operand formatter for every instruction type (see asminfo.py)
+operand_formatters = {
+    'jump': format_address,
+    'jump_conditional': format_address,
+    'jump_no_address': format_no_address,
+    'single_register': format_single_register,
+    'register_to_register': format_two_registers,
+    'indirect_memory': format_two_registers,
+    'register_to_memory': format_register_to_memory,
+    'x_to_register': format_x_to_register
+}
+
+
+def compile_decode_table(tables):
+    """
+    Invert the encoding tables (see ddasm.compile_asminfo(...) ) into a decode table.
+
+    :param tables: The encoding tables.
+    :return: A list with the (mnemonic, type) of every value of the most significant byte of an instruction (None \
+             for an unknown instruction).
+    """
+    table = [None] * 256
+    # conditional jumps use the 3 least significant bits as flag
+    for mnemonic, (instruction_type, high_byte) in tables['instructions'].items():
+        if instruction_type == 'jump_conditional':
+            table[high_byte] = (mnemonic, instruction_type)
+    # the other instructions use them as register code (or do not use them)
+    for mnemonic, (instruction_type, high_byte) in tables['instructions'].items():
+        if instruction_type != 'jump_conditional':
+            for code in range(8):
+                table[high_byte | code] = (mnemonic, instruction_type)
+    return table
+
+
+# Decode table of the most significant byte of an instruction
+decode_table = compile_decode_table(encoding_tables)
+
+# Name of every register code
+register_names = [None] * 8
+for register_name, register_code in encoding_tables['registers'].items():
+    register_names[register_code] = register_name
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,166 @@
+"""
+Source-mapped profile of a simulation of the LDD mark II processor. The execution counters of the simulator (see \
+ddsim.Profile) are mapped back to the lines of the DDA program, for a hot-spot report, the annotated source and the \
+line and branch coverage (see ddsim.py, option --profile).
+DDASM = Digital Design Assmebly
+LDD = Lab Digital Design
+Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
+"""
+from ddasm import encoding_tables
+
+# Mnemonics of the conditional jumps (jz, jc, je, jg, js), whose branches are covered separately
+conditional_jumps = {mnemonic for mnemonic, (instruction_type, _) in encoding_tables['instructions'].items()
+                     if instruction_type == 'jump_conditional'}
+
+# Default number of lines in the hot-spot report
+default_hot_spots = 10
+
+
+def profile_instructions(pinfo, simulator):
+    """
+    Map the profile of a simulation to the instructions of the program.
+
+    :param pinfo: A dictionary containing the analysed program (provided by ddasm.load_program(...) ).
+    :param simulator: The ddsim.Simulator that ran the program (with profiling).
+    :return: A list with a dictionary for every instruction of the program, in address order: 'instruction' (see \
+             ddasm.Instruction), 'routine' (the labels at the start of the routine that contains it), 'executions', \
+             'cycles' and, for a conditional jump, 'taken' and 'not_taken' (None otherwise).
+    """
+    profile = simulator.profile
+    executions = profile.executions()
+    cycles = profile.cycles(simulator.program)
+
+    # a routine runs from a label up to the next one
+    routines = dict()
+    for label, address in pinfo['labels'].items():
+        routines.setdefault(int(address, 16), list()).append(label)
+    routine = '(start)'
+
+    profiles = list()
+    for instruction in pinfo['program']:
+        address = instruction.address
+        if address in routines:
+            routine = ', '.join(routines[address])
+        count = executions[address] if address < len(executions) else 0
+        taken = not_taken = None
+        if instruction.instruction in conditional_jumps:
+            target = simulator.program[address][1]
+            # the profile does not count a jump to the next instruction as taken: both branches are the same
+            taken = profile.taken[address] if target != address + 2 else count
+            not_taken = count - profile.taken[address] if target != address + 2 else count
+        profiles.append({'instruction': instruction, 'routine': routine, 'executions': count,
+                         'cycles': cycles[address] if address < len(cycles) else 0, 'taken': taken,
+                         'not_taken': not_taken})
+    return profiles
+
+
+def format_hot_spots(profiles, source_lines, top=default_hot_spots):
+    """
+    Format the hot-spot report: the clock cycles spent in every routine, and the lines that take the most cycles.
+
+    :param profiles: The profile of every instruction (see profile_instructions(...) ).
+    :param source_lines: The lines of the program.
+    :param top: Number of lines in the report.
+    :return: The report (string).
+    """
+    total = sum(item['cycles'] for item in profiles) or 1
+    # routine -> [cycles, executions of its first instruction]
+    routines = dict()
+    for item in profiles:
+        routine = routines.setdefault(item['routine'], [0, item['executions']])
+        routine[0] += item['cycles']
+
+    lines = ['Hot spots (routines):', '%12s %7s %12s  %s' % ('cycles', '%', 'entries', 'routine')]
+    for name, (cycles, entries) in sorted(routines.items(), key=lambda routine: -routine[1][0]):
+        if cycles:
+            lines.append('%12d %6.1f%% %12d  %s' % (cycles, 100.0 * cycles / total, entries, name))
+    lines.append('')
+    lines.append('Hot spots (lines):')
+    lines.append('%12s %7s %12s  %5s  %s' % ('cycles', '%', 'executions', 'line', 'source'))
+    hot = sorted((item for item in profiles if item['cycles']), key=lambda item: -item['cycles'])[:top]
+    for item in hot:
+        line = item['instruction'].line
+        lines.append('%12d %6.1f%% %12d  %5d  %s' % (item['cycles'], 100.0 * item['cycles'] / total,
+                                                     item['executions'], line + 1, source_lines[line].strip()))
+    return '\n'.join(lines)
+
+
+def format_coverage(profiles):
+    """
+    Format the line and branch coverage: the instructions that were executed, and the conditional jumps that were \
+    taken and not taken.
+
+    :param profiles: The profile of every instruction (see profile_instructions(...) ).
+    :return: The coverage report (string).
+    """
+    executed = [item for item in profiles if item['executions']]
+    branches = [item for item in profiles if item['taken'] is not None]
+    covered_branches = sum((item['taken'] > 0) + (item['not_taken'] > 0) for item in branches)
+
+    lines = ['Line coverage:   %d of %d instructions (%s)' % (len(executed), len(profiles),
+                                                                percentage(len(executed), len(profiles))),
+             'Branch coverage: %d of %d branches (%s)' % (covered_branches, 2 * len(branches),
+                                                           percentage(covered_branches, 2 * len(branches)))]
+    missed = missed_ranges(profiles)
+    if missed:
+        lines.append('Lines not executed: ' + ', '.join(str(first) if first == last else '%d-%d' % (first, last)
+                                                        for first, last in missed))
+    for item in branches:
+        if item['executions'] and not (item['taken'] and item['not_taken']):
+            instruction = item['instruction']
+            lines.append('Line %d (%s): %s' % (instruction.line + 1, instruction.text.strip(),
+                                               'never taken' if item['not_taken'] else 'always taken'))
+    return '\n'.join(lines)
+
+
+def annotate_source(profiles, source_lines):
+    """
+    Annotate the lines of the program with their profile: the number of executions and the clock cycles of every \
+    instruction ("#####" if it was not executed), and how often a conditional jump was taken and not taken.
+
+    :param profiles: The profile of every instruction (see profile_instructions(...) ).
+    :param source_lines: The lines of the program.
+    :return: The annotated source (string).
+    """
+    by_line = {item['instruction'].line: item for item in profiles}
+    lines = ['%12s %12s %-23s | %s' % ('executions', 'cycles', 'branches', 'source')]
+    for index, source_line in enumerate(source_lines):
+        item = by_line.get(index)
+        if item is None:
+            annotation = '%12s %12s %-23s' % ('', '', '')
+        elif not item['executions']:
+            annotation = '%12s %12s %-23s' % ('#####', '', '')
+        else:
+            branches = '' if item['taken'] is None else 'taken %d, not %d' % (item['taken'], item['not_taken'])
+            annotation = '%12d %12d %-23s' % (item['executions'], item['cycles'], branches)
+        lines.append(annotation + ' | ' + source_line.rstrip('\n'))
+    return '\n'.join(lines) + '\n'
+
+
+def percentage(part, total):
+    """
+    :param part: A number of items.
+    :param total: The total number of items.
+    :return: The percentage (string, "-" if there are no items).
+    """
+    return '-' if not total else '%.1f%%' % (100.0 * part / total)
+
+
+def missed_ranges(profiles):
+    """
+    :param profiles: The profile of every instruction (see profile_instructions(...) ).
+    :return: A list of (first line, last line) tuples: the line numbers of every run of consecutive instructions \
+             that were not executed.
+    """
+    ranges = list()
+    previous_missed = False
+    for item in profiles:
+        line_number = item['instruction'].line + 1
+        if item['executions']:
+            previous_missed = False
+        elif previous_missed:
+            ranges[-1][1] = line_number
+        else:
+            ranges.append([line_number, line_number])
+            previous_missed = True
+    return [tuple(line_range) for line_range in ranges]
@@ -0,0 +1,1580 @@
+"""
+Instruction-set simulator for the LDD mark II processor. It runs a DDA program (assembled in memory) or a program ROM \
+(VHDL, raw binary, Intel HEX, $readmemh/$readmemb or .coe file, see ddasm.py) without a VHDL simulator, and counts \
+the clock cycles.
+DDASM = Digital Design Assmebly
+LDD = Lab Digital Design
+Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
+"""
+import sys
+import time
+import heapq
+import logging
+from ddasm import Assembler, encoding_tables, read_image_file, pop_option, positive_number, setup_logging, \
+    close_logging, logger, text_lines
+from ddisasm import decode_table, register_names
+from ddprof import profile_instructions, format_hot_spots, format_coverage, annotate_source
+from ddtrace import Trace, default_trace_length
+from ddvcd import VcdWriter, parse_signals
+
+# Data memory map of the processor (the program ROM has its own address space)
+ram_start = 0x80
+ram_end = 0x9f
+io_start = 0xa0
+data_memory_size = 0x100
+
+# Default depth of the stack (return addresses of call and interrupts, and pushed registers)
+default_stack_depth = 16
+
+# Maximum number of instructions of a basic block (see Simulator.translate_block(...) )
+max_block_length = 64
+
+# Offset of the address that an instruction returns when run(...) has to be left after it, to take an interrupt or \
+# for a stop that a peripheral requested (beyond any ROM)
+run_exit = 0x10000
+
+# Maximum number of passes through a loop that is not idle between two checks (see Simulator.execute_blocks(...) )
+max_idle_interval = 1023
+
+# I/O locations of the peripherals of the lab board (see Board)
+irqe_address = 0xc0
+irqf_address = 0xc1
+timer_address = 0xd8
+switches_addresses = (0xe0, 0xe1)
+buttons_address = 0xe8
+output_names = {0xd0: 'RGB_R', 0xd1: 'RGB_G', 0xd2: 'RGB_B', 0xf0: 'LEDS_L', 0xf1: 'LEDS_H', 0xf8: 'BCD0',
+                0xf9: 'BCD1', 0xfa: 'BCD2', 0xfb: 'BCD3'}
+
+# Interrupt flags (IRQE/IRQF) of the peripherals
+buttons_irq_mask = 0x01
+timer_irq_mask = 0x04
+
+# Clock frequency of the processor on the lab board (Hz)
+default_clock_frequency = 100000000
+
+# Clock cycles of every instruction (a model of the processor: 3 cycles to fetch, decode and execute an instruction, \
+# 1 extra cycle for a memory or stack access). Conditional jumps take the same time whether they are taken or not.
+instruction_cycles = {mnemonic: 3 for mnemonic in encoding_tables['instructions']}
+instruction_cycles.update({mnemonic: 4 for mnemonic in ('ldr', 'str', 'ldrr', 'strr', 'push', 'pop', 'call', 'retc',
+                                                        'reti')})
+
+
+def main(argv):
+    """
+    Simulate a program.
+
+    :param argv: The list of command line arguments passed to this script.
+    :return: The script returns exit code 0 on success; -1 otherwise.
+    """
+    args = list(argv[1:])
+    try:
+        max_cycles = pop_option(args, '--cycles', positive_number)
+        max_instructions = pop_option(args, '--instructions', positive_number)
+        addr_width = pop_option(args, '--addr-width', positive_number)
+        template_file = pop_option(args, '--template', str) or 'ROM_template.vhd'
+        seconds = pop_option(args, '--seconds', positive_time)
+        clock_frequency = pop_option(args, '--clock', positive_number) or default_clock_frequency
+        buttons = pop_option(args, '--buttons', parse_stimulus) or []
+        switches = pop_option(args, '--switches', parse_stimulus) or []
+        profile_file = pop_option(args, '--profile', str)
+        trace_file = pop_option(args, '--trace', str)
+        trace_length = pop_option(args, '--trace-length', positive_number) or default_trace_length
+        vcd_file = pop_option(args, '--vcd', str)
+        vcd_signals = pop_option(args, '--vcd-signals', str)
+    except ValueError:
+        print('ERROR: "--cycles", "--instructions", "--addr-width", "--clock" and "--trace-length" expect a positive '
+              'number, "--seconds" a positive time, "--buttons" and "--switches" a list of TIME:VALUE pairs and '
+              '"--template", "--profile", "--trace" and "--vcd" a file name.')
+        print_usage()
+        return -1
+    try:
+        vcd_signals = parse_signals(vcd_signals) if vcd_signals is not None else None
+    except ValueError as e:
+        print('ERROR: "--vcd-signals" expects a list of signals (' + str(e) + ').')
+        print_usage()
+        return -1
+    translate = not pop_option(args, '--interpret')
+    trace_all = pop_option(args, '--trace-all')
+    if len(args) != 1:
+        print('ERROR: Expecting 1 program or ROM file.')
+        print_usage()
+        return -1
+    if seconds is not None:
+        max_cycles = int(round(seconds * clock_frequency))
+    if max_cycles is None and max_instructions is None:
+        max_cycles = 1000000
+
+    handlers = setup_logging({'console_level': logging.WARNING, 'log_level': logging.WARNING, 'log_file': None})
+    try:
+        image, pinfo = load_image(args[0], template_file, addr_width)
+        source_lines = None
+        if profile_file is not None and pinfo is not None:
+            with open(args[0]) as f:
+                source_lines = text_lines(f.read())
+    except (IOError, ValueError) as e:
+        print('ERROR: Failed to load ' + args[0] + (' (' + str(e) + ').' if str(e) else '.'))
+        return -1
+    finally:
+        close_logging(handlers)
+    if profile_file is not None and pinfo is None:
+        print('ERROR: Profiling requires a DDA program (to map the profile to its lines).')
+        return -1
+
+    trace = None
+    if trace_file is not None:
+        try:
+            # the complete trace is streamed to the file while the program runs
+            trace = Trace(trace_length, open(trace_file, 'wb') if trace_all else None)
+        except IOError:
+            print('ERROR: Failed to open the trace file (' + trace_file + ').')
+            return -1
+
+    vcd = None
+    if vcd_file is not None:
+        try:
+            vcd = VcdWriter(open(vcd_file, 'w'), clock_frequency, vcd_signals)
+        except IOError:
+            print('ERROR: Failed to open the VCD file (' + vcd_file + ').')
+            return -1
+        if vcd.traces_instructions() and trace is not None:
+            print('ERROR: "--trace" cannot be combined with a VCD file of the PC, the registers or the flags.')
+            return -1
+    # a VCD file of the PC, the registers or the flags observes every instruction, like a trace
+    observer = vcd if vcd is not None and vcd.traces_instructions() else trace
+
+    simulator = Simulator(image, translate=translate, profile=profile_file is not None, trace=observer)
+    board = Board(simulator, clock_frequency)
+    for at, value in buttons:
+        board.press_buttons(at, value)
+    for at, value in switches:
+        board.flip_switches(at, value)
+    if vcd is not None:
+        board.output_listeners.append(vcd.output_changed)
+        try:
+            vcd.write_header(simulator.memory)
+        except IOError:
+            print('ERROR: Failed to write the VCD file (' + vcd_file + ').')
+            return -1
+    start = time.perf_counter()
+    try:
+        board.run(max_instructions, max_cycles)
+    except ValueError as e:
+        print('ERROR: ' + str(e))
+        print(simulator.format_state())
+        if trace is not None:
+            save_trace(trace, trace_file)
+        if vcd is not None:
+            save_vcd(vcd, vcd_file, simulator.cycles)
+        return -1
+    elapsed = time.perf_counter() - start
+
+    simulated = simulator.cycles / clock_frequency
+    print(simulator.format_state())
+    print(board.format_outputs())
+    print('%d instructions, %d cycles in %.3f s (%.2f M instructions/s)'
+          % (simulator.instructions, simulator.cycles, elapsed, simulator.instructions / max(elapsed, 1e-9) / 1e6))
+    print('%.3f s simulated at %d Hz (%.1f simulated s per s)'
+          % (simulated, clock_frequency, simulated / max(elapsed, 1e-9)))
+    if trace is not None and not save_trace(trace, trace_file):
+        return -1
+    if vcd is not None and not save_vcd(vcd, vcd_file, simulator.cycles):
+        return -1
+
+    if profile_file is not None:
+        profiles = profile_instructions(pinfo, simulator)
+        print()
+        print(format_hot_spots(profiles, source_lines))
+        print()
+        print(format_coverage(profiles))
+        try:
+            with open(profile_file, 'w') as f:
+                f.write(annotate_source(profiles, source_lines))
+        except IOError:
+            print('ERROR: Failed to write the annotated program (' + profile_file + ').')
+            return -1
+        print('Annotated program written to ' + profile_file + '.')
+    return 0
+
+
+def print_usage():
+    """
+    Print an informational message on how to use the simulator.
+
+    :return: Nothing
+    """
+    print('USAGE: python ddsim.py (program.dda | rom_file) [--cycles N] [--instructions N] [--addr-width N]')
+    print('                       [--template FILE] [--interpret] [--seconds S] [--clock HZ]')
+    print('                       [--buttons T:HH,...] [--switches T:HHHH,...] [--profile FILE]')
+    print('                       [--trace FILE] [--trace-length N] [--trace-all] [--vcd FILE]')
+    print('                       [--vcd-signals LIST]')
+    print(' * program.dda      : DDA program (assembled in memory, see ddasm.py)')
+    print(' * rom_file         : Program ROM (.vhd, .bin, .hex, .mem or .coe file)')
+    print(' * --cycles N       : (optional) Number of clock cycles to simulate (default: 1000000).')
+    print(' * --instructions N : (optional) Number of instructions to simulate.')
+    print(' * --addr-width N   : (optional) Address width of the program ROM (for a DDA program).')
+    print(' * --template FILE  : (optional) The program ROM template (for a DDA program, default: ROM_template.vhd).')
+    print(' * --interpret      : Execute every instruction separately instead of translating basic blocks.')
+    print(' * --seconds S      : (optional) Simulated time (s); replaces --cycles.')
+    print(' * --clock HZ       : (optional) Clock frequency of the processor (default: 100000000).')
+    print(' * --buttons T:HH   : (optional) Set the buttons (BTNS) to HH (hex) at time T (s), e.g. 1:04,1.2:00')
+    print(' * --switches T:HHHH: (optional) Set the switches (SW_H, SW_L) to HHHH (hexadecimal) at time T (s).')
+    print(' * --profile FILE   : (optional) Count the executions of every instruction; print the hot spots and the')
+    print('                      coverage and write the annotated program to FILE (for a DDA program).')
+    print(' * --trace FILE     : (optional) Write the last instructions (also after a failure) to the trace file FILE')
+    print('                      (see ddtrace.py); implies --interpret.')
+    print(' * --trace-length N : (optional) Number of instructions in the trace (default: %d).' % default_trace_length)
+    print(' * --trace-all      : Trace the complete run (written to FILE in chunks of --trace-length instructions).')
+    print(' * --vcd FILE       : (optional) Write the changes of the signals to the VCD file FILE (waveforms); the PC,')
+    print('                      the registers and the flags imply --interpret.')
+    print(' * --vcd-signals L  : (optional) Comma-separated signals of the VCD file: PC, R0-R7, Z, C, E, G, S, LEDS_L,')
+    print('                      LEDS_H, BCD0-BCD3, RGB_R, RGB_G, RGB_B or the groups registers, flags, leds, bcd,')
+    print('                      rgb (default: PC,registers,flags,leds,bcd).')
+
+
+def load_image(filename, template_file='ROM_template.vhd', addr_width=None):
+    """
+    Load the machine image of a program. A DDA program is assembled in memory; other files are read as program ROM.
+
+    :param filename: The DDA program or ROM file (see ddasm.read_image_file(...) ).
+    :param template_file: The program ROM template (only used for a DDA program).
+    :param addr_width: (optional) Address width of the program ROM (only used for a DDA program).
+    :return: A tuple with the contents of the program ROM and the analysed program (None for a ROM file). Raises \
+             IOError or ValueError if the program cannot be loaded.
+    """
+    if not filename.lower().endswith('.dda'):
+        return read_image_file(filename), None
+
+    assembler = Assembler(logger=logger, addr_width=addr_width)
+    pinfo = assembler.load_program(filename)
+    with open(template_file) as f:
+        rom = assembler.analyse_template(f.read(), filename)
+    return assembler.encode_program(pinfo, rom), pinfo
+
+
+def save_trace(trace, filename):
+    """
+    Write a trace to its file: the entries that are left in the buffer of a streamed trace, or the ring buffer.
+
+    :param trace: The ddtrace.Trace.
+    :param filename: The trace file.
+    :return: True on success; False otherwise.
+    """
+    try:
+        if trace.stream is not None:
+            trace.flush()
+            trace.stream.close()
+            count = trace.count
+        else:
+            trace.dump(filename)
+            count = len(trace)
+    except IOError:
+        print('ERROR: Failed to write the trace (' + filename + ').')
+        return False
+    print('Trace of %d instructions written to %s.' % (count, filename))
+    return True
+
+
+def save_vcd(vcd, filename, cycle):
+    """
+    Write the changes that are left in the buffer of a VCD file, and close it.
+
+    :param vcd: The ddvcd.VcdWriter.
+    :param filename: The VCD file.
+    :param cycle: The clock cycle at the end of the simulation.
+    :return: True on success; False otherwise.
+    """
+    try:
+        vcd.close(cycle)
+        vcd.stream.close()
+    except IOError:
+        print('ERROR: Failed to write the VCD file (' + filename + ').')
+        return False
+    print('Waveforms of %d signals written to %s.' % (len(vcd.signals), filename))
+    return True
+
+
+def positive_time(text):
+    """
+    Convert a command line value to a positive time.
+
+    :param text: The value (s).
+    :return: The time (s). Raises ValueError if the value is not a positive number.
+    """
+    seconds = float(text)
+    if not seconds > 0:
+        raise ValueError
+    return seconds
+
+
+def parse_stimulus(text):
+    """
+    Convert a command line value to a list of changes of an input.
+
+    :param text: The value: comma-separated TIME:VALUE pairs, with the time in seconds and the value hexadecimal.
+    :return: A list of (time, value) tuples. Raises ValueError if the value is invalid.
+    """
+    changes = list()
+    for pair in text.split(','):
+        at, value = pair.split(':')
+        at = float(at)
+        if at < 0:
+            raise ValueError
+        changes.append((at, int(value, 16)))
+    return changes
+
+
+class Simulator:
+    """
+    Cycle-counting simulator of the LDD mark II processor.
+
+    The program ROM is predecoded into a list with an entry for every address: (handler, operand, operand, cycles). \
+    The handlers come from a dispatch table with a function for every mnemonic (see compile_handlers(...) ); a \
+    handler executes the instruction and returns the address of the next one.
+
+    With translation (the default), straight-line code is not dispatched instruction by instruction: the program \
+    is split into basic blocks (see translate_block(...) ), and every block is compiled once into a Python function \
+    that executes all of its instructions. The blocks are cached by start address; patch(...) invalidates the blocks \
+    that contain a patched byte.
+
+    With translation, idle loops are fast-forwarded as well: when a block that jumps back to itself (e.g. "jmp" to \
+    itself, a loop that refreshes the outputs or polls an input) leaves the complete state of the processor \
+    unchanged between two passes, every further pass is the same, so the remaining passes up to the limit of \
+    run(...) are only counted. A peripheral must therefore keep its state in the data memory, or only change it \
+    between two run(...) calls (see Board).
+
+    The state of the processor is kept in lists that the handlers share: registers (R0 - R7), flags (Z, C, E, G, S, \
+    in the order of the flag codes of the conditional jumps), memory (the 256-byte data memory: RAM at 80 - 9F, I/O \
+    at A0 - FF) and stack. These lists are modified in place, never replaced. Reads and writes of I/O locations can \
+    be redirected to a peripheral with map_io(...). During run(...), cycles is brought up to date before a \
+    peripheral is called (it is then the cycle count at the start of the instruction that accesses it).
+
+    With profiling, the executions of every instruction are counted in profile (see Profile); the passes through an \
+    idle loop that are fast-forwarded are counted as well. With a trace (see ddtrace.Trace), every executed \
+    instruction is recorded.
+    """
+
+    def __init__(self, image, stack_depth=default_stack_depth, translate=True, fast_forward=True, profile=False,
+                 trace=None):
+        """
+        :param image: The contents of the program ROM.
+        :param stack_depth: Number of entries of the stack.
+        :param translate: Setting translate to False runs every instruction through the dispatch table (no basic \
+                          blocks).
+        :param fast_forward: Setting fast_forward to False executes idle loops pass by pass (only used with \
+                             translation).
+        :param profile: Setting profile to True counts the executions of every instruction (see Profile).
+        :param trace: (optional) A ddtrace.Trace that records every executed instruction. With a trace, every \
+                      instruction runs through the dispatch table (no basic blocks).
+        """
+        self.image = bytes(image)
+        self.stack_depth = stack_depth
+        self.translate = translate
+        self.fast_forward = fast_forward
+        self.registers = [0] * 8
+        self.flags = [False] * len(flag_names)
+        self.memory = bytearray(data_memory_size)
+        self.stack = list()
+        self.io_read_hooks = [None] * data_memory_size
+        self.io_write_hooks = [None] * data_memory_size
+        self.pc = 0
+        self.cycles = 0
+        self.instructions = 0
+        self.in_interrupt = False
+        self.interrupt_pending = False
+        self.interrupt_requested = False
+        self.exit_requested = False
+        self.running = False
+        self.saved_flags = list(self.flags)
+        self.profile = Profile(len(self.image)) if profile else None
+        self.trace = trace
+        self.handlers = compile_handlers(self)
+        self.program = self.predecode(self.image)
+        self.blocks = [None] * len(self.image)
+        self.leaders = jump_targets(self.image)
+        if trace is not None:
+            trace.attach(self)
+
+    def reset(self):
+        """
+        Reset the processor: clear the registers, flags, data memory and stack and start again at the reset vector. \
+        The profile is kept.
+
+        :return: Nothing
+        """
+        self.registers[:] = [0] * 8
+        self.flags[:] = [False] * len(flag_names)
+        self.memory[:] = bytes(data_memory_size)
+        self.stack[:] = []
+        self.pc = 0
+        self.cycles = 0
+        self.instructions = 0
+        self.in_interrupt = False
+        self.interrupt_pending = False
+        self.interrupt_requested = False
+        self.exit_requested = False
+
+    def predecode(self, image):
+        """
+        Decode every address of the program ROM (a jump can target an odd address as well).
+
+        :param image: The contents of the program ROM.
+        :return: A list with the decoded instruction (handler, operand, operand, cycles) at every address.
+        """
+        handlers = self.handlers
+        words = dict()
+        program = list()
+        padded = image + b'\x00'
+        for address in range(len(image)):
+            word = padded[address] << 8 | padded[address + 1]
+            decoded = words.get(word)
+            if decoded is None:
+                decoded = words[word] = self.decode(handlers, word >> 8, word & 0xff)
+            program.append(decoded)
+        return program
+
+    @staticmethod
+    def decode(handlers, high_byte, low_byte):
+        """
+        Decode one instruction.
+
+        :param handlers: The instruction handlers (see compile_handlers(...) ).
+        :param high_byte: The most significant byte of the instruction (opcode and flag, Rd or Rs).
+        :param low_byte: The least significant byte of the instruction (address, literal or Rs).
+        :return: A tuple (handler, operand, operand, cycles).
+        """
+        decoded = decode_instruction(high_byte, low_byte)
+        if decoded is None:
+            return handlers['unknown'], high_byte, low_byte, 0
+        mnemonic, handler_name, operand_1, operand_2 = decoded
+        return handlers[handler_name], operand_1, operand_2, instruction_cycles[mnemonic]
+
+    def patch(self, address, data):
+        """
+        Change the contents of the program ROM. The changed instructions are decoded again and the basic blocks that \
+        contain a changed byte are translated again when they are used.
+
+        :param address: Address of the first byte to change.
+        :param data: The new bytes.
+        :return: Nothing
+        """
+        end = address + len(data)
+        if address < 0 or end > len(self.image):
+            raise ValueError('Patch (%02X - %02X) outside the program ROM.' % (address, end - 1))
+        image = bytearray(self.image)
+        image[address:end] = data
+        self.image = bytes(image)
+
+        # the instruction at the address before the patch uses its first byte as well
+        padded = self.image + b'\x00'
+        for changed in range(max(address - 1, 0), end):
+            self.program[changed] = self.decode(self.handlers, padded[changed], padded[changed + 1])
+        for start, block in enumerate(self.blocks):
+            if block is not None and start < end and address < block[3] + 2:
+                self.blocks[start] = None
+        self.leaders = jump_targets(self.image)
+        if self.trace is not None:
+            self.trace.attach(self)
+
+    def run(self, max_instructions=None, max_cycles=None):
+        """
+        Run the program until the number of instructions or clock cycles is reached (whichever comes first). The \
+        last instruction is always completed, so the number of cycles can be exceeded by a few cycles.
+
+        :param max_instructions: (optional) Number of instructions to execute.
+        :param max_cycles: (optional) Number of clock cycles to execute.
+        :return: The number of executed instructions. Raises ValueError if the program fails (unknown instruction, \
+                 stack overflow or underflow, program counter outside the program ROM).
+        """
+        if max_instructions is None and max_cycles is None:
+            raise ValueError('No number of instructions or cycles to run.')
+        cycle_limit = None if max_cycles is None else self.cycles + max_cycles
+        executed = 0
+        self.running = True
+        try:
+            while True:
+                if self.translate and self.trace is None:
+                    # the basic blocks stop before the limits; the last few instructions are interpreted
+                    executed += self.execute_blocks(None if max_instructions is None else max_instructions - executed,
+                                                    cycle_limit)
+                remaining = None if max_instructions is None else max_instructions - executed
+                if not self.exit_requested and (remaining is None or remaining > 0) and \
+                        (cycle_limit is None or self.cycles < cycle_limit):
+                    executed += self.interpret(remaining, None if cycle_limit is None else cycle_limit - self.cycles)
+                if not self.exit_requested:
+                    return executed
+                # a peripheral requested an interrupt or a stop during the last instruction
+                self.exit_requested = False
+                if not self.interrupt_requested:
+                    return executed
+                self.interrupt_requested = False
+                self.pc = self.enter_interrupt(self.pc)
+        finally:
+            self.running = False
+
+    def interpret(self, max_instructions=None, max_cycles=None):
+        """
+        Run the program instruction by instruction, through the dispatch table (see run(...) for the parameters).
+
+        The instructions are executed in chunks without any checks in between: a chunk is never longer than the \
+        number of instructions that is left, nor than the number of instructions that surely fits in the cycles that \
+        are left. An instruction after which an interrupt has to be taken returns the address of the next \
+        instruction plus run_exit, which stops the chunk (and the run).
+
+        :param max_instructions: (optional) Number of instructions to execute.
+        :param max_cycles: (optional) Number of clock cycles to execute.
+        :return: The number of executed instructions. Raises ValueError if the program fails (unknown instruction, \
+                 stack overflow or underflow, program counter outside the program ROM).
+        """
+        if max_instructions is None and max_cycles is None:
+            raise ValueError('No number of instructions or cycles to run.')
+        cycle_limit = None if max_cycles is None else self.cycles + max_cycles
+        max_cost = max(instruction_cycles.values())
+
+        program = self.program
+        profile = self.profile
+        trace = self.trace
+        conditional = self.handlers['jz']
+        hits = taken = record = address_registers = None
+        if profile is not None:
+            hits = profile.hits
+            taken = profile.taken
+        if trace is not None:
+            record = trace.record
+            address_registers = trace.address_registers
+        registers = self.registers
+        indirect_address = None
+        pc = self.pc
+        cycles = self.cycles
+        executed = 0
+        step = 0
+        try:
+            while True:
+                count = None if max_instructions is None else max_instructions - executed
+                if cycle_limit is not None:
+                    # every instruction takes at most max_cost cycles
+                    fits = -(-(cycle_limit - cycles) // max_cost)
+                    count = fits if count is None else min(count, fits)
+                if count <= 0:
+                    break
+                if profile is None and trace is None:
+                    for step in range(count):
+                        handler, operand_1, operand_2, cost = program[pc]
+                        self.cycles = cycles
+                        pc = handler(pc, operand_1, operand_2)
+                        cycles += cost
+                else:
+                    for step in range(count):
+                        handler, operand_1, operand_2, cost = program[pc]
+                        self.cycles = cycles
+                        if trace is not None:
+                            # the address register of ldrr and strr can be overwritten by the instruction
+                            address_register = address_registers[pc]
+                            indirect_address = None if address_register is None else registers[address_register]
+                        next_pc = handler(pc, operand_1, operand_2)
+                        if profile is not None:
+                            hits[pc] += 1
+                            if next_pc != pc + 2 and handler is conditional:
+                                taken[pc] += 1
+                        if trace is not None:
+                            record(pc, cycles, indirect_address)
+                        pc = next_pc
+                        cycles += cost
+                executed += count
+                step = 0
+        except IndexError:
+            if pc < run_exit:
+                if pc >= len(program):
+                    raise ValueError('Program counter (%02X) outside the program ROM.' % pc)
+                raise ValueError('Stack underflow at address %02X.' % pc)
+        finally:
+            # after a failure (or an interrupt), step is the number of instructions of the chunk that were executed
+            executed += step
+            if pc >= run_exit:
+                pc -= run_exit
+            self.pc = pc
+            self.cycles = cycles
+            self.instructions += executed
+        return executed
+
+    def execute_blocks(self, max_instructions=None, cycle_limit=None):
+        """
+        Run the program block by block, as long as the next block fits in the number of instructions and the cycles \
+        that are left.
+
+        :param max_instructions: (optional) Number of instructions to execute.
+        :param cycle_limit: (optional) The cycle count at which to stop.
+        :return: The number of executed instructions.
+        """
+        instruction_limit = sys.maxsize if max_instructions is None else max_instructions
+        if cycle_limit is None:
+            cycle_limit = sys.maxsize
+
+        blocks = self.blocks
+        profile = self.profile
+        pc = self.pc
+        cycles = self.cycles
+        executed = 0
+        block = None
+        failed = False
+        # state after the last checked pass through a block that jumps back to itself: (start, state, cycles, \
+        # instructions, profile counters); a loop that is not idle is checked less and less often
+        idle = (None, None, 0, 0, None)
+        idle_interval = 0
+        idle_wait = 0
+        try:
+            while True:
+                block = blocks[pc]
+                if block is None:
+                    block = self.translate_block(pc)
+                function, block_count, block_cost, last_address, last_cost, loops = block
+                if executed + block_count > instruction_limit or cycles + block_cost > cycle_limit:
+                    break
+                self.cycles = cycles
+                start = pc
+                pc, count, cost = function()
+                executed += count
+                cycles += cost
+                if loops and pc == start and self.fast_forward:
+                    if idle_wait:
+                        idle_wait -= 1
+                        continue
+                    state = self.snapshot()
+                    if idle[0] == start and idle[1] == state:
+                        # the same state as the last check: skip all whole periods up to the limits
+                        period_cycles = cycles - idle[2]
+                        period_instructions = executed - idle[3]
+                        periods = min((cycle_limit - cycles) // period_cycles,
+                                      (instruction_limit - executed) // period_instructions)
+                        cycles += periods * period_cycles
+                        executed += periods * period_instructions
+                        if profile is not None:
+                            profile.repeat(idle[4], periods)
+                    else:
+                        idle_interval = min(2 * idle_interval + 1, max_idle_interval)
+                    idle_wait = idle_interval
+                    idle = (start, state, cycles, executed, None if profile is None else profile.snapshot())
+        except (IndexError, ValueError):
+            # a block that is left for an interrupt (or a stop) returns the address of the next instruction plus \
+            # run_exit
+            if pc < run_exit:
+                if pc >= len(blocks):
+                    raise ValueError('Program counter (%02X) outside the program ROM.' % pc)
+                # only the last instruction of a block can fail (before it changes the state): count the \
+                # instructions before it and run it again through the dispatch table, which reports the error
+                executed += block_count - 1
+                cycles += block_cost - last_cost
+                pc = last_address
+                failed = True
+                if profile is not None and self.program[pc][0] is not self.handlers['unknown']:
+                    # the block counted its last instruction (an unknown instruction is never part of a block)
+                    profile.block_counts[pc] -= 1
+                    profile.block_counts[pc + 2] += 1
+        finally:
+            if pc >= run_exit:
+                pc -= run_exit
+            self.pc = pc
+            self.cycles = cycles
+            self.instructions += executed
+        if failed:
+            self.interpret(1)
+        return executed
+
+    def translate_block(self, start):
+        """
+        Translate the basic block that starts at an address into a Python function, and cache it.
+
+        A block ends after an unconditional jump, a call or a return, after push and pop (so only its last \
+        instruction can fail), before the target of a jump (see jump_targets(...) ), before an unknown instruction \
+        and after max_block_length instructions. A conditional jump leaves the block when it is taken, and continues \
+        the block otherwise.
+
+        :param start: Start address of the block.
+        :return: A tuple (function, number of instructions, cycles, address of the last instruction, cycles of the \
+                 last instruction, whether the block jumps back to itself). The number of instructions and the cycles \
+                 are those of the complete block. The function executes the block and returns a tuple with the \
+                 address of the next instruction, the number of executed instructions and their cycles.
+        """
+        image = self.image + b'\x00'
+        instructions = list()
+        address = start
+        while address < len(self.image) and len(instructions) < max_block_length:
+            if instructions and address in self.leaders:
+                break
+            decoded = decode_instruction(image[address], image[address + 1])
+            if decoded is None:
+                break
+            instructions.append((address,) + decoded)
+            if decoded[0] in block_end_mnemonics:
+                break
+            # a conditional jump continues the block (unless the next instruction starts a block of its own)
+            address += 2
+
+        if not instructions:
+            # an unknown instruction is left to the dispatch table (which reports it)
+            handler, operand_1, operand_2, cost = self.program[start]
+            block = (lambda: (handler(start, operand_1, operand_2), 1, cost), 1, cost, start, cost, False)
+        else:
+            namespace = {'h_' + name: handler for name, handler in self.handlers.items()}
+            namespace.update({'r': self.registers, 'f': self.flags, 'memory': self.memory, 'stack': self.stack,
+                              'io_read': self.io_read_hooks, 'io_write': self.io_write_hooks, 'sim': self})
+            if self.profile is not None:
+                namespace.update({'counts': self.profile.block_counts, 'taken': self.profile.taken})
+            exec(compile(block_source(instructions, self.stack_depth, self.profile is not None), '<block %02X>' % start,
+                         'exec'), namespace)
+            costs = [instruction_cycles[instruction[1]] for instruction in instructions]
+            loops = any(decode_table_types[mnemonic] in ('jump', 'jump_conditional') and mnemonic != 'call'
+                        and operand_1 == start for _, mnemonic, _, operand_1, _ in instructions)
+            block = (namespace['block'], len(instructions), sum(costs), instructions[-1][0], costs[-1], loops)
+        self.blocks[start] = block
+        return block
+
+    def snapshot(self):
+        """
+        :return: The complete state of the processor (except the program counter and the counters), for comparison.
+        """
+        return (bytes(self.memory), tuple(self.registers), tuple(self.flags), tuple(self.stack), self.in_interrupt,
+                self.interrupt_pending)
+
+    def step(self):
+        """
+        Execute one instruction.
+
+        :return: Nothing
+        """
+        self.run(1)
+
+    def interrupt(self):
+        """
+        Request an interrupt. The return address is pushed on the stack, the flags are saved and the processor \
+        continues at the interrupt vector (02); reti restores the flags. An interrupt that is requested while the \
+        interrupt service routine runs, is taken after reti. An interrupt that a peripheral requests during run(...) \
+        (when the program writes to it) is taken after the current instruction.
+
+        :return: Nothing
+        """
+        if self.in_interrupt:
+            self.interrupt_pending = True
+        elif self.running:
+            self.interrupt_requested = True
+            self.exit_requested = True
+        else:
+            self.pc = self.enter_interrupt(self.pc)
+
+    def stop(self):
+        """
+        Leave run(...) after the current instruction, e.g. for a peripheral that schedules an event while the program \
+        writes to it. Nothing happens outside run(...).
+
+        :return: Nothing
+        """
+        if self.running:
+            self.exit_requested = True
+
+    def enter_interrupt(self, return_address):
+        """
+        Enter the interrupt service routine.
+
+        :param return_address: The address of the interrupted instruction.
+        :return: The address of the interrupt vector.
+        """
+        if len(self.stack) >= self.stack_depth:
+            raise ValueError('Stack overflow at address %02X (interrupt).' % return_address)
+        self.stack.append(return_address)
+        self.saved_flags[:] = self.flags
+        self.in_interrupt = True
+        return 2
+
+    def map_io(self, address, read=None, write=None):
+        """
+        Connect a peripheral to an I/O location.
+
+        :param address: The address of the I/O location (A0 - FF).
+        :param read: (optional) Function without arguments that returns the value that is read (ldr/ldrr).
+        :param write: (optional) Function that is called with the value that is written (str/strr). The value is \
+                      stored in the data memory as well, after the call (so the function can compare it with the \
+                      previous value). The function can request an interrupt (see interrupt() ) or a stop (see stop() ).
+        :return: Nothing
+        """
+        if not io_start <= address < data_memory_size:
+            raise ValueError('Address %02X is not an I/O location.' % address)
+        self.io_read_hooks[address] = read
+        self.io_write_hooks[address] = write
+
+    def format_state(self):
+        """
+        :return: The state of the processor (program counter, registers, flags, stack and RAM) as text.
+        """
+        lines = ['PC: %02X   cycles: %d   instructions: %d' % (self.pc, self.cycles, self.instructions)]
+        lines.append('   '.join('%s: %02X' % (register_names[code].upper(), self.registers[code]) for code in range(8)))
+        lines.append('flags: ' + ' '.join(name + '=' + str(int(value)) for name, value in zip(flag_names, self.flags)))
+        lines.append('stack: ' + (' '.join('%02X' % value for value in self.stack) or '(empty)'))
+        for start in range(ram_start, ram_end + 1, 16):
+            lines.append('RAM %02X: ' % start + ' '.join('%02X' % value for value in self.memory[start:start + 16]))
+        return '\n'.join(lines)
+
+
+class Profile:
+    """
+    Execution counters of a simulation, with an entry for every address of the program ROM (see \
+    Simulator(..., profile=True) ). The lists are allocated once, and a basic block updates them with only two \
+    operations: it adds 1 to block_counts at its first address and subtracts 1 after its last instruction, so the \
+    running sum over the addresses (separately for the even and the odd ones) is the number of executions of every \
+    instruction. A block that is left early (a taken conditional jump, an interrupt) moves the subtraction up to the \
+    instruction that left it. The instructions executed through the dispatch table are counted in hits, and taken \
+    counts how often every conditional jump was taken.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: The size of the program ROM.
+        """
+        self.block_counts = [0] * (size + 2)
+        self.hits = [0] * size
+        self.taken = [0] * size
+
+    def snapshot(self):
+        """
+        :return: A copy of the counters that the basic blocks update (see repeat(...) ).
+        """
+        return list(self.block_counts), list(self.taken)
+
+    def repeat(self, snapshot, times):
+        """
+        Count the executions since a snapshot again a number of times (for the passes through an idle loop that are \
+        fast-forwarded).
+
+        :param snapshot: The counters at the start of the period (see snapshot() ).
+        :param times: Number of times to add the period.
+        :return: Nothing
+        """
+        for counters, previous in zip((self.block_counts, self.taken), snapshot):
+            for address, value in enumerate(previous):
+                if counters[address] != value:
+                    counters[address] += times * (counters[address] - value)
+
+    def executions(self):
+        """
+        :return: A list with the number of executions of the instruction at every address.
+        """
+        executions = list(self.hits)
+        running = [0, 0]
+        for address in range(len(executions)):
+            running[address & 1] += self.block_counts[address]
+            executions[address] += running[address & 1]
+        return executions
+
+    def cycles(self, program):
+        """
+        :param program: The predecoded program (see Simulator.predecode(...) ).
+        :return: A list with the clock cycles spent in the instruction at every address.
+        """
+        return [count * program[address][3] for address, count in enumerate(self.executions())]
+
+
+class Board:
+    """
+    Peripherals of the lab board, connected to the I/O locations of a simulator:
+        - IRQE (C0): interrupt enable; IRQF (C1): interrupt flags, cleared when read
+        - TRM1S (D8): timer; writing 1 starts it, writing 0 stops it. It sets the timer flag every second.
+        - BTNS (E8): buttons; pressing a button sets the buttons flag
+        - SW_L (E0), SW_H (E1): switches
+        - LEDS_L (F0), LEDS_H (F1), BCD0 - BCD3 (F8 - FB), RGB (D0 - D2): outputs
+    An interrupt is requested when a flag is set that is enabled in IRQE.
+
+    The peripherals are driven by an event queue, ordered by clock cycle. run(...) runs the simulator up to the next \
+    event, handles the due events (timer ticks, changes of the inputs) and continues. While the program waits for \
+    an event in an idle loop, the simulator fast-forwards (see Simulator), so a simulated second takes about as long \
+    as the code that runs in it.
+    """
+
+    def __init__(self, simulator, clock_frequency=default_clock_frequency):
+        """
+        :param simulator: The Simulator.
+        :param clock_frequency: The clock frequency of the processor (Hz).
+        """
+        self.simulator = simulator
+        self.clock_frequency = clock_frequency
+        self.events = list()
+        self.sequence = 0
+        self.timer_generation = 0
+        self.output_listeners = list()
+        # the cycle count up to which the simulator runs (during run(...) )
+        self.run_limit = None
+        simulator.map_io(irqe_address, write=self.write_irqe)
+        simulator.map_io(irqf_address, read=self.read_irqf)
+        simulator.map_io(timer_address, write=self.write_timer)
+        for address in output_names:
+            simulator.map_io(address, write=self.output_writer(address))
+
+    def schedule(self, cycle, action):
+        """
+        Add an event to the queue.
+
+        :param cycle: The clock cycle of the event.
+        :param action: Function that is called with the clock cycle of the event.
+        :return: Nothing
+        """
+        heapq.heappush(self.events, (cycle, self.sequence, action))
+        self.sequence += 1
+        # an event that a peripheral schedules while the program runs, can be due before the end of the current run
+        if self.run_limit is None or cycle < self.run_limit:
+            self.simulator.stop()
+
+    def seconds_to_cycles(self, seconds):
+        """
+        :param seconds: Simulated time (s).
+        :return: The number of clock cycles.
+        """
+        return int(round(seconds * self.clock_frequency))
+
+    def press_buttons(self, seconds, value):
+        """
+        Schedule a change of the buttons.
+
+        :param seconds: The simulated time of the change (s).
+        :param value: The new state of the buttons (BTNS).
+        :return: Nothing
+        """
+        self.schedule(self.seconds_to_cycles(seconds), lambda cycle: self.set_buttons(value))
+
+    def flip_switches(self, seconds, value):
+        """
+        Schedule a change of the switches.
+
+        :param seconds: The simulated time of the change (s).
+        :param value: The new state of the switches (16 bits: SW_H, SW_L).
+        :return: Nothing
+        """
+        self.schedule(self.seconds_to_cycles(seconds), lambda cycle: self.set_switches(value))
+
+    def set_buttons(self, value):
+        """
+        :param value: The new state of the buttons. A button that is pressed sets the buttons flag.
+        :return: Nothing
+        """
+        memory = self.simulator.memory
+        value &= 0xff
+        pressed = value & ~memory[buttons_address]
+        memory[buttons_address] = value
+        if pressed:
+            self.raise_flag(buttons_irq_mask)
+
+    def set_switches(self, value):
+        """
+        :param value: The new state of the switches (16 bits: SW_H, SW_L).
+        :return: Nothing
+        """
+        memory = self.simulator.memory
+        memory[switches_addresses[0]] = value & 0xff
+        memory[switches_addresses[1]] = (value >> 8) & 0xff
+
+    def raise_flag(self, mask):
+        """
+        Set an interrupt flag, and request an interrupt if it is enabled.
+
+        :param mask: The flag (bit mask of IRQF).
+        :return: Nothing
+        """
+        memory = self.simulator.memory
+        memory[irqf_address] |= mask
+        if memory[irqe_address] & mask:
+            self.simulator.interrupt()
+
+    def write_irqe(self, value):
+        """
+        Write hook of IRQE: enabling a flag that is already set requests an interrupt.
+
+        :param value: The value that is written.
+        :return: Nothing
+        """
+        memory = self.simulator.memory
+        if value & ~memory[irqe_address] & memory[irqf_address]:
+            self.simulator.interrupt()
+
+    def read_irqf(self):
+        """
+        Read hook of IRQF: the flags are cleared when they are read.
+
+        :return: The flags.
+        """
+        memory = self.simulator.memory
+        value = memory[irqf_address]
+        memory[irqf_address] = 0
+        # the flags that were read, no longer request an interrupt
+        self.simulator.interrupt_pending = False
+        return value
+
+    def write_timer(self, value):
+        """
+        Write hook of TRM1S: bit 0 starts (1) or stops (0) the timer. Writing the same value again does not restart \
+        the timer.
+
+        :param value: The value that is written.
+        :return: Nothing
+        """
+        enabled = self.simulator.memory[timer_address] & 1
+        if value & 1 and not enabled:
+            self.timer_generation += 1
+            self.schedule_tick(self.simulator.cycles + self.clock_frequency, self.timer_generation)
+        elif not value & 1 and enabled:
+            # the pending tick belongs to an older generation, so it is ignored
+            self.timer_generation += 1
+
+    def schedule_tick(self, cycle, generation):
+        """
+        Schedule a tick of the timer (it schedules the next one). Stopping the timer starts a new generation, which \
+        cancels the ticks of the previous one.
+
+        :param cycle: The clock cycle of the tick.
+        :param generation: The generation of the timer.
+        :return: Nothing
+        """
+        def tick(tick_cycle):
+            if generation == self.timer_generation:
+                self.raise_flag(timer_irq_mask)
+                self.schedule_tick(tick_cycle + self.clock_frequency, generation)
+        self.schedule(cycle, tick)
+
+    def output_writer(self, address):
+        """
+        :param address: The address of an output.
+        :return: The write hook of the output: it calls every function of output_listeners with the clock cycle, \
+                 the address and the value when the value of the output changes.
+        """
+        memory = self.simulator.memory
+
+        def write(value):
+            if value != memory[address]:
+                for listener in self.output_listeners:
+                    listener(self.simulator.cycles, address, value)
+        return write
+
+    def run(self, max_instructions=None, max_cycles=None):
+        """
+        Run the simulator and the peripherals (see Simulator.run(...) for the parameters).
+
+        :return: Nothing. Raises ValueError if the program fails.
+        """
+        if max_instructions is None and max_cycles is None:
+            raise ValueError('No number of instructions or cycles to run.')
+        simulator = self.simulator
+        events = self.events
+        cycle_end = None if max_cycles is None else simulator.cycles + max_cycles
+        instruction_end = None if max_instructions is None else simulator.instructions + max_instructions
+        while True:
+            while events and events[0][0] <= simulator.cycles:
+                cycle, _, action = heapq.heappop(events)
+                action(cycle)
+            limit = cycle_end
+            if events and (limit is None or events[0][0] < limit):
+                limit = events[0][0]
+            instructions = None if instruction_end is None else instruction_end - simulator.instructions
+            if limit is not None and limit <= simulator.cycles or instructions is not None and instructions <= 0:
+                break
+            self.run_limit = limit
+            try:
+                simulator.run(instructions, None if limit is None else limit - simulator.cycles)
+            finally:
+                self.run_limit = None
+
+    def format_outputs(self):
+        """
+        :return: The state of the outputs (LEDs, BCD displays, RGB LED) and inputs as text.
+        """
+        memory = self.simulator.memory
+        lines = ['LEDS: %02X%02X   BCD3-0: %X %X %X %X   RGB: %02X %02X %02X'
+                 % tuple(memory[address] for address in (0xf1, 0xf0, 0xfb, 0xfa, 0xf9, 0xf8, 0xd0, 0xd1, 0xd2))]
+        lines.append('SW: %02X%02X   BTNS: %02X   IRQE: %02X   IRQF: %02X   TRM1S: %02X'
+                     % tuple(memory[address] for address in (0xe1, 0xe0, buttons_address, irqe_address,
+                                                              irqf_address, timer_address)))
+        return '\n'.join(lines)
+
+
+def compile_handlers(simulator):
+    """
+    Build the dispatch table of a simulator: a handler for every mnemonic (see asminfo.py). A handler is called with \
+    the address of the instruction and its two decoded operands (see operand_decoders), executes the instruction on \
+    the state of the simulator and returns the address of the next instruction.
+
+    :param simulator: The Simulator.
+    :return: A dictionary with the handler of every mnemonic, of the I/O variants of ldr and str ('ldr_io' and \
+             'str_io') and of unknown instructions ('unknown').
+    """
+    r = simulator.registers
+    f = simulator.flags
+    memory = simulator.memory
+    stack = simulator.stack
+    stack_depth = simulator.stack_depth
+    io_read = simulator.io_read_hooks
+    io_write = simulator.io_write_hooks
+
+    def unknown(pc, high_byte, low_byte):
+        raise ValueError('Unknown instruction %02X%02X at address %02X.' % (high_byte, low_byte, pc))
+
+    def load(address):
+        hook = io_read[address] if address >= io_start else None
+        return memory[address] if hook is None else hook()
+
+    def store(pc, address, value):
+        if address >= io_start:
+            hook = io_write[address]
+            if hook is not None:
+                hook(value)
+                if simulator.exit_requested:
+                    memory[address] = value
+                    return pc + 2 + run_exit
+        memory[address] = value
+        return pc + 2
+
+    # jump instructions
+    def nop(pc, a, b):
+        return pc + 2
+
+    def reti(pc, a, b):
+        address = stack.pop()
+        if simulator.in_interrupt:
+            f[:] = simulator.saved_flags
+            simulator.in_interrupt = False
+            if simulator.interrupt_pending:
+                simulator.interrupt_pending = False
+                return simulator.enter_interrupt(address)
+        return address
+
+    def retc(pc, a, b):
+        return stack.pop()
+
+    def call(pc, address, b):
+        if len(stack) >= stack_depth:
+            raise ValueError('Stack overflow at address %02X (call).' % pc)
+        stack.append(pc + 2)
+        return address
+
+    def jmp(pc, address, b):
+        return address
+
+    def jump_conditional(pc, address, flag):
+        return address if f[flag] else pc + 2
+
+    # register / memory instructions
+    def movl(pc, rd, literal):
+        r[rd] = literal
+        return pc + 2
+
+    def movr(pc, rd, rs):
+        r[rd] = r[rs]
+        return pc + 2
+
+    def ldr(pc, rd, address):
+        r[rd] = memory[address]
+        return pc + 2
+
+    def ldr_io(pc, rd, address):
+        hook = io_read[address]
+        r[rd] = memory[address] if hook is None else hook()
+        return pc + 2
+
+    def str_(pc, address, rs):
+        memory[address] = r[rs]
+        return pc + 2
+
+    def str_io(pc, address, rs):
+        return store(pc, address, r[rs])
+
+    def ldrr(pc, rd, rs):
+        r[rd] = load(r[rs])
+        return pc + 2
+
+    def strr(pc, rd, rs):
+        return store(pc, r[rd], r[rs])
+
+    def push(pc, rs, b):
+        if len(stack) >= stack_depth:
+            raise ValueError('Stack overflow at address %02X (push).' % pc)
+        stack.append(r[rs])
+        return pc + 2
+
+    def pop(pc, rd, b):
+        r[rd] = stack.pop()
+        return pc + 2
+
+    # ALU operations - single operand
+    def not_(pc, rds, b):
+        value = r[rds] ^ 0xff
+        r[rds] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def rr(pc, rds, b):
+        value = r[rds]
+        f[1] = value & 1 == 1
+        r[rds] = (value >> 1) | (value & 1) << 7
+        f[0] = value == 0
+        return pc + 2
+
+    def rl(pc, rds, b):
+        value = r[rds] << 1
+        f[1] = value > 0xff
+        r[rds] = (value | value >> 8) & 0xff
+        f[0] = value == 0
+        return pc + 2
+
+    def swap(pc, rds, b):
+        value = r[rds]
+        r[rds] = (value << 4 | value >> 4) & 0xff
+        f[0] = value == 0
+        return pc + 2
+
+    # ALU operations - two operands
+    def andl(pc, rd, literal):
+        value = r[rd] & literal
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def andr(pc, rd, rs):
+        value = r[rd] & r[rs]
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def orl(pc, rd, literal):
+        value = r[rd] | literal
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def orr(pc, rd, rs):
+        value = r[rd] | r[rs]
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def xorl(pc, rd, literal):
+        value = r[rd] ^ literal
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def xorr(pc, rd, rs):
+        value = r[rd] ^ r[rs]
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def addl(pc, rd, literal):
+        value = r[rd] + literal
+        f[1] = value > 0xff
+        value &= 0xff
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def addr(pc, rd, rs):
+        value = r[rd] + r[rs]
+        f[1] = value > 0xff
+        value &= 0xff
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def subl(pc, rd, literal):
+        value = r[rd] - literal
+        f[1] = value < 0
+        value &= 0xff
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def subr(pc, rd, rs):
+        value = r[rd] - r[rs]
+        f[1] = value < 0
+        value &= 0xff
+        r[rd] = value
+        f[0] = value == 0
+        return pc + 2
+
+    def cmpl(pc, rd, literal):
+        value = r[rd]
+        f[2] = value == literal
+        f[3] = value > literal
+        f[4] = value < literal
+        return pc + 2
+
+    def cmpr(pc, rd, rs):
+        value = r[rd]
+        other = r[rs]
+        f[2] = value == other
+        f[3] = value > other
+        f[4] = value < other
+        return pc + 2
+
+    handlers = {'nop': nop, 'reti': reti, 'retc': retc, 'call': call, 'jmp': jmp, 'movl': movl, 'movr': movr,
+                'ldr': ldr, 'ldr_io': ldr_io, 'str': str_, 'str_io': str_io, 'ldrr': ldrr, 'strr': strr,
+                'push': push, 'pop': pop, 'not': not_, 'rr': rr, 'rl': rl, 'swap': swap, 'andl': andl, 'andr': andr,
+                'orl': orl, 'orr': orr, 'xorl': xorl, 'xorr': xorr, 'addl': addl, 'addr': addr, 'subl': subl,
+                'subr': subr, 'cmpl': cmpl, 'cmpr': cmpr, 'unknown': unknown}
+    for mnemonic, (instruction_type, _) in encoding_tables['instructions'].items():
+        if instruction_type == 'jump_conditional':
+            handlers[mnemonic] = jump_conditional
+    return handlers
+
+
+def decode_instruction(high_byte, low_byte):
+    """
+    Decode one instruction.
+
+    :param high_byte: The most significant byte of the instruction (opcode and flag, Rd or Rs).
+    :param low_byte: The least significant byte of the instruction (address, literal or Rs).
+    :return: A tuple (mnemonic, handler name, operand, operand), or None for an unknown instruction. The handler name \
+             is the mnemonic, except for loads and stores with a fixed I/O address ('ldr_io' and 'str_io').
+    """
+    decoded = decode_table[high_byte]
+    if decoded is None:
+        return None
+    mnemonic, instruction_type = decoded
+    operand_1, operand_2 = operand_decoders[instruction_type](high_byte, low_byte)
+    handler_name = mnemonic
+    # loads and stores with a fixed I/O address get a handler that calls the peripherals
+    if mnemonic == 'ldr' and operand_2 >= io_start or mnemonic == 'str' and operand_1 >= io_start:
+        handler_name += '_io'
+    return mnemonic, handler_name, operand_1, operand_2
+
+
+def jump_targets(image):
+    """
+    :param image: The contents of the program ROM.
+    :return: The set of addresses where a basic block starts: the reset and interrupt vectors and the targets of \
+             the jumps and calls.
+    """
+    targets = {0, 2}
+    for address in range(0, len(image) - 1, 2):
+        decoded = decode_table[image[address]]
+        if decoded is not None and decoded[1] in ('jump', 'jump_conditional'):
+            targets.add(image[address + 1])
+    return targets
+
+
+def block_source(instructions, stack_depth, profile=False):
+    """
+    Generate the Python source of a basic block. The operands are filled in as constants, and flags that are \
+    overwritten further on in the block (before a conditional jump reads them or the block can be left) are not \
+    computed.
+
+    :param instructions: The instructions of the block: tuples (address, mnemonic, handler name, operand, operand).
+    :param stack_depth: Number of entries of the stack.
+    :param profile: Setting profile to True adds the updates of the profile counters (see Profile).
+    :return: The source of a function "block" that executes the instructions and returns a tuple with the address of \
+             the next instruction, the number of executed instructions and their cycles (a taken conditional jump \
+             leaves the block early).
+    """
+    # number of instructions and cycles up to (and including) every instruction
+    totals = [(0, 0)]
+    cycles = 0
+    for index, instruction in enumerate(instructions):
+        cycles += instruction_cycles[instruction[1]]
+        totals.append((index + 1, cycles))
+    offsets = [cycles for _, cycles in totals[:-1]]
+    del totals[0]
+
+    all_flags = set(range(len(flag_names)))
+    live_flags = set(all_flags)
+    last = len(instructions) - 1
+    end = instructions[last][0] + 2
+    bodies = list()
+    for index in range(last, -1, -1):
+        address, mnemonic, handler_name, operand_1, operand_2 = instructions[index]
+        count, cycles = totals[index]
+        values = {'pc': address, 'next': address + 2, 'a': operand_1, 'b': operand_2, 'depth': stack_depth,
+                  'offset': offsets[index], 'exit': address + 2 + run_exit}
+        # the profile counters of a block that is left before its last instruction
+        leave = ['counts[%d] -= 1' % (address + 2), 'counts[%d] += 1' % end] if profile and index < last else []
+        body = ['    # %02X: %s' % (address, mnemonic)]
+        if decode_table_types[mnemonic] == 'jump_conditional':
+            taken = ['taken[%d] += 1' % address] if profile and operand_1 != address + 2 else []
+            if index < last:
+                # a conditional jump within the block: leave the block when it is taken
+                body.append('    if f[%d]:' % operand_2)
+                body.extend('        ' + line for line in leave + taken)
+                body.append('        return %d, %d, %d' % (operand_1, count, cycles))
+                live_flags = set(all_flags)
+                bodies.append(body)
+                continue
+            if taken:
+                body.extend(['    if f[%d]:' % operand_2, '        ' + taken[0],
+                             '        return %d, %d, %d' % (operand_1, count, cycles),
+                             '    return %d, %d, %d' % (address + 2, count, cycles)])
+                bodies.append(body)
+                continue
+        written_flags = set()
+        leaves_block = False
+        for line in block_templates[handler_name]:
+            if isinstance(line, tuple):
+                line, flag = line
+                written_flags.add(flag)
+                if flag not in live_flags:
+                    continue
+            line = line.format(**values)
+            statement = line.lstrip()
+            if statement.startswith('return '):
+                indent = line[:len(line) - len(statement)]
+                body.extend('    ' + indent + profile_line for profile_line in leave)
+                line = indent + 'return (%s), %d, %d' % (statement[len('return '):], count, cycles)
+                leaves_block = True
+            body.append('    ' + line)
+        bodies.append(body)
+        live_flags -= written_flags
+        if leaves_block:
+            # the block can be left here (eg: an interrupt requested by a store), with the flags written before
+            live_flags = set(all_flags)
+
+    lines = ['def block(r=r, f=f, memory=memory, stack=stack, io_read=io_read, io_write=io_write, sim=sim):']
+    if profile:
+        # every instruction of the block counts as executed, up to where the block is left
+        lines[0] = lines[0][:-2] + ', counts=counts, taken=taken):'
+        lines.extend(['    counts[%d] += 1' % instructions[0][0], '    counts[%d] -= 1' % end])
+    if any(instruction[2] in io_handler_names for instruction in instructions):
+        # the cycle count at the start of the block (see Simulator.execute_blocks(...) )
+        lines.append('    base = sim.cycles')
+    for body in reversed(bodies):
+        lines.extend(body)
+    if not lines[-1].startswith('    return'):
+        lines.append('    return %d, %d, %d' % ((instructions[-1][0] + 2,) + totals[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+def decode_address(high_byte, low_byte):
+    """
+    Decode the operands of a jump instruction: address.
+
+    :param high_byte: The most significant byte of the instruction (opcode and flag, Rd or Rs).
+    :param low_byte: The least significant byte of the instruction (address, literal or Rs).
+    :return: A tuple with the values of both operands.
+    """
+    return low_byte, None
+
+
+def decode_conditional(high_byte, low_byte):
+    """
+    Decode the operands of a conditional jump instruction: address, flag code (see decode_address(...) for the \
+    parameters).
+    """
+    return low_byte, high_byte & 7
+
+
+def decode_no_address(high_byte, low_byte):
+    """
+    Decode the operands of a jump instruction without address (see decode_address(...) for the parameters).
+    """
+    return None, None
+
+
+def decode_single_register(high_byte, low_byte):
+    """
+    Decode the operands of a single register instruction: Rds (see decode_address(...) for the parameters).
+    """
+    return high_byte & 7, None
+
+
+def decode_two_registers(high_byte, low_byte):
+    """
+    Decode the operands of a register-to-register or indirect memory instruction: Rd, Rs (see decode_address(...) \
+    for the parameters).
+    """
+    return high_byte & 7, low_byte >> 5
+
+
+def decode_register_to_memory(high_byte, low_byte):
+    """
+    Decode the operands of a register-to-memory instruction: address, Rs (see decode_address(...) for the parameters).
+    """
+    return low_byte, high_byte & 7
+
+
+def decode_x_to_register(high_byte, low_byte):
+    """
+    Decode the operands of a memory/literal-to-register instruction: Rd, address or literal (see \
+    decode_address(...) for the parameters).
+    """
+    return high_byte & 7, low_byte
+
+
+# Operand decoder for every instruction type (see asminfo.py)
+operand_decoders = {
+    'jump': decode_address,
+    'jump_conditional': decode_conditional,
+    'jump_no_address': decode_no_address,
+    'single_register': decode_single_register,
+    'register_to_register': decode_two_registers,
+    'indirect_memory': decode_two_registers,
+    'register_to_memory': decode_register_to_memory,
+    'x_to_register': decode_x_to_register
+}
+
+# Name of every flag, in the order of the flag codes of the conditional jumps (jz -> Z, jc -> C, ...)
+flag_names = [None] * 5
+for flag_mnemonic, (flag_type, flag_high_byte) in encoding_tables['instructions'].items():
+    if flag_type == 'jump_conditional':
+        flag_names[flag_high_byte & 7] = flag_mnemonic[1:].upper()
+
+
+# Type of every mnemonic
+decode_table_types = {mnemonic: instruction_type
+                      for mnemonic, (instruction_type, _) in encoding_tables['instructions'].items()}
+
+# Mnemonics that end a basic block: unconditional jumps, calls and returns, and the stack instructions (which can fail)
+block_end_mnemonics = {mnemonic for mnemonic, instruction_type in decode_table_types.items()
+                       if instruction_type in ('jump', 'jump_no_address') and mnemonic != 'nop'}
+block_end_mnemonics.update(('push', 'pop'))
+
+# Handlers that can call a peripheral
+io_handler_names = {'ldr_io', 'str_io', 'ldrr', 'strr'}
+
+# Python source of every handler in a basic block ({a} and {b} are the operands, {pc} and {next} the address of the \
+# instruction and of the next one, {depth} the depth of the stack, {offset} the cycles of the block before the \
+# instruction, to bring the cycle count up to date before a peripheral is called, {exit} the address of the next \
+# instruction plus run_exit, to leave the block for an interrupt or a stop that a peripheral requested). A tuple \
+# (line, flag) is a line that only sets a flag. A line that raises ValueError leaves the error message to the dispatch \
+# table.
+block_templates = {
+    'nop': [],
+    'reti': ['return h_reti({pc}, None, None)'],
+    'retc': ['return stack.pop()'],
+    'call': ['if len(stack) >= {depth}:', '    raise ValueError', 'stack.append({next})', 'return {a}'],
+    'jmp': ['return {a}'],
+    'movl': ['r[{a}] = {b}'],
+    'movr': ['r[{a}] = r[{b}]'],
+    'ldr': ['r[{a}] = memory[{b}]'],
+    'ldr_io': ['v = io_read[{b}]', 'if v is None:', '    r[{a}] = memory[{b}]', 'else:',
+               '    sim.cycles = base + {offset}', '    r[{a}] = v()'],
+    'str': ['memory[{a}] = r[{b}]'],
+    'str_io': ['v = r[{b}]', 'if io_write[{a}] is not None:', '    sim.cycles = base + {offset}',
+               '    io_write[{a}](v)', '    if sim.exit_requested:', '        memory[{a}] = v',
+               '        return {exit}', 'memory[{a}] = v'],
+    'ldrr': ['sim.cycles = base + {offset}', 'h_ldrr({pc}, {a}, {b})'],
+    'strr': ['sim.cycles = base + {offset}', 'if h_strr({pc}, {a}, {b}) != {next}:', '    return {exit}'],
+    'push': ['if len(stack) >= {depth}:', '    raise ValueError', 'stack.append(r[{a}])'],
+    'pop': ['r[{a}] = stack.pop()'],
+    'not': ['v = r[{a}] ^ 0xff', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'rr': ['v = r[{a}]', ('f[1] = v & 1 == 1', 1), 'r[{a}] = v >> 1 | (v & 1) << 7', ('f[0] = v == 0', 0)],
+    'rl': ['v = r[{a}] << 1', ('f[1] = v > 0xff', 1), 'r[{a}] = (v | v >> 8) & 0xff', ('f[0] = v == 0', 0)],
+    'swap': ['v = r[{a}]', 'r[{a}] = (v << 4 | v >> 4) & 0xff', ('f[0] = v == 0', 0)],
+    'andl': ['v = r[{a}] & {b}', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'andr': ['v = r[{a}] & r[{b}]', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'orl': ['v = r[{a}] | {b}', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'orr': ['v = r[{a}] | r[{b}]', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'xorl': ['v = r[{a}] ^ {b}', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'xorr': ['v = r[{a}] ^ r[{b}]', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'addl': ['v = r[{a}] + {b}', ('f[1] = v > 0xff', 1), 'v &= 0xff', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'addr': ['v = r[{a}] + r[{b}]', ('f[1] = v > 0xff', 1), 'v &= 0xff', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'subl': ['v = r[{a}] - {b}', ('f[1] = v < 0', 1), 'v &= 0xff', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'subr': ['v = r[{a}] - r[{b}]', ('f[1] = v < 0', 1), 'v &= 0xff', 'r[{a}] = v', ('f[0] = v == 0', 0)],
+    'cmpl': ['v = r[{a}]', ('f[2] = v == {b}', 2), ('f[3] = v > {b}', 3), ('f[4] = v < {b}', 4)],
+    'cmpr': ['v = r[{a}]', 'w = r[{b}]', ('f[2] = v == w', 2), ('f[3] = v > w', 3), ('f[4] = v < w', 4)]
+}
+for conditional_mnemonic, conditional_type in decode_table_types.items():
+    if conditional_type == 'jump_conditional':
+        block_templates[conditional_mnemonic] = ['return {a} if f[{b}] else {next}']
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
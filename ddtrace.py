@@ -0,0 +1,324 @@
+"""
+Execution trace of the LDD mark II processor simulator (see ddsim.py, option --trace). Every executed instruction \
+is recorded as a fixed-size binary entry in a ring buffer, which keeps the last instructions of a run (e.g. before a \
+failure); the buffer can also be streamed to a file chunk by chunk, to trace a complete run. Trace files are decoded \
+lazily into DDA mnemonics.
+DDASM = Digital Design Assmebly
+LDD = Lab Digital Design
+Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
+"""
+import sys
+import mmap
+import struct
+from ddasm import encoding_tables, pop_option, positive_number
+from ddisasm import decode_table, register_names, operand_formatters
+
+# First bytes of a trace file
+trace_magic = b'DDTRACE1'
+
+# Binary layout of a trace entry: clock cycle (at the start of the instruction), address, instruction code, register \
+# written (no_register if none) and its new value, flags (bit 0: Z, 1: C, 2: E, 3: G, 4: S, after the instruction), \
+# memory access (no_access, read_access or write_access), memory address and the value read or written
+entry_format = struct.Struct('<QHHBBBBBB')
+no_register = 0xff
+no_access = 0
+read_access = 1
+write_access = 2
+
+# Default number of entries of the ring buffer
+default_trace_length = 65536
+
+# Names of the flags, in the order of the bits of a trace entry
+trace_flag_names = [None] * 5
+for flag_mnemonic, (flag_type, flag_high_byte) in encoding_tables['instructions'].items():
+    if flag_type == 'jump_conditional':
+        trace_flag_names[flag_high_byte & 7] = flag_mnemonic[1:].upper()
+
+
+def main(argv):
+    """
+    Decode a trace file.
+
+    :param argv: The list of command line arguments passed to this script.
+    :return: The script returns exit code 0 on success; -1 otherwise.
+    """
+    args = list(argv[1:])
+    try:
+        first = pop_option(args, '--first', positive_number)
+        last = pop_option(args, '--last', positive_number)
+    except ValueError:
+        print('ERROR: "--first" and "--last" expect a positive number.')
+        print_usage()
+        return -1
+    if len(args) != 1:
+        print('ERROR: Expecting 1 trace file.')
+        print_usage()
+        return -1
+
+    try:
+        trace = TraceFile(args[0])
+    except (IOError, ValueError) as e:
+        print('ERROR: Failed to read ' + args[0] + (' (' + str(e) + ').' if str(e) else '.'))
+        return -1
+    with trace:
+        start, end = 0, len(trace)
+        if first is not None:
+            end = min(end, first)
+        if last is not None:
+            start = max(start, end - last)
+        print('%d entries' % len(trace))
+        for index in range(start, end):
+            print(format_entry(trace[index]))
+    return 0
+
+
+def print_usage():
+    """
+    Print an informational message on how to use the trace decoder.
+
+    :return: Nothing
+    """
+    print('USAGE: python ddtrace.py trace_file [--first N] [--last N]')
+    print(' * trace_file : Trace file written by the simulator (python ddsim.py ... --trace FILE).')
+    print(' * --first N  : (optional) Only decode the first N entries.')
+    print(' * --last N   : (optional) Only decode the last N entries (of the first N, with --first).')
+
+
+class Trace:
+    """
+    Recorder of the instructions that a simulator executes (see ddsim.Simulator(..., trace=...) ).
+
+    The entries (see entry_format) are packed into a preallocated buffer of length entries. Without a stream, the \
+    buffer is a ring: it keeps the last length entries. With a stream (a binary file), the trace file header is \
+    written first and the buffer is written to the stream whenever it is full, so the complete run is traced with \
+    bounded memory; flush() writes the entries that are left at the end.
+    """
+
+    def __init__(self, length=default_trace_length, stream=None):
+        """
+        :param length: Number of entries of the buffer.
+        :param stream: (optional) Binary file to which the complete trace is written.
+        """
+        self.length = length
+        self.buffer = bytearray(length * entry_format.size)
+        self.view = memoryview(self.buffer)
+        self.position = 0
+        self.count = 0
+        self.stream = stream
+        if stream is not None:
+            stream.write(trace_magic)
+        self.registers = None
+        self.flags = None
+        self.memory = None
+        # static information of every address of the program ROM (see attach(...) )
+        self.instructions = list()
+        self.address_registers = list()
+
+    def attach(self, simulator):
+        """
+        Connect the trace to the state of a simulator, and decode its program ROM: the code of every instruction, \
+        the register it writes and the memory it accesses.
+
+        :param simulator: The ddsim.Simulator.
+        :return: Nothing
+        """
+        self.registers = simulator.registers
+        self.flags = simulator.flags
+        self.memory = simulator.memory
+        image = bytes(simulator.image) + b'\x00'
+        self.instructions = list()
+        self.address_registers = list()
+        for address in range(len(image) - 1):
+            high_byte, low_byte = image[address], image[address + 1]
+            instruction, address_register = trace_info(high_byte, low_byte)
+            self.instructions.append(instruction)
+            self.address_registers.append(address_register)
+
+    def record(self, pc, cycles, indirect_address):
+        """
+        Record an executed instruction (called after the instruction).
+
+        :param pc: The address of the instruction.
+        :param cycles: The clock cycle at the start of the instruction.
+        :param indirect_address: The memory address of ldrr or strr (the value of its address register before the \
+                                 instruction, see address_registers); None for the other instructions.
+        :return: Nothing
+        """
+        word, register, access, address = self.instructions[pc]
+        if indirect_address is not None:
+            address = indirect_address
+        value = 0
+        if access == read_access:
+            value = self.registers[register]
+        elif access == write_access:
+            value = self.memory[address]
+        f = self.flags
+        entry_format.pack_into(self.buffer, self.position * entry_format.size, cycles, pc, word, register,
+                               0 if register == no_register else self.registers[register],
+                               f[0] | f[1] << 1 | f[2] << 2 | f[3] << 3 | f[4] << 4, access, address, value)
+        self.count += 1
+        self.position += 1
+        if self.position == self.length:
+            if self.stream is not None:
+                self.stream.write(self.view)
+            self.position = 0
+
+    def __len__(self):
+        """
+        :return: The number of entries in the buffer.
+        """
+        if self.stream is not None:
+            return self.position
+        return min(self.count, self.length)
+
+    def entries(self):
+        """
+        :return: The entries in the buffer, oldest first (bytes).
+        """
+        end = self.position * entry_format.size
+        if self.stream is not None or self.count < self.length:
+            return bytes(self.view[:end])
+        return bytes(self.view[end:]) + bytes(self.view[:end])
+
+    def flush(self):
+        """
+        Write the entries that are left in the buffer to the stream.
+
+        :return: Nothing
+        """
+        if self.stream is not None:
+            self.stream.write(self.view[:self.position * entry_format.size])
+            self.position = 0
+            self.stream.flush()
+
+    def dump(self, filename):
+        """
+        Write the entries in the buffer to a trace file.
+
+        :param filename: The trace file.
+        :return: Nothing
+        """
+        with open(filename, 'wb') as f:
+            f.write(trace_magic)
+            f.write(self.entries())
+
+
+class TraceFile:
+    """
+    A trace file, read lazily: the file is mapped into memory and an entry is only unpacked when it is accessed.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: The trace file. Raises IOError if it cannot be read and ValueError if it is no trace file.
+        """
+        self.file = open(filename, 'rb')
+        try:
+            if self.file.read(len(trace_magic)) != trace_magic:
+                raise ValueError('not a trace file')
+            size = self.file.seek(0, 2) - len(trace_magic)
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        except (IOError, ValueError):
+            self.file.close()
+            raise
+        self.length = size // entry_format.size
+
+    def __len__(self):
+        """
+        :return: The number of entries.
+        """
+        return self.length
+
+    def __getitem__(self, index):
+        """
+        :param index: Index of an entry.
+        :return: The entry: a tuple (cycle, pc, code, register, register value, flags, access, address, value).
+        """
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('trace entry out of range')
+        return entry_format.unpack_from(self.map, len(trace_magic) + index * entry_format.size)
+
+    def close(self):
+        """
+        Close the file.
+
+        :return: Nothing
+        """
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        """
+        :return: The trace file (closed at the end of the with statement).
+        """
+        return self
+
+    def __exit__(self, *exception):
+        """
+        Close the file at the end of the with statement.
+        """
+        self.close()
+
+
+def trace_info(high_byte, low_byte):
+    """
+    Decode the static trace information of an instruction.
+
+    :param high_byte: The most significant byte of the instruction (opcode and flag, Rd or Rs).
+    :param low_byte: The least significant byte of the instruction (address, literal or Rs).
+    :return: A tuple with the tuple (code, register written, access, memory address) of the trace entry and the \
+             register that holds the memory address of ldrr or strr (None for the other instructions).
+    """
+    word = high_byte << 8 | low_byte
+    decoded = decode_table[high_byte]
+    if decoded is None:
+        return (word, no_register, no_access, 0), None
+    mnemonic, instruction_type = decoded
+    register = high_byte & 7
+    if mnemonic == 'ldr':
+        return (word, register, read_access, low_byte), None
+    if mnemonic == 'str':
+        return (word, no_register, write_access, low_byte), None
+    if mnemonic == 'ldrr':
+        return (word, register, read_access, 0), low_byte >> 5
+    if mnemonic == 'strr':
+        return (word, no_register, write_access, 0), register
+    if instruction_type in ('single_register', 'register_to_register', 'x_to_register') and \
+            mnemonic not in ('push', 'cmpr', 'cmpl'):
+        return (word, register, no_access, 0), None
+    return (word, no_register, no_access, 0), None
+
+
+def format_entry(entry):
+    """
+    Decode a trace entry into text: the clock cycle, the address, the code and the mnemonic of the instruction, and \
+    its effects (register written, flags, memory access).
+
+    :param entry: The entry (see TraceFile.__getitem__(...) ).
+    :return: The text.
+    """
+    cycle, pc, word, register, register_value, flags, access, address, value = entry
+    high_byte, low_byte = word >> 8, word & 0xff
+    decoded = decode_table[high_byte]
+    if decoded is None:
+        text = '; unknown instruction'
+    else:
+        mnemonic, instruction_type = decoded
+        operands = operand_formatters[instruction_type](high_byte, low_byte, {})
+        text = mnemonic + (' ' + operands if operands else '')
+    effects = list()
+    if register != no_register:
+        effects.append('%s=%02X' % (register_names[register].upper(), register_value))
+    if access == read_access:
+        effects.append('[%02X]->%02X' % (address, value))
+    elif access == write_access:
+        effects.append('[%02X]<-%02X' % (address, value))
+    effects.append(''.join(name if flags >> bit & 1 else '-' for bit, name in enumerate(trace_flag_names)))
+    return '%12d  %02X: %04X  %-18s %s' % (cycle, pc, word, text, '  '.join(effects))
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,231 @@
+"""
+VCD (value change dump) export of a simulation of the LDD mark II processor (see ddsim.py, option --vcd), for \
+comparison with the waveforms of an HDL simulation. Only the changes of the selected signals are written, through a \
+buffer, so a long run streams to the file with a fixed amount of memory.
+DDASM = Digital Design Assmebly
+LDD = Lab Digital Design
+Digital Design refers to the Digital Design courses of the Faculty Engineering Technology - KU Leuven, Ghent
+"""
+from ddtrace import trace_flag_names as vcd_flag_names
+
+# Memory-mapped outputs of the lab board that can be written (address -> signal name, see ddsim.output_names)
+vcd_outputs = {0xf0: 'LEDS_L', 0xf1: 'LEDS_H', 0xf8: 'BCD0', 0xf9: 'BCD1', 0xfa: 'BCD2', 0xfb: 'BCD3',
+               0xd0: 'RGB_R', 0xd1: 'RGB_G', 0xd2: 'RGB_B'}
+
+# Groups of signals that can be selected at once
+vcd_signal_groups = {'registers': ['R%d' % code for code in range(8)], 'flags': list(vcd_flag_names),
+                     'leds': ['LEDS_L', 'LEDS_H'], 'bcd': ['BCD0', 'BCD1', 'BCD2', 'BCD3'],
+                     'rgb': ['RGB_R', 'RGB_G', 'RGB_B']}
+
+# Signals that are written by default
+default_vcd_signals = ['PC'] + vcd_signal_groups['registers'] + vcd_signal_groups['flags'] + \
+    vcd_signal_groups['leds'] + vcd_signal_groups['bcd']
+
+# Number of lines that are buffered before they are written to the file
+vcd_buffer_lines = 8192
+
+
+def parse_signals(text):
+    """
+    Convert a command line value to a list of signals.
+
+    :param text: Comma-separated signal names (PC, R0 - R7, Z, C, E, G, S, LEDS_L, LEDS_H, BCD0 - BCD3, RGB_R, RGB_G, \
+                 RGB_B) or groups (registers, flags, leds, bcd, rgb), not case-sensitive.
+    :return: The list of signal names. Raises ValueError if a name is unknown.
+    """
+    known = ['PC'] + vcd_signal_groups['registers'] + vcd_signal_groups['flags'] + list(vcd_outputs.values())
+    signals = list()
+    for name in text.split(','):
+        name = name.strip()
+        group = vcd_signal_groups.get(name.lower())
+        if group is None and name.upper() not in known:
+            raise ValueError('unknown signal "%s"' % name)
+        for signal in group or [name.upper()]:
+            if signal not in signals:
+                signals.append(signal)
+    return signals
+
+
+class VcdWriter:
+    """
+    Writer of a VCD file with the selected signals of a simulation.
+
+    The outputs are written when a Board reports a change (see output_changed(...) ); the program counter, the \
+    registers and the flags are written after every instruction, like a trace (see ddsim.Simulator(..., trace=...) ). \
+    The program counter changes at the start of an instruction, the registers and flags at its end. The time unit is \
+    a picosecond, so every clock cycle takes a whole number of units.
+    """
+
+    def __init__(self, stream, clock_frequency, signals=None, name='ldd'):
+        """
+        :param stream: The text file to which the VCD is written.
+        :param clock_frequency: The clock frequency of the processor (Hz).
+        :param signals: (optional) The names of the signals to write (see parse_signals(...) ); all default signals \
+                        if not specified.
+        :param name: Name of the module in the VCD file.
+        """
+        self.stream = stream
+        self.period = max(int(round(1e12 / clock_frequency)), 1)
+        self.signals = list(default_vcd_signals if signals is None else signals)
+        self.name = name
+        self.buffer = list()
+        self.time = None
+        self.identifiers = {signal: vcd_identifier(index) for index, signal in enumerate(self.signals)}
+        self.widths = {signal: 1 if signal in vcd_flag_names else 8 for signal in self.signals}
+        self.registers = [code for code in range(8) if 'R%d' % code in self.identifiers]
+        self.flags = [code for code, flag in enumerate(vcd_flag_names) if flag in self.identifiers]
+        self.outputs = {address: name for address, name in vcd_outputs.items() if name in self.identifiers}
+        self.last_pc = None
+        self.last_registers = None
+        self.last_flags = None
+        self.simulator = None
+        # static information that a trace provides for every address of the program ROM (see attach(...) )
+        self.costs = list()
+        self.address_registers = list()
+
+    def traces_instructions(self):
+        """
+        :return: True if a signal changes with the instructions (program counter, registers, flags), so the writer \
+                 must be connected to the simulator as a trace; False if only outputs are written.
+        """
+        return 'PC' in self.identifiers or bool(self.registers) or bool(self.flags)
+
+    def attach(self, simulator):
+        """
+        Connect the writer to the state of a simulator (called by the simulator).
+
+        :param simulator: The ddsim.Simulator.
+        :return: Nothing
+        """
+        self.simulator = simulator
+        self.costs = [decoded[3] for decoded in simulator.program]
+        self.address_registers = [None] * len(simulator.program)
+        if 'PC' in self.widths:
+            self.widths['PC'] = max(8, (len(simulator.program) - 1).bit_length())
+
+    def write_header(self, memory):
+        """
+        Write the declarations of the signals and their initial values (time 0).
+
+        :param memory: The data memory at the start of the simulation (initial values of the outputs).
+        :return: Nothing
+        """
+        lines = ['$version DDASM simulator $end\n', '$timescale 1ps $end\n', '$scope module %s $end\n' % self.name]
+        for signal in self.signals:
+            lines.append('$var wire %d %s %s $end\n' % (self.widths[signal], self.identifiers[signal], signal))
+        lines.extend(['$upscope $end\n', '$enddefinitions $end\n', '#0\n', '$dumpvars\n'])
+        for signal in self.signals:
+            value = 0
+            for address, name in self.outputs.items():
+                if name == signal:
+                    value = memory[address]
+            lines.append(self.format_value(signal, value))
+        lines.append('$end\n')
+        self.stream.write(''.join(lines))
+        self.time = 0
+        simulator = self.simulator
+        if simulator is not None:
+            self.last_pc = simulator.pc
+            self.last_registers = list(simulator.registers)
+            self.last_flags = list(simulator.flags)
+
+    def format_value(self, signal, value):
+        """
+        :param signal: The name of a signal.
+        :param value: Its value.
+        :return: The VCD line of the value.
+        """
+        if self.widths[signal] == 1:
+            return '%d%s\n' % (value, self.identifiers[signal])
+        return 'b%s %s\n' % (format(value, 'b'), self.identifiers[signal])
+
+    def change(self, cycle, signal, value):
+        """
+        Write the change of a signal.
+
+        :param cycle: The clock cycle of the change.
+        :param signal: The name of the signal.
+        :param value: The new value.
+        :return: Nothing
+        """
+        if cycle != self.time:
+            self.buffer.append('#%d\n' % (cycle * self.period))
+            self.time = cycle
+        self.buffer.append(self.format_value(signal, value))
+        if len(self.buffer) >= vcd_buffer_lines:
+            self.flush()
+
+    def record(self, pc, cycles, indirect_address):
+        """
+        Write the changes of the program counter, registers and flags of an executed instruction (see \
+        ddtrace.Trace.record(...) for the parameters).
+
+        :return: Nothing
+        """
+        if pc != self.last_pc and 'PC' in self.identifiers:
+            self.change(cycles, 'PC', pc)
+        self.last_pc = pc
+        end = cycles + self.costs[pc]
+        registers = self.simulator.registers
+        if registers != self.last_registers:
+            for code in self.registers:
+                if registers[code] != self.last_registers[code]:
+                    self.change(end, 'R%d' % code, registers[code])
+            self.last_registers[:] = registers
+        flags = self.simulator.flags
+        if flags != self.last_flags:
+            for code in self.flags:
+                if flags[code] != self.last_flags[code]:
+                    self.change(end, vcd_flag_names[code], int(flags[code]))
+            self.last_flags[:] = flags
+
+    def output_changed(self, cycle, address, value):
+        """
+        Write the change of an output (an output listener of ddsim.Board).
+
+        :param cycle: The clock cycle of the change.
+        :param address: The address of the output.
+        :param value: The new value.
+        :return: Nothing
+        """
+        name = self.outputs.get(address)
+        if name is not None:
+            self.change(max(cycle, self.time), name, value)
+
+    def flush(self):
+        """
+        Write the buffered lines to the file.
+
+        :return: Nothing
+        """
+        self.stream.write(''.join(self.buffer))
+        self.buffer.clear()
+
+    def close(self, cycle):
+        """
+        Write the end time of the simulation and the buffered lines.
+
+        :param cycle: The clock cycle at the end of the simulation.
+        :return: Nothing
+        """
+        # the address of the next instruction
+        if self.simulator is not None and self.simulator.pc != self.last_pc and 'PC' in self.identifiers:
+            self.change(cycle, 'PC', self.simulator.pc)
+            self.last_pc = self.simulator.pc
+        if cycle != self.time:
+            self.buffer.append('#%d\n' % (cycle * self.period))
+            self.time = cycle
+        self.flush()
+
+
+def vcd_identifier(index):
+    """
+    :param index: The index of a signal.
+    :return: Its identifier in the VCD file (printable characters from "!" to "~").
+    """
+    identifier = ''
+    while True:
+        identifier += chr(33 + index % 94)
+        index //= 94
+        if not index:
+            return identifier
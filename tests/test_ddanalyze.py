@@ -0,0 +1,42 @@
+"""
+Regression tests of the static analysis of DDASM programs.
+
+USAGE: python -m pytest tests (or python -m unittest discover tests)
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import ddanalyze  # noqa: E402
+import ddasm  # noqa: E402
+
+
+def analyse(text):
+    """
+    :param text: A DDASM program.
+    :return: Its ddanalyze.ProgramAnalysis.
+    """
+    assembler = ddasm.Assembler()
+    pinfo = assembler.analyse_program(text)
+    assembler.resolve_program(pinfo)
+    return ddanalyze.ProgramAnalysis(pinfo, ddasm.text_lines(text))
+
+
+class CallTest(unittest.TestCase):
+
+    def test_call_outside_program(self):
+        # past the end of the program and an odd address
+        for target in ('40', '05'):
+            analysis = analyse('reset:\n\tcall %s\n\tcall sub\nloop:\n\tjump loop\nsub:\n\tretc\n' % target)
+            routine = analysis.routines[0]
+            self.assertEqual(routine['cycles'], ddanalyze.unbounded)
+            self.assertIn('Line 2 calls %s, outside the program.' % target, routine['problems'])
+            self.assertEqual(analysis.routines[6]['cycles'], 4)
+            self.assertIn('4+unbounded', analysis.annotate_source())
+            analysis.format_report()
+
+
+if __name__ == '__main__':
+    unittest.main()
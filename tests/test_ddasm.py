@@ -0,0 +1,115 @@
+"""
+Regression tests of the DDASM assembler.
+
+USAGE: python -m pytest tests (or python -m unittest discover tests)
+"""
+import os
+import sys
+import stat
+import pickle
+import tempfile
+import unittest
+
+package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, package_dir)
+
+import ddasm  # noqa: E402
+
+
+class OptimizeTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(package_dir, 'ROM_template.vhd')) as template_file:
+            self.template = template_file.read()
+
+    def test_invalid_programs(self):
+        # the errors are reported as without --optimize, instead of an exception of the optimizer
+        for text in ('jz', 'movl r0, 01\nmovl', 'cmpl r0, 01\nfoo'):
+            for optimize in (False, True):
+                result = ddasm.Assembler(self.template, optimize=optimize).assemble(text)
+                self.assertFalse(result['success'], text)
+                self.assertTrue(any(line.startswith('ERROR') for line in result['diagnostics']), text)
+
+    def test_valid_program(self):
+        text = 'reset:\n\tjump start\nisr:\n\treti\nstart:\n\tjump next\nnext:\n\tmovl r0, 01\n\tjump start\n'
+        result = ddasm.Assembler(self.template, optimize=True).assemble(text)
+        self.assertTrue(result['success'])
+
+
+class BuildCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        with open(os.path.join(package_dir, 'ROM_template.vhd')) as template_file:
+            self.template = template_file.read()
+        with open(os.path.join(package_dir, 'example.dda')) as program_file:
+            self.source_text = program_file.read()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ddasm.BuildCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assemble(self):
+        return ddasm.Assembler(self.template, cache=self.cache).assemble(self.source_text, 'example.vhd',
+                                                                         'example.dda')
+
+    def test_hit(self):
+        built = self.assemble()
+        cached = self.assemble()
+        self.assertTrue(any('cache hit' in line for line in cached['diagnostics']))
+        self.assertEqual(cached['rom'], built['rom'])
+        self.assertEqual(cached['image'], built['image'])
+        self.assertEqual([line for line in cached['diagnostics'] if 'cache hit' not in line], built['diagnostics'])
+
+    def test_damaged_entry(self):
+        built = self.assemble()
+        key = ddasm.BuildCache.key(self.source_text, self.template, None, ddasm.vhdl_variant('verbose', True, False))
+        entry_file = self.cache.entry_file(key)
+        with open(entry_file, 'rb') as f:
+            data = f.read()
+        # an entry of an old version, a pickle that imports an unknown module and truncated or damaged files
+        for damaged in (pickle.dumps({'key': key}), b'\x80\x04cunknown_module\nname\n.', b'', data[:-3],
+                        data.replace(b'"size"', b'"sise"'), b'\xff\xfe\n' + data):
+            with open(entry_file, 'wb') as f:
+                f.write(damaged)
+            result = self.assemble()
+            self.assertTrue(result['success'])
+            self.assertFalse(any('cache hit' in line for line in result['diagnostics']))
+            self.assertEqual(result['rom'], built['rom'])
+        # the damaged entry is replaced
+        self.assertTrue(any('cache hit' in line for line in self.assemble()['diagnostics']))
+
+
+class WriteIfChangedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'program.vhd')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def mode(self):
+        return stat.S_IMODE(os.stat(self.filename).st_mode)
+
+    @unittest.skipIf(os.name != 'posix', 'POSIX permissions')
+    def test_permissions(self):
+        umask = os.umask(0o027)
+        try:
+            # a new file: the current umask applies
+            self.assertTrue(ddasm.write_if_changed(self.filename, ['first\n']))
+            self.assertEqual(self.mode(), 0o640)
+            # an existing file keeps its permissions
+            os.chmod(self.filename, 0o600)
+            self.assertTrue(ddasm.write_if_changed(self.filename, ['second\n']))
+            self.assertEqual(self.mode(), 0o600)
+            self.assertFalse(ddasm.write_if_changed(self.filename, ['second\n']))
+        finally:
+            os.umask(umask)
+        with open(self.filename) as f:
+            self.assertEqual(f.read(), 'second\n')
+        self.assertEqual(os.listdir(self.directory.name), ['program.vhd'])
+
+
+if __name__ == '__main__':
+    unittest.main()
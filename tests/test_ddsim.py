@@ -0,0 +1,78 @@
+"""
+Regression tests of the DDASM simulator: the translation of basic blocks must give the same results as the \
+interpreter.
+
+USAGE: python -m pytest tests (or python -m unittest discover tests)
+"""
+import os
+import sys
+import unittest
+
+package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, package_dir)
+
+import ddasm  # noqa: E402
+import ddsim  # noqa: E402
+
+# A store to IRQE in the middle of a block requests an interrupt; the ISR reads the zero flag of the andl before it
+interrupt_in_block = '''reset:
+\tjump main
+isr:
+\tjz isr_z
+\tmovl r5, 55
+\treti
+isr_z:
+\tmovl r5, AA
+\treti
+main:
+\tmovl r1, FF
+\tandl r2, 00
+\tstr c0, r1
+\taddl r3, 01
+done:
+\tjump done
+'''
+
+
+def assemble_image(text):
+    """
+    :param text: A DDASM program.
+    :return: The contents of its program ROM.
+    """
+    assembler = ddasm.Assembler()
+    pinfo = assembler.analyse_program(text)
+    with open(os.path.join(package_dir, 'ROM_template.vhd')) as template_file:
+        rom = assembler.analyse_template(template_file.read(), 'test')
+    return assembler.encode_program(pinfo, rom)
+
+
+class TranslateTest(unittest.TestCase):
+
+    def run_modes(self, image, buttons=None, max_cycles=1000):
+        """
+        :return: The registers and flags at the end of the run, with the interpreter and with translated blocks.
+        """
+        states = list()
+        for translate in (False, True):
+            simulator = ddsim.Simulator(image, translate=translate)
+            board = ddsim.Board(simulator)
+            if buttons is not None:
+                board.press_buttons(0, buttons)
+            board.run(max_cycles=max_cycles)
+            states.append((list(simulator.registers), list(simulator.flags)))
+        return states
+
+    def test_interrupt_in_block(self):
+        interpreted, translated = self.run_modes(assemble_image(interrupt_in_block), buttons=1, max_cycles=200)
+        self.assertEqual(interpreted[0][5], 0xaa)
+        self.assertEqual(interpreted, translated)
+
+    def test_example(self):
+        image, _ = ddsim.load_image(os.path.join(package_dir, 'example.dda'),
+                                    os.path.join(package_dir, 'ROM_template.vhd'))
+        interpreted, translated = self.run_modes(image, buttons=4, max_cycles=200000)
+        self.assertEqual(interpreted, translated)
+
+
+if __name__ == '__main__':
+    unittest.main()